@@ -7,6 +7,7 @@ from finlab import data
 import yfinance as yf
 import pandas as pd
 from pandas.core.indexes.datetimes import DatetimeIndex
+from Chapter2.utils.kernels import rank_groups
 
 def finlab_login() -> None:
     """
@@ -332,8 +333,12 @@ def rank_stocks_by_factor(
     # 針對每一天的資料，根據指定的因子欄位進行排名
     # 如果因子與收益正相關，則根據因子值由小到大排名
     # 如果因子與收益負相關，則根據因子值由大到小排名
-    ranked_df[rank_result_column] = ranked_df.groupby(level="datetime")[
-        rank_column].rank(ascending=positive_corr)
+    # 與 groupby(level="datetime")[rank_column].rank(ascending=positive_corr) 結果相同
+    ranked_df[rank_result_column] = rank_groups(
+        ranked_df[rank_column].to_numpy(dtype=float),
+        ranked_df.index,
+        ascending=positive_corr,
+    )
     ranked_df = ranked_df.fillna(0)
     ranked_df.reset_index(inplace=True)
     return ranked_df
@@ -1,10 +1,15 @@
 # 這段程式來自 GitHub 上的 yli188/WorldQuant_alpha101_code 專案
 # 專案網址: https://github.com/yli188/WorldQuant_alpha101_code
+import sys
+
 import numpy as np
 import pandas as pd
 from numpy import abs, log, sign
 from scipy.stats import rankdata
 
+from Chapter2.utils.kernels import rolling_extrema
+from Chapter2.utils.profiler import OperatorProfiler
+
 
 # region Auxiliary functions
 def ts_sum(df, window=10):
@@ -163,7 +168,7 @@ def ts_argmax(df, window=10):
     :param window: the rolling window.
     :return: well.. that :)
     """
-    return df.rolling(window).apply(np.argmax) + 1
+    return rolling_extrema(df, window, "max")[1] + 1
 
 
 def ts_argmin(df, window=10):
@@ -173,7 +178,7 @@ def ts_argmin(df, window=10):
     :param window: the rolling window.
     :return: well.. that :)
     """
-    return df.rolling(window).apply(np.argmin) + 1
+    return rolling_extrema(df, window, "min")[1] + 1
 
 
 def decay_linear(df, period=10):
@@ -207,7 +212,13 @@ def decay_linear(df, period=10):
 # endregion
 
 
-def get_alpha(df):
+def get_alpha(df, profile=False):
+    if profile:
+        # 替换本模块的辅助函数，结束时输出每个 alpha × 运算子的耗时表
+        with OperatorProfiler([sys.modules[__name__]]) as profiler:
+            df = get_alpha(df)
+        print(profiler.breakdown())
+        return df
     stock = Alphas(df)
     df["alpha001"] = stock.alpha001()
     df["alpha002"] = stock.alpha002()
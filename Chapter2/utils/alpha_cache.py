@@ -0,0 +1,171 @@
+# 以輸入資料內容做為索引的 alpha 計算結果快取
+# 快取鍵 = 輸入資料表雜湊 + 類別名稱 + alpha 名稱 + alpha 程式碼版本
+# 資料或程式碼任何一方改變，鍵就會改變，舊結果自然失效
+import hashlib
+import inspect
+import os
+import pickle
+
+import pandas as pd
+
+# 快取格式版本，改變儲存格式時遞增即可讓所有舊快取失效
+CACHE_FORMAT_VERSION = 1
+
+
+def hash_data(df_data):
+    """
+    計算輸入資料表(df_data)的內容雜湊，索引、欄位名稱與數值都會納入計算。
+
+    Args:
+        df_data: 計算因子所需的股票資料表
+    Returns:
+        str: 十六進位的 sha256 雜湊字串
+    """
+    h = hashlib.sha256()
+    h.update(pd.util.hash_pandas_object(df_data, index=True).values.tobytes())
+    h.update(repr(list(df_data.columns)).encode("utf-8"))
+    return h.hexdigest()
+
+
+def _collect_sources(func, seen):
+    # 收集函數本身與它所引用的模組層級函數(例如 Rank、Corr)的原始碼
+    func = inspect.unwrap(getattr(func, "__func__", func))
+    if func in seen or not inspect.isfunction(func):
+        return []
+    seen.add(func)
+    try:
+        sources = [inspect.getsource(func)]
+    except (OSError, TypeError):
+        sources = [func.__qualname__]
+    for name in func.__code__.co_names:
+        ref = func.__globals__.get(name)
+        if inspect.isfunction(ref):
+            sources.extend(_collect_sources(ref, seen))
+    return sources
+
+
+def code_version(func, cls=None):
+    """
+    計算 alpha 方法的程式碼版本。
+    除了方法本身，也會遞迴納入它呼叫到的輔助函數原始碼，
+    所以修改 Rank、Corr 等運算子同樣會讓相關的快取失效。
+    給定 cls 時一併納入類別(含父類別)的 __init__，
+    self.vwap、self.returns 等欄位的算法改變時快取也會失效。
+
+    Args:
+        func: alpha 方法
+        cls: alpha 方法所屬的類別
+    Returns:
+        str: 十六進位的 sha256 雜湊字串
+    """
+    seen = set()
+    sources = _collect_sources(func, seen)
+    for klass in getattr(cls, "__mro__", ()):
+        if "__init__" in vars(klass):
+            sources.extend(_collect_sources(vars(klass)["__init__"], seen))
+    h = hashlib.sha256()
+    for source in sources:
+        h.update(source.encode("utf-8"))
+    return h.hexdigest()
+
+
+class AlphaCache(object):
+    """
+    alpha 計算結果的磁碟快取，超過容量上限時依最久未使用的順序淘汰。
+
+    Args:
+        cache_dir: 快取檔案存放的資料夾
+        max_bytes: 快取總容量上限(位元組)
+    """
+
+    def __init__(self, cache_dir="alpha_cache", max_bytes=2 * 1024**3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    @staticmethod
+    def make_key(data_hash, cls_name, alpha_name, version):
+        raw = f"{CACHE_FORMAT_VERSION}|{data_hash}|{cls_name}|{alpha_name}|{version}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def key_for(self, data_hash, cls, alpha_name):
+        """
+        根據資料雜湊、類別與 alpha 名稱計算快取鍵。
+        """
+        func = getattr(cls, alpha_name)
+        return self.make_key(
+            data_hash, cls.__name__, alpha_name, code_version(func, cls)
+        )
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.pkl")
+
+    def get(self, key):
+        """
+        讀取快取結果，不存在時回傳 None。命中時會更新檔案時間供淘汰順序使用。
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                result = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        os.utime(path, None)
+        return result
+
+    def put(self, key, result):
+        """
+        寫入快取結果，寫入後檢查容量並淘汰最久未使用的檔案。
+        """
+        path = self._path(key)
+        # 先寫入暫存檔再改名，避免多個行程同時寫入時讀到不完整的檔案
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        """
+        快取總容量超過 max_bytes 時，從最久未使用的檔案開始刪除。
+        """
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".pkl"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+    def get_or_compute(self, stock, alpha_name, data_hash):
+        """
+        先查詢快取，沒有命中才實際計算 alpha 並寫入快取。
+
+        Args:
+            stock: 已實例化的因子計算物件，例如 Alphas191(df_data)
+            alpha_name: alpha 方法名稱
+            data_hash: hash_data(df_data) 的結果
+        Returns:
+            alpha 計算結果
+        """
+        key = self.key_for(data_hash, type(stock), alpha_name)
+        result = self.get(key)
+        if result is None:
+            result = getattr(stock, alpha_name)()
+            self.put(key, result)
+        return result
@@ -2,38 +2,108 @@
 # 專案網址: https://github.com/popbo/alphas
 # from datas import *
 import os
+import sys
 import time
 import traceback
+from contextlib import nullcontext
 from multiprocessing import Pool
 
 import pandas as pd
 
+from Chapter2.utils.alpha_cache import hash_data
+from Chapter2.utils.chunked import check_exact, compute_chunked, lookback_groups
+from Chapter2.utils.lookback import get_lookback, max_lookback, warmup_start
+from Chapter2.utils.profiler import OperatorProfiler
+
 
 class Alphas(object):
     def __init__(self, df_data):
         pass
 
     @classmethod
-    def calc_alpha(cls, path, func, data):
+    def operator_profiler(cls):
+        # 只替换定义因子类的模块中的运算子
+        return OperatorProfiler([sys.modules[cls.__module__]])
+
+    @classmethod
+    def profiling(cls, profile):
+        # 未开启分析时不替换任何函数，没有额外开销
+        return cls.operator_profiler() if profile else nullcontext()
+
+    @classmethod
+    def compute_alpha(cls, func, data, cache=None, data_hash=None):
+        if cache is None:
+            return func(data)
+        # 输入数据与因子代码都没有变化时直接读取缓存结果
+        key = cache.key_for(data_hash, cls, func.__name__)
+        res = cache.get(key)
+        if res is None:
+            res = func(data)
+            cache.put(key, res)
+        return res
+
+    @classmethod
+    def calc_alpha(cls, path, func, data, cache=None, data_hash=None, profile=False):
+        profiler = None
         try:
             t1 = time.time()
-            res = func(data)
+            with cls.profiling(profile) as profiler:
+                res = cls.compute_alpha(func, data, cache, data_hash)
             res.to_csv(path)
             t2 = time.time()
             print(f"Factory {os.path.splitext(os.path.basename(path))[0]} time {t2-t1}")
         except Exception as e:
             print(f"generate {path} error!!!")
             # traceback.print_exc()
+        # 子进程中的分析记录回传给主进程汇总
+        return profiler.records if profiler is not None else None
+
+    @classmethod
+    def calc_alpha_years(
+        cls, root, func, data, years, cache=None, data_hash=None, profile=False
+    ):
+        # 一次计算整段区间的因子，再按年份拆分保存到 {root}/{year}/{name}.csv
+        name = func.__name__
+        profiler = None
+        try:
+            t1 = time.time()
+            with cls.profiling(profile) as profiler:
+                res = cls.compute_alpha(func, data, cache, data_hash)
+            res_years = res.index.astype(str).str[:4]
+            for year in years:
+                res[res_years == str(year)].to_csv(f"{root}/{year}/{name}.csv")
+            t2 = time.time()
+            print(f"Factory {name} time {t2-t1}")
+        except Exception as e:
+            print(f"generate {root}/{name} error!!!")
+            # traceback.print_exc()
+        return profiler.records if profiler is not None else None
 
     @classmethod
-    def get_stocks_data(cls, year, list_assets, benchmark):
+    def get_stocks_data(cls, year, list_assets, benchmark, lookback=None):
         # list_assets,df_asserts = get_zz500_stocks(f'{year}-01-01')
         yer = int(year)
-        start_time = f"{yer-1}-01-01"
-        end_time = f"{yer+1}-01-01"
+        if lookback is None:
+            # 未指定回看长度时沿用 year-1 ~ year+1 的数据范围
+            return cls.get_stocks_data_range(
+                f"{yer-1}-01-01", f"{yer+1}-01-01", list_assets, benchmark
+            )
+        # 指定回看长度时只在 year 之前多载入 lookback 个交易日做为暖机数据
+        return cls.get_stocks_data_range(
+            f"{yer}-01-01", f"{yer+1}-01-01", list_assets, benchmark, warmup=lookback
+        )
 
+    @classmethod
+    def get_stocks_data_range(
+        cls, start_time, end_time, list_assets, benchmark, warmup=0
+    ):
         index_path = "index"
         df = pd.read_csv(f"{index_path}/{benchmark}.csv")
+        if warmup:
+            # 以指数的交易日历为准，往前推 warmup 个交易日做为载入起点
+            start_time = warmup_start(
+                df["date"][df["date"] <= end_time].values, start_time, warmup
+            )
         bm_data = df[(df["date"] >= start_time) & (df["date"] <= end_time)]
 
         # 修改列名
@@ -56,9 +126,6 @@ class Alphas(object):
             df = pd.read_csv(f"{data_path}/{c}.csv")
             df["asset"] = c
             df = df[(df["日期"] >= start_time) & (df["日期"] <= end_time)]
-            df = df.merge(
-                bm_data, how="outer", left_on="日期", right_on="benchmark_date"
-            )
             list_all.append(df)
 
         print(len(list_all))
@@ -99,13 +166,22 @@ class Alphas(object):
                 "vwap",
                 "pctChg",
                 "turnover",
-                "benchmark_open",
-                "benchmark_close",
             ]
         ]
         # ddu = df_all[df_all.duplicated()]
         df_all = df_all[df_all["asset"].notnull()]
-        return df_all.pivot(index="date", columns="asset")
+        df_all = df_all.pivot(index="date", columns="asset")
+
+        # 指数数据只保存一份，不再复制到每只股票，列名为 (benchmark_open, "")
+        bm_data = bm_data.set_index("benchmark_date")[
+            ["benchmark_open", "benchmark_close"]
+        ]
+        bm_data.columns = pd.MultiIndex.from_tuples(
+            [(c, "") for c in bm_data.columns], names=df_all.columns.names
+        )
+        # 日期以股票数据为准: 原本逐只股票 outer merge 后，只有指数有的日期 asset 为空，
+        # 会被上面的 asset.notnull() 过滤掉，所以这里用 left join 得到相同的日期
+        return df_all.join(bm_data, how="left")
 
     @classmethod
     def get_benchmark(cls, year, code):
@@ -126,22 +202,49 @@ class Alphas(object):
             )
         )
 
+    @classmethod
+    def select_alpha_methods(cls, methods=None):
+        # 未指定时计算所有因子；指定时(例如去冗余后的保留列表)只计算列表中的因子
+        all_methods = cls.get_alpha_methods(cls)
+        if methods is None:
+            return all_methods
+        unknown = [m for m in methods if m not in all_methods]
+        if unknown:
+            raise ValueError(f"{cls.__name__} 没有以下因子: {unknown}")
+        return [m for m in all_methods if m in set(methods)]
+
     @classmethod
     def generate_alpha_single(
-        cls, alpha_name, year, list_assets, benchmark, need_save=False
+        cls,
+        alpha_name,
+        year,
+        list_assets,
+        benchmark,
+        need_save=False,
+        cache=None,
+        auto_warmup=True,
+        profile=False,
     ):
+        factor = getattr(cls, alpha_name, None)
+        if factor is None:
+            print("alpha name is error!!!")
+            return None
+
+        # 只载入这个因子需要的暖机数据
+        lookback = get_lookback(cls, alpha_name) if auto_warmup else None
         # 获取计算因子所需股票数据
-        stock_data = cls.get_stocks_data(year, list_assets, benchmark)
+        stock_data = cls.get_stocks_data(year, list_assets, benchmark, lookback)
 
         # 实例化因子计算的对象
         stock = cls(stock_data)
 
-        factor = getattr(cls, alpha_name)
-        if factor is None:
-            print("alpha name is error!!!")
-            return None
-
-        alpha_data = factor(stock)
+        data_hash = hash_data(stock_data) if cache is not None else None
+        with cls.profiling(profile) as profiler:
+            alpha_data = cls.compute_alpha(factor, stock, cache, data_hash)
+        if profiler is not None:
+            print(profiler.breakdown())
+        if auto_warmup:
+            alpha_data = alpha_data[alpha_data.index >= f"{int(year)}-01-01"]
 
         if need_save:
             path = f"alphas/{cls.__name__}/{year}"
@@ -152,10 +255,27 @@ class Alphas(object):
         return alpha_data
 
     @classmethod
-    def generate_alphas(cls, year, list_assets, benchmark):
+    def generate_alphas(
+        cls,
+        year,
+        list_assets,
+        benchmark,
+        cache=None,
+        auto_warmup=True,
+        profile=False,
+        methods=None,
+    ):
+        if auto_warmup:
+            # 单一年份即为只含一年的连续区间
+            return cls.generate_alphas_range(
+                year, year, list_assets, benchmark, cache, profile, methods
+            )
+
         t1 = time.time()
         # 获取计算因子所需股票数据
         stock_data = cls.get_stocks_data(year, list_assets, benchmark)
+        # 输入数据的哈希只需计算一次，供所有因子的缓存键共用
+        data_hash = hash_data(stock_data) if cache is not None else None
 
         # 实例化因子计算的对象
         stock = cls(stock_data)
@@ -171,18 +291,130 @@ class Alphas(object):
         count = os.cpu_count()
         pool = Pool(count)
 
-        # 获取所有因子计算的方法
-        methods = cls.get_alpha_methods(cls)
+        # 获取需要计算的因子方法
+        methods = cls.select_alpha_methods(methods)
 
         # 在线程池中计算所有alpha
+        tasks = []
         for m in methods:
             factor = getattr(cls, m)
             try:
-                pool.apply_async(cls.calc_alpha, (f"{path}/{m}.csv", factor, stock))
+                tasks.append(
+                    pool.apply_async(
+                        cls.calc_alpha,
+                        (f"{path}/{m}.csv", factor, stock, cache, data_hash, profile),
+                    )
+                )
             except Exception as e:
                 traceback.print_exc()
 
         pool.close()
         pool.join()
         t2 = time.time()
-        print(f"Total time {t2-t1}")
\ No newline at end of file
+        print(f"Total time {t2-t1}")
+        return cls.collect_profile(tasks) if profile else None
+
+    @classmethod
+    def generate_alphas_range(
+        cls,
+        start_year,
+        end_year,
+        list_assets,
+        benchmark,
+        cache=None,
+        profile=False,
+        methods=None,
+    ):
+        t1 = time.time()
+        # 获取需要计算的因子方法
+        methods = cls.select_alpha_methods(methods)
+        years = [str(y) for y in range(int(start_year), int(end_year) + 1)]
+
+        # 整段区间只载入一次数据，载入的暖机数据量取所有因子中最大的回看长度
+        lookback = max_lookback(cls, methods)
+        stock_data = cls.get_stocks_data_range(
+            f"{years[0]}-01-01",
+            f"{int(years[-1]) + 1}-01-01",
+            list_assets,
+            benchmark,
+            warmup=lookback,
+        )
+        # 按回看长度分组，每组只用自己需要的暖机数据计算，
+        # 回看长度很长的因子(例如以 SMA_WARMUP_TOL 估算的 Sma)不会拖慢其他因子
+        groups = lookback_groups(cls, stock_data, f"{years[0]}-01-01", methods)
+
+        # 因子计算结果仍按年份保存在 alphas/{cls}/{year} 下
+        root = f"alphas/{cls.__name__}"
+        for year in years:
+            if not os.path.isdir(f"{root}/{year}"):
+                os.makedirs(f"{root}/{year}")
+
+        # 创建线程池
+        count = os.cpu_count()
+        pool = Pool(count)
+
+        # 在线程池中计算所有alpha，每个alpha只计算一次
+        tasks = []
+        for data, names in groups:
+            # 同一组的因子共用计算对象与输入数据的哈希(缓存键)
+            data_hash = hash_data(data) if cache is not None else None
+            stock = cls(data)
+            for m in names:
+                factor = getattr(cls, m)
+                try:
+                    tasks.append(
+                        pool.apply_async(
+                            cls.calc_alpha_years,
+                            (root, factor, stock, years, cache, data_hash, profile),
+                        )
+                    )
+                except Exception as e:
+                    traceback.print_exc()
+
+        pool.close()
+        pool.join()
+        t2 = time.time()
+        print(f"Total time {t2-t1}")
+        return cls.collect_profile(tasks) if profile else None
+
+    @classmethod
+    def generate_alphas_chunked(
+        cls,
+        start_time,
+        end_time,
+        list_assets,
+        benchmark,
+        chunk_size=250,
+        processes=None,
+        methods=None,
+    ):
+        t1 = time.time()
+        # 分段载入数据，内存用量只与 chunk_size 有关
+        exact, inexact = check_exact(cls, cls.select_alpha_methods(methods))
+        if inexact:
+            print(f"skip inexact alphas: {inexact}")
+        path = f"alphas/{cls.__name__}/{start_time}_{end_time}"
+        compute_chunked(
+            cls,
+            start_time,
+            end_time,
+            list_assets,
+            benchmark,
+            exact,
+            chunk_size=chunk_size,
+            processes=processes,
+            out_dir=path,
+        )
+        t2 = time.time()
+        print(f"Total time {t2-t1}")
+
+    @classmethod
+    def collect_profile(cls, tasks):
+        # 汇总各子进程的运算子分析记录，并输出 alpha × 运算子 的耗时表
+        profiler = cls.operator_profiler()
+        for task in tasks:
+            records = task.get()
+            if records:
+                profiler.merge(records)
+        print(profiler.breakdown())
+        return profiler
@@ -13,6 +13,7 @@ if current_dir not in sys.path:
 
 
 from Chapter2.utils.alphas import Alphas
+from Chapter2.utils.kernels import ewm_mean, rank_rows, rolling_extrema
 
 # from datas import *
 
@@ -23,8 +24,8 @@ def Log(sr):
 
 
 def Rank(sr):
-    # 列-升序排序并转化成百分比
-    return sr.rank(axis=1, method="min", pct=True)
+    # 列-升序排序并转化成百分比，与 sr.rank(axis=1, method="min", pct=True) 结果相同
+    return rank_rows(sr, method="min", pct=True)
 
 
 def Delta(sr, period):
@@ -107,9 +108,10 @@ def Rowmin(sr):
     return sr.min(axis=1)
 
 
-def Sma(sr, n, m):
-    # sma均值
-    return sr.ewm(alpha=m / n, adjust=False).mean()
+def Sma(sr, n, m, times=1):
+    # sma均值，与 ewm(alpha=m/n, adjust=False).mean() 结果相同
+    # times>1 时为连续套用 times 次，例如 SMA(SMA(X,3,1),3,1)
+    return ewm_mean(sr, [m / n] * times)
 
 
 def Abs(sr):
@@ -134,11 +136,13 @@ def Decaylinear(sr, window):
 
 
 def Lowday(sr, window):
-    return sr.rolling(window).apply(lambda x: len(x) - x.values.argmin())
+    # 最小值距今的天数(最小值在窗口最后一天时为 1)
+    return window - rolling_extrema(sr, window, "min")[1]
 
 
 def Highday(sr, window):
-    return sr.rolling(window).apply(lambda x: len(x) - x.values.argmax())
+    # 最大值距今的天数(最大值在窗口最后一天时为 1)
+    return window - rolling_extrema(sr, window, "max")[1]
 
 
 def Wma(sr, window):
@@ -162,6 +166,14 @@ def Returns(df):
     return df.rolling(2).apply(lambda x: x.iloc[-1] / x.iloc[0]) - 1
 
 
+def Benchmark(df_data, name):
+    # 指数数据只保留一条 1-D 序列，与个股面板运算时再用 sub/div(axis=0) 按日期广播
+    bm = df_data[name]
+    if bm.ndim == 2:
+        bm = bm.iloc[:, 0]
+    return bm
+
+
 class Alphas191(Alphas):
     def __init__(self, df_data):
         self.open = df_data[["open"]]  # 开盘价
@@ -175,8 +187,8 @@ class Alphas191(Alphas):
             (self.open + self.high + self.low + self.close) / 4
         ) * self.volume
         self.vwap = self.amount / self.volume
-        self.benchmark_open = df_data[["benchmark_open"]]  # 指数开盘价series
-        self.benchmark_close = df_data[["benchmark_close"]]  # 指数收盘价series
+        self.benchmark_open = Benchmark(df_data, "benchmark_open")  # 指数开盘价series
+        self.benchmark_close = Benchmark(df_data, "benchmark_close")  # 指数收盘价series
 
     def alpha001(self):  # 平均1751个数据
         ##### (-1 * CORR(RANK(DELTA(LOG(VOLUME), 1)), RANK(((CLOSE - OPEN) / OPEN)), 6))####
@@ -1021,15 +1033,12 @@ class Alphas191(Alphas):
     def alpha096(self):  # 1736
         ####SMA(SMA((CLOSE-TSMIN(LOW,9))/(TSMAX(HIGH,9)-TSMIN(LOW,9))*100,3,1),3,1)###
         return Sma(
-            Sma(
-                (self.close - Tsmin(self.low, 9))
-                / (Tsmax(self.high, 9) - Tsmin(self.low, 9))
-                * 100,
-                3,
-                1,
-            ),
+            (self.close - Tsmin(self.low, 9))
+            / (Tsmax(self.high, 9) - Tsmin(self.low, 9))
+            * 100,
             3,
             1,
+            times=2,
         )
 
     def alpha097(self):  # 1729
@@ -1724,14 +1733,14 @@ class Alphas191(Alphas):
 
     def alpha181(self):  # 1532  公式有问题，假设后面的sum周期为20
         ####SUM(((CLOSE/DELAY(CLOSE,1)-1)-MEAN((CLOSE/DELAY(CLOSE,1)-1),20))-(BANCHMARKINDEXCLOSE-MEAN(BANCHMARKINDEXCLOSE,20))^2,20)/SUM((BANCHMARKINDEXCLOSE-MEAN(BANCHMARKINDEXCLOSE,20))^3)###
+        # 指数部分只在 1-D 序列上计算，最后才按日期广播到所有股票
         return Sum(
             (
                 (self.close / Delay(self.close, 1) - 1)
                 - Mean((self.close / Delay(self.close, 1) - 1), 20)
-            )
-            - (self.benchmark_close - Mean(self.benchmark_close, 20)) ** 2,
+            ).sub((self.benchmark_close - Mean(self.benchmark_close, 20)) ** 2, axis=0),
             20,
-        ) / Sum(((self.benchmark_close - Mean(self.benchmark_close, 20)) ** 3), 20)
+        ).div(Sum(((self.benchmark_close - Mean(self.benchmark_close, 20)) ** 3), 20), axis=0)
 
     def alpha183(self):
         ###MAX(SUMAC(CLOSE-MEAN(CLOSE,24)))-MIN(SUMAC(CLOSE-MEAN(CLOSE,24)))/STD(CLOSE,24)###
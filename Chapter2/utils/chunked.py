@@ -0,0 +1,183 @@
+# 分段(out-of-core)計算 alpha
+# 把時間軸切成固定長度的區段，每段往前多帶回看長度(lookback)的資料做為暖機(halo)，
+# 各段獨立載入、計算、裁掉暖機後依序寫出，記憶體用量只與區段長度有關，與總歷史長度無關。
+# 只接受回看長度精確的 alpha，拼接結果與一次載入全部資料的計算完全相同
+import os
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+
+from Chapter2.utils.lookback import get_lookback, is_exact
+
+
+def time_chunks(trading_dates, start_time, end_time, chunk_size):
+    """
+    依交易日曆把 [start_time, end_time] 切成每段 chunk_size 個交易日的區段。
+
+    Returns:
+        List[Tuple]: 每段的(第一個交易日, 最後一個交易日)
+    """
+    dates = np.sort(np.asarray(trading_dates))
+    dates = dates[(dates >= start_time) & (dates <= end_time)]
+    return [
+        (dates[i], dates[min(i + chunk_size, len(dates)) - 1])
+        for i in range(0, len(dates), chunk_size)
+    ]
+
+
+def check_exact(cls, methods):
+    """
+    檢查 alpha 是否都能以有限暖機精確重現，回傳(可分段計算的, 不可分段計算的)。
+    """
+    exact = [m for m in methods if is_exact(cls, m)]
+    inexact = [m for m in methods if not is_exact(cls, m)]
+    return exact, inexact
+
+
+def lookback_groups(cls, stock_data, first, methods):
+    """
+    依回看長度把 alpha 分組，每組只帶自己回看長度的暖機資料。
+
+    Args:
+        cls: 因子計算類別
+        stock_data: 含暖機區間的股票資料表
+        first: 輸出的第一個日期
+        methods: alpha 方法名稱列表
+    Returns:
+        List[Tuple]: 每組的(資料表切片, alpha 方法名稱列表)
+    """
+    start = int(np.searchsorted(stock_data.index.values, first))
+    groups = {}
+    for m in methods:
+        groups.setdefault(get_lookback(cls, m), []).append(m)
+    return [
+        (stock_data.iloc[max(start - lookback, 0) :], names)
+        for lookback, names in groups.items()
+    ]
+
+
+def _compute(cls, stock_data, first, methods):
+    # 每個 alpha 只帶自己回看長度的暖機資料，回看長度相同的 alpha 共用同一個計算物件
+    results = {}
+    for data, names in lookback_groups(cls, stock_data, first, methods):
+        stock = cls(data)
+        for m in names:
+            res = getattr(stock, m)()
+            # 裁掉暖機區間，只保留這一段自己的日期
+            results[m] = res[res.index >= first]
+    return results
+
+
+def _compute_chunk(args):
+    cls, first, last, list_assets, benchmark, methods, lookback = args
+    stock_data = cls.get_stocks_data_range(
+        first, last, list_assets, benchmark, warmup=lookback
+    )
+    return _compute(cls, stock_data, first, methods)
+
+
+def _compute_panel_chunk(args):
+    cls, stock_data, first, methods = args
+    return _compute(cls, stock_data, first, methods)
+
+
+def _run(func, tasks, processes):
+    # 依區段順序逐一產出結果；平行時最多同時持有 processes 個區段
+    if processes is None or processes <= 1:
+        for task in tasks:
+            yield func(task)
+        return
+    with Pool(processes) as pool:
+        yield from pool.imap(func, tasks)
+
+
+def _stitch(chunks, methods, paths=None):
+    # 拼接各段結果；指定 paths 時逐段附加寫入 CSV，不在記憶體中保留完整結果
+    columns = {}
+    parts = {m: [] for m in methods}
+    for i, results in enumerate(chunks):
+        for m in methods:
+            res = results[m]
+            if m not in columns:
+                columns[m] = res.columns
+            elif not res.columns.equals(columns[m]):
+                if len(res.columns.difference(columns[m])):
+                    raise ValueError(f"{m} 第 {i + 1} 段出現第一段沒有的欄位")
+                res = res.reindex(columns=columns[m])
+            if paths is None:
+                parts[m].append(res)
+            else:
+                res.to_csv(paths[m], mode="w" if i == 0 else "a", header=i == 0)
+    if paths is not None:
+        return paths
+    return {m: pd.concat(parts[m]) for m in methods if parts[m]}
+
+
+def compute_chunked(
+    cls,
+    start_time,
+    end_time,
+    list_assets,
+    benchmark,
+    methods,
+    chunk_size=250,
+    processes=None,
+    out_dir=None,
+):
+    """
+    從本地資料分段載入並計算 alpha。
+
+    Args:
+        cls: 因子計算類別，例如 Alphas191
+        start_time, end_time: 輸出的日期區間(含頭尾)
+        list_assets: 股票代號列表
+        benchmark: 指數代號
+        methods: alpha 方法名稱列表
+        chunk_size: 每段的交易日數
+        processes: 平行計算的行程數，None 或 1 表示依序計算
+        out_dir: 指定時把結果逐段寫入 {out_dir}/{alpha}.csv，回傳檔案路徑
+    Returns:
+        dict: alpha 名稱 -> 拼接後的結果(或 CSV 路徑)
+    """
+    exact, inexact = check_exact(cls, methods)
+    if inexact:
+        raise ValueError(f"以下 alpha 無法以有限暖機精確分段計算: {inexact}")
+    lookback = max((get_lookback(cls, m) for m in exact), default=0)
+    dates = pd.read_csv(f"index/{benchmark}.csv")["date"].values
+    tasks = [
+        (cls, first, last, list_assets, benchmark, exact, lookback)
+        for first, last in time_chunks(dates, start_time, end_time, chunk_size)
+    ]
+    paths = None
+    if out_dir is not None:
+        if not os.path.isdir(out_dir):
+            os.makedirs(out_dir)
+        paths = {m: f"{out_dir}/{m}.csv" for m in exact}
+    return _stitch(_run(_compute_chunk, tasks, processes), exact, paths)
+
+
+def compute_chunked_panel(cls, stock_data, methods, chunk_size=250, processes=None):
+    """
+    對已載入的股票資料表分段計算 alpha。輸入仍在記憶體中，
+    但各運算子產生的中間資料表只有區段大小。
+
+    Args:
+        cls: 因子計算類別
+        stock_data: get_stocks_data_range 回傳的資料表
+        methods: alpha 方法名稱列表
+        chunk_size: 每段的列數
+        processes: 平行計算的行程數
+    Returns:
+        dict: alpha 名稱 -> 拼接後的結果
+    """
+    exact, inexact = check_exact(cls, methods)
+    if inexact:
+        raise ValueError(f"以下 alpha 無法以有限暖機精確分段計算: {inexact}")
+    lookback = max((get_lookback(cls, m) for m in exact), default=0)
+    tasks = []
+    for i in range(0, len(stock_data), chunk_size):
+        halo = max(i - lookback, 0)
+        chunk = stock_data.iloc[halo : i + chunk_size]
+        tasks.append((cls, chunk, stock_data.index[i], exact))
+    return _stitch(_run(_compute_panel_chunk, tasks, processes), exact)
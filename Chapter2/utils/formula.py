@@ -0,0 +1,649 @@
+# Alpha191 / Alpha101 公式字串編譯器
+# 把 "(-1 * CORR(RANK(DELTA(LOG(VOLUME), 1)), RANK(((CLOSE - OPEN) / OPEN)), 6))"
+# 這類公式解析成運算圖，做常數折疊，並在一批公式之間合併相同的子運算式，
+# 最後依拓樸順序呼叫 alphas191.py 的運算子計算，不需要再手動翻譯成 pandas 程式碼
+import inspect
+import re
+
+import numpy as np
+import pandas as pd
+
+import Chapter2.utils.alphas191 as ops191
+import Chapter2.utils.Alpha_code_1 as ops101
+
+
+class FormulaError(ValueError):
+    pass
+
+
+# 公式中的變數 -> Alphas191 / Alpha_code_1 物件上的屬性名稱
+VARIABLES = {
+    "OPEN": "open",
+    "HIGH": "high",
+    "LOW": "low",
+    "CLOSE": "close",
+    "VOLUME": "volume",
+    "VWAP": "vwap",
+    "AMOUNT": "amount",
+    "RET": "returns",
+    "RETURNS": "returns",
+    "BANCHMARKINDEXOPEN": "benchmark_open",
+    "BANCHMARKINDEXCLOSE": "benchmark_close",
+    "BENCHMARKINDEXOPEN": "benchmark_open",
+    "BENCHMARKINDEXCLOSE": "benchmark_close",
+}
+
+# Alpha101 的函數別名
+ALIASES = {
+    "CORRELATION": "CORR",
+    "COVARIANCE": "COV",
+    "STDDEV": "STD",
+    "TS_SUM": "SUM",
+    "PRODUCT": "PROD",
+    "TS_RANK": "TSRANK",
+    "TS_MAX": "TSMAX",
+    "TS_MIN": "TSMIN",
+    "DECAY_LINEAR": "DECAYLINEAR",
+}
+
+
+def _signed_power(x, e):
+    return np.sign(x) * np.abs(x) ** e
+
+
+def _sumif(x, window, cond):
+    # alphas191.Sumif 會直接修改輸入，這裡先複製以免破壞共用的子運算式結果
+    return ops191.Sumif(x.copy(), window, cond)
+
+
+def _scale(x, k=1):
+    return ops101.scale(x, k)
+
+
+# 函數名稱 -> (運算子, 參數個數, 需要是整數窗口的參數位置)
+# 運算子在呼叫時才從模組取出，效能分析工具替換運算子後同樣能記錄到
+FUNCTIONS = {
+    "RANK": (lambda: ops191.Rank, 1, ()),
+    "LOG": (lambda: ops191.Log, 1, ()),
+    "ABS": (lambda: ops191.Abs, 1, ()),
+    "SIGN": (lambda: ops191.Sign, 1, ()),
+    "DELTA": (lambda: ops191.Delta, 2, (1,)),
+    "DELAY": (lambda: ops191.Delay, 2, (1,)),
+    "CORR": (lambda: ops191.Corr, 3, (2,)),
+    "COV": (lambda: ops191.Cov, 3, (2,)),
+    "SUM": (lambda: ops191.Sum, 2, (1,)),
+    "PROD": (lambda: ops191.Prod, 2, (1,)),
+    "MEAN": (lambda: ops191.Mean, 2, (1,)),
+    "STD": (lambda: ops191.Std, 2, (1,)),
+    "TSRANK": (lambda: ops191.Tsrank, 2, (1,)),
+    "TSMAX": (lambda: ops191.Tsmax, 2, (1,)),
+    "TSMIN": (lambda: ops191.Tsmin, 2, (1,)),
+    "SMA": (lambda: ops191.Sma, 3, ()),
+    "WMA": (lambda: ops191.Wma, 2, (1,)),
+    "DECAYLINEAR": (lambda: ops191.Decaylinear, 2, (1,)),
+    "LOWDAY": (lambda: ops191.Lowday, 2, (1,)),
+    "HIGHDAY": (lambda: ops191.Highday, 2, (1,)),
+    "COUNT": (lambda: ops191.Count, 2, (1,)),
+    "SUMIF": (lambda: _sumif, 3, (1,)),
+    "REGBETA": (lambda: ops191.Regbeta, 2, ()),
+    "TS_ARGMAX": (lambda: ops101.ts_argmax, 2, (1,)),
+    "TS_ARGMIN": (lambda: ops101.ts_argmin, 2, (1,)),
+    "SCALE": (lambda: _scale, 2, ()),
+    "SIGNEDPOWER": (lambda: _signed_power, 2, ()),
+    "ELEMMAX": (lambda: ops191.Max, 2, ()),
+    "ELEMMIN": (lambda: ops191.Min, 2, ()),
+}
+
+# 單一股票(pd.Series)時改用 Alpha_code_1 的版本: rank 為時間序列上的百分位排名，
+# alphas191 的 Corr 以二維索引把起始窗口設為空值，不適用於 Series
+SERIES_FUNCTIONS = {
+    "RANK": lambda: ops101.rank,
+    "CORR": lambda: ops101.correlation,
+    "COV": lambda: ops101.covariance,
+}
+
+# 逐元素運算，參數可以是資料表或純量(常數折疊時直接對純量計算)
+ELEMENTWISE = {
+    "add": lambda a, b: _binary("add", a, b),
+    "sub": lambda a, b: _binary("sub", a, b),
+    "mul": lambda a, b: _binary("mul", a, b),
+    "div": lambda a, b: _binary("truediv", a, b),
+    "pow": lambda a, b: _binary("pow", a, b),
+    "lt": lambda a, b: _binary("lt", a, b),
+    "gt": lambda a, b: _binary("gt", a, b),
+    "le": lambda a, b: _binary("le", a, b),
+    "ge": lambda a, b: _binary("ge", a, b),
+    "eq": lambda a, b: _binary("eq", a, b),
+    "ne": lambda a, b: _binary("ne", a, b),
+    "and": lambda a, b: _truth(a) & _truth(b),
+    "or": lambda a, b: _truth(a) | _truth(b),
+    "neg": lambda a: -a,
+}
+
+_PY_OPS = {
+    "add": lambda a, b: a + b,
+    "sub": lambda a, b: a - b,
+    "mul": lambda a, b: a * b,
+    "truediv": lambda a, b: a / b,
+    "pow": lambda a, b: a**b,
+    "lt": lambda a, b: a < b,
+    "gt": lambda a, b: a > b,
+    "le": lambda a, b: a <= b,
+    "ge": lambda a, b: a >= b,
+    "eq": lambda a, b: a == b,
+    "ne": lambda a, b: a != b,
+}
+
+
+def _binary(name, a, b):
+    # 1-D 的指數序列與個股面板運算時按日期廣播(axis=0)，其餘情況交給一般運算子
+    if isinstance(a, pd.Series) and isinstance(b, pd.DataFrame):
+        if name in _REFLECTED:
+            return getattr(b, _REFLECTED[name])(a, axis=0)
+    elif isinstance(a, pd.DataFrame) and isinstance(b, pd.Series):
+        return getattr(a, name)(b, axis=0)
+    return _PY_OPS[name](a, b)
+
+
+# a op b 等於 b op' a
+_REFLECTED = {
+    "add": "radd",
+    "sub": "rsub",
+    "mul": "rmul",
+    "truediv": "rtruediv",
+    "pow": "rpow",
+    "lt": "gt",
+    "gt": "lt",
+    "le": "ge",
+    "ge": "le",
+    "eq": "eq",
+    "ne": "ne",
+}
+
+
+def _truth(x):
+    if isinstance(x, (pd.DataFrame, pd.Series)):
+        # 比較運算的結果(bool)與數值條件都以非零為真，缺值視為假
+        return x.fillna(0) != 0
+    return bool(x)
+
+
+def _where(cond, a, b):
+    # COND ? A : B
+    like = cond if isinstance(cond, (pd.DataFrame, pd.Series)) else None
+    if like is None:
+        return a if cond else b
+    values = np.where(_truth(cond), a, b)
+    if isinstance(like, pd.DataFrame):
+        return pd.DataFrame(values, index=like.index, columns=like.columns)
+    return pd.Series(values, index=like.index)
+
+
+def _field(panel):
+    # Alphas191 的欄位為 (欄位名稱, 股票代號) 兩層欄位，去掉第一層後不同欄位之間才能依股票對齊運算
+    columns = getattr(panel, "columns", None)
+    if isinstance(columns, pd.MultiIndex) and columns.nlevels == 2:
+        if len(columns.get_level_values(0).unique()) == 1:
+            return panel.droplevel(0, axis=1)
+    return panel
+
+
+def panel_variables(df_data):
+    """
+    由 Alphas191 使用的股票資料表建立公式變數，每個欄位都是以股票代號為欄的資料表，
+    不同欄位之間可以直接依股票對齊運算。
+
+    Args:
+        df_data: get_stocks_data / get_stocks_data_range 回傳的資料表
+    Returns:
+        dict: 屬性名稱 -> 資料表
+    """
+    fields = {name: df_data[name] for name in ("open", "high", "low", "close", "volume")}
+    fields["returns"] = ops191.Returns(fields["close"])
+    fields["amount"] = (
+        (fields["open"] + fields["high"] + fields["low"] + fields["close"]) / 4
+    ) * fields["volume"]
+    fields["vwap"] = fields["amount"] / fields["volume"]
+    for name in ("benchmark_open", "benchmark_close"):
+        if name in df_data:
+            fields[name] = ops191.Benchmark(df_data, name)
+    return fields
+
+
+class Node(object):
+    """
+    運算圖中的一個節點。相同的 (op, args, value) 只會建立一次，藉此合併相同的子運算式。
+    """
+
+    __slots__ = ("op", "args", "value", "index")
+
+    def __init__(self, op, args, value, index):
+        self.op = op
+        self.args = args
+        self.value = value
+        self.index = index
+
+    @property
+    def is_const(self):
+        return self.op == "const"
+
+    def __repr__(self):
+        if self.op == "const":
+            return repr(self.value)
+        if self.op == "var":
+            return self.value
+        if self.op == "call":
+            return f"{self.value}({', '.join(map(repr, self.args))})"
+        return f"{self.op}({', '.join(map(repr, self.args))})"
+
+
+class Graph(object):
+    """
+    一批公式共用的運算圖，負責節點的建立、合併與常數折疊。
+    """
+
+    def __init__(self):
+        self.nodes = []
+        self._interned = {}
+
+    def _node(self, op, args=(), value=None):
+        # 常數的型別也要納入鍵，避免窗口參數 5 與浮點數 5.0 被合併成同一個節點
+        if isinstance(value, np.ndarray):
+            key_value = ("array", tuple(value))
+        else:
+            key_value = (type(value).__name__, value)
+        key = (op, tuple(a.index for a in args), key_value)
+        node = self._interned.get(key)
+        if node is None:
+            node = Node(op, tuple(args), value, len(self.nodes))
+            self.nodes.append(node)
+            self._interned[key] = node
+        return node
+
+    def const(self, value):
+        if isinstance(value, (bool, np.bool_)):
+            value = float(value)
+        return self._node("const", (), value)
+
+    def var(self, name):
+        if name not in VARIABLES:
+            match = re.fullmatch(r"ADV(\d+)", name)
+            if match:
+                # Alpha101 的 advN 為 N 日平均成交量
+                return self.call("MEAN", [self.var("VOLUME"), self.const(int(match.group(1)))])
+            raise FormulaError(f"未知的變數 {name}")
+        return self._node("var", (), VARIABLES[name])
+
+    def op(self, name, args):
+        args = list(args)
+        # 常數折疊: 參數全為常數時直接算出結果
+        if all(a.is_const for a in args):
+            return self.const(ELEMENTWISE[name](*[a.value for a in args]))
+        # 代數化簡
+        if name in ("add", "sub") and args[1].is_const and args[1].value == 0:
+            return args[0]
+        if name == "add" and args[0].is_const and args[0].value == 0:
+            return args[1]
+        if name in ("mul", "div", "pow") and args[1].is_const and args[1].value == 1:
+            return args[0]
+        if name == "mul" and args[0].is_const and args[0].value == 1:
+            return args[1]
+        if name == "neg" and args[0].op == "neg":
+            return args[0].args[0]
+        if name in ("add", "sub"):
+            # a*c1 + a*c2 -> a*(c1+c2)，例如 (OPEN * 0.65) + (OPEN * 0.35)
+            left, right = self._scaled(args[0]), self._scaled(args[1])
+            if left[0] is right[0]:
+                coef = left[1] + right[1] if name == "add" else left[1] - right[1]
+                return self.op("mul", [left[0], self.const(coef)])
+        return self._node(name, args)
+
+    def _scaled(self, node):
+        if node.op == "mul" and node.args[1].is_const:
+            return node.args[0], node.args[1].value
+        if node.op == "mul" and node.args[0].is_const:
+            return node.args[1], node.args[0].value
+        return node, 1.0
+
+    def where(self, cond, a, b):
+        if cond.is_const:
+            return a if cond.value else b
+        if a is b:
+            return a
+        return self._node("where", (cond, a, b))
+
+    def call(self, name, args):
+        name = ALIASES.get(name, name)
+        if name == "SEQUENCE":
+            if len(args) != 1 or not args[0].is_const:
+                raise FormulaError("SEQUENCE 的參數必須是常數")
+            return self.const(np.arange(1, int(args[0].value) + 1))
+        if name in ("MAX", "MIN"):
+            # MAX(X, n) 在 Alpha191 中是 n 日滾動最大值，其餘情況為逐元素取大/取小
+            if len(args) == 2 and args[1].is_const and not args[0].is_const:
+                value = args[1].value
+                if float(value).is_integer() and value > 1:
+                    return self.call("TS" + name, args)
+            return self.call("ELEM" + name, args)
+        if name == "SMA" and len(args) == 2:
+            return self.call("MEAN", args)
+        if name == "SUM" and len(args) == 1:
+            raise FormulaError("SUM 缺少窗口參數")
+        if name == "SCALE" and len(args) == 1:
+            args = args + [self.const(1)]
+        if name not in FUNCTIONS:
+            raise FormulaError(f"未知的函數 {name}")
+        _, arity, window_args = FUNCTIONS[name]
+        if len(args) != arity:
+            raise FormulaError(f"{name} 需要 {arity} 個參數，實際為 {len(args)} 個")
+        args = list(args)
+        for pos in window_args:
+            if not args[pos].is_const:
+                raise FormulaError(f"{name} 的第 {pos + 1} 個參數必須是常數窗口")
+            # Alpha101 的窗口可能是小數，與 Alpha_code_1 相同四捨五入為整數
+            args[pos] = self.const(int(round(float(args[pos].value))))
+        if name in ("ELEMMAX", "ELEMMIN") and all(a.is_const for a in args):
+            func = max if name == "ELEMMAX" else min
+            return self.const(func(args[0].value, args[1].value))
+        return self._node("call", args, name)
+
+
+_TOKEN = re.compile(
+    r"\s*(?:(?P<num>\d+\.\d*|\.\d+|\d+)|(?P<name>[A-Za-z_][A-Za-z_0-9.]*)"
+    r"|(?P<op>&&|\|\||<=|>=|==|!=|[-+*/^()<>=?:,&|]))"
+)
+
+
+def _tokenize(text):
+    # 原始公式中混有全形或排版用的符號
+    for old, new in (("–", "-"), ("−", "-"), ("？", "?"), ("：", ":"), ("（", "("), ("）", ")"), ("，", ",")):
+        text = text.replace(old, new)
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        match = _TOKEN.match(text, pos)
+        if match is None:
+            raise FormulaError(f"無法解析的字元 {text[pos:pos + 10]!r}")
+        pos = match.end()
+        if match.group("num") is not None:
+            tokens.append(("num", float(match.group("num"))))
+        elif match.group("name") is not None:
+            tokens.append(("name", match.group("name").upper()))
+        else:
+            tokens.append(("op", match.group("op")))
+    tokens.append(("end", None))
+    return tokens
+
+
+class _Parser(object):
+    # 遞迴下降解析器，運算子優先順序由低到高:
+    # ?:  ->  || |  ->  && &  ->  比較  ->  + -  ->  * /  ->  正負號  ->  ^
+    def __init__(self, text, graph):
+        self.tokens = _tokenize(text)
+        self.pos = 0
+        self.graph = graph
+
+    def peek(self):
+        return self.tokens[self.pos]
+
+    def take(self, op=None):
+        token = self.tokens[self.pos]
+        if op is not None and token != ("op", op):
+            raise FormulaError(f"預期 {op!r}，實際為 {token[1]!r}")
+        self.pos += 1
+        return token
+
+    def parse(self):
+        node = self.ternary()
+        if self.peek()[0] != "end":
+            raise FormulaError(f"多餘的內容 {self.peek()[1]!r}")
+        return node
+
+    def ternary(self):
+        cond = self.logical_or()
+        if self.peek() == ("op", "?"):
+            self.take("?")
+            a = self.ternary()
+            self.take(":")
+            b = self.ternary()
+            return self.graph.where(cond, a, b)
+        return cond
+
+    def logical_or(self):
+        node = self.logical_and()
+        while self.peek() in (("op", "||"), ("op", "|")):
+            self.take()
+            node = self.graph.op("or", [node, self.logical_and()])
+        return node
+
+    def logical_and(self):
+        node = self.compare()
+        while self.peek() in (("op", "&&"), ("op", "&")):
+            self.take()
+            node = self.graph.op("and", [node, self.compare()])
+        return node
+
+    def compare(self):
+        names = {"<": "lt", ">": "gt", "<=": "le", ">=": "ge", "==": "eq", "=": "eq", "!=": "ne"}
+        node = self.additive()
+        while self.peek()[0] == "op" and self.peek()[1] in names:
+            op = names[self.take()[1]]
+            node = self.graph.op(op, [node, self.additive()])
+        return node
+
+    def additive(self):
+        node = self.multiplicative()
+        while self.peek() in (("op", "+"), ("op", "-")):
+            op = "add" if self.take()[1] == "+" else "sub"
+            node = self.graph.op(op, [node, self.multiplicative()])
+        return node
+
+    def multiplicative(self):
+        node = self.unary()
+        while self.peek() in (("op", "*"), ("op", "/")):
+            op = "mul" if self.take()[1] == "*" else "div"
+            node = self.graph.op(op, [node, self.unary()])
+        return node
+
+    def unary(self):
+        if self.peek() == ("op", "-"):
+            self.take()
+            return self.graph.op("neg", [self.unary()])
+        if self.peek() == ("op", "+"):
+            self.take()
+            return self.unary()
+        return self.power()
+
+    def power(self):
+        node = self.atom()
+        if self.peek() == ("op", "^"):
+            self.take()
+            node = self.graph.op("pow", [node, self.unary()])
+        return node
+
+    def atom(self):
+        kind, value = self.take()
+        if kind == "num":
+            return self.graph.const(value)
+        if kind == "name":
+            if self.peek() == ("op", "("):
+                self.take("(")
+                args = []
+                if self.peek() != ("op", ")"):
+                    args.append(self.ternary())
+                    while self.peek() == ("op", ","):
+                        self.take(",")
+                        args.append(self.ternary())
+                self.take(")")
+                return self.graph.call(value, args)
+            return self.graph.var(value)
+        if (kind, value) == ("op", "("):
+            node = self.ternary()
+            self.take(")")
+            return node
+        raise FormulaError(f"非預期的符號 {value!r}")
+
+
+class Plan(object):
+    """
+    編譯後的執行計畫: 依拓樸順序排列、已合併重複子運算式的節點列表。
+
+    Args:
+        graph: 共用的運算圖
+        outputs: 公式名稱 -> 輸出節點
+    """
+
+    def __init__(self, graph, outputs):
+        self.outputs = dict(outputs)
+        # 只保留輸出實際用到的節點；節點建立時子節點一定先建立，所以依 index 排序即為拓樸順序
+        needed = set()
+        stack = list(self.outputs.values())
+        while stack:
+            node = stack.pop()
+            if node.index in needed:
+                continue
+            needed.add(node.index)
+            stack.extend(node.args)
+        self.steps = [n for n in graph.nodes if n.index in needed]
+        # 每個節點被多少個後續節點使用，用完即可釋放記憶體
+        self.uses = {n.index: 0 for n in self.steps}
+        for n in self.steps:
+            for a in n.args:
+                self.uses[a.index] += 1
+
+    def __len__(self):
+        return len(self.steps)
+
+    def describe(self):
+        """
+        Returns:
+            pd.DataFrame: 每個步驟的運算內容與被引用次數
+        """
+        return pd.DataFrame(
+            [
+                {
+                    "step": i,
+                    "op": n.value if n.op == "call" else n.op,
+                    "expr": repr(n),
+                    "uses": self.uses[n.index],
+                }
+                for i, n in enumerate(self.steps)
+                if n.op not in ("const",)
+            ]
+        )
+
+    def evaluate(self, data):
+        """
+        執行計畫。
+
+        Args:
+            data: 股票資料表(見 panel_variables)、{屬性名稱: 資料表} 的 dict，
+                或 Alphas191 / Alpha_code_1.Alphas 物件
+        Returns:
+            dict: 公式名稱 -> 計算結果
+        """
+        if isinstance(data, pd.DataFrame):
+            variables = panel_variables(data)
+        elif isinstance(data, dict):
+            variables = data
+        else:
+            variables = vars(data)
+        remaining = dict(self.uses)
+        keep = {n.index for n in self.outputs.values()}
+        values = {}
+        for node in self.steps:
+            if node.op == "const":
+                values[node.index] = node.value
+                continue
+            if node.op == "var":
+                if node.value not in variables:
+                    raise FormulaError(f"資料中沒有 {node.value}")
+                values[node.index] = _field(variables[node.value])
+                continue
+            args = [values[a.index] for a in node.args]
+            if node.op == "call":
+                func = FUNCTIONS[node.value][0]
+                if isinstance(args[0], pd.Series):
+                    func = SERIES_FUNCTIONS.get(node.value, func)
+                values[node.index] = func()(*args)
+            elif node.op == "where":
+                values[node.index] = _where(*args)
+            else:
+                values[node.index] = ELEMENTWISE[node.op](*args)
+            for a in node.args:
+                remaining[a.index] -= 1
+                if remaining[a.index] == 0 and a.index not in keep:
+                    del values[a.index]
+        return {name: values[node.index] for name, node in self.outputs.items()}
+
+
+def compile_formulas(formulas):
+    """
+    把一批公式編譯成一個共用的執行計畫。
+
+    Args:
+        formulas: {名稱: 公式字串}
+    Returns:
+        Plan: 執行計畫，呼叫 plan.evaluate(stock) 計算所有公式
+    """
+    graph = Graph()
+    outputs = {}
+    for name, text in formulas.items():
+        try:
+            outputs[name] = _Parser(text, graph).parse()
+        except FormulaError as e:
+            raise FormulaError(f"{name}: {e}") from e
+    return Plan(graph, outputs)
+
+
+def compile_formula(text):
+    """
+    編譯單一公式，回傳只有一個輸出(名稱為 "alpha")的執行計畫。
+    """
+    return compile_formulas({"alpha": text})
+
+
+def extract_formulas(cls):
+    """
+    從 alpha 方法的註解中取出公式字串。
+    alphas191.py 的公式寫在方法內 "####公式###" 的註解中，
+    Alpha_code_1.py 的公式寫在方法上方 "# Alpha#1\t 公式" 的註解中。
+
+    Returns:
+        dict: alpha 名稱 -> 公式字串
+    """
+    formulas = {}
+    for name in sorted(dir(cls)):
+        if not re.fullmatch(r"alpha\d+", name):
+            continue
+        func = getattr(cls, name)
+        comments = inspect.getcomments(func) or ""
+        match = re.search(r"Alpha#\d+\s+(.+)", comments)
+        if match:
+            formulas[name] = match.group(1).strip()
+            continue
+        for line in inspect.getsource(func).splitlines()[1:]:
+            line = line.strip()
+            if line.startswith("#") and line.strip("#").strip():
+                formulas[name] = line.strip("#").strip()
+                break
+    return formulas
+
+
+def compile_class_formulas(cls):
+    """
+    編譯類別中所有能解析的 alpha 公式。
+
+    Returns:
+        Tuple[Plan, dict]: (執行計畫, 無法編譯的 alpha -> 錯誤訊息)
+    """
+    compiled, errors = {}, {}
+    for name, text in extract_formulas(cls).items():
+        try:
+            compile_formulas({name: text})
+        except (FormulaError, ValueError, TypeError, ZeroDivisionError) as e:
+            errors[name] = str(e)
+            continue
+        compiled[name] = text
+    return compile_formulas(compiled), errors
@@ -0,0 +1,359 @@
+# 以遺傳規劃(genetic programming)搜尋新的 alpha
+# 運算式樹使用與 alphas191.py 相同的運算子(Rank、Corr、Delta、Tsrank、Decaylinear...)，
+# 適應度為 alpha 與未來報酬的橫截面 Rank IC 平均值，在多個行程中平行計算；
+# 每個子行程保留子樹的計算結果，跨世代重複出現的子運算式不需要重新計算
+import os
+import random
+from collections import OrderedDict
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+
+from Chapter2.utils.formula import ELEMENTWISE, FUNCTIONS, panel_variables
+
+# 終端節點: 公式變數名稱 -> panel_variables 的屬性名稱
+TERMINALS = {
+    "OPEN": "open",
+    "HIGH": "high",
+    "LOW": "low",
+    "CLOSE": "close",
+    "VOLUME": "volume",
+    "VWAP": "vwap",
+    "AMOUNT": "amount",
+    "RET": "returns",
+}
+
+# 運算子: 名稱 -> (子運算式個數, 是否帶窗口參數)
+UNARY_OPS = {"RANK": (1, False), "ABS": (1, False), "SIGN": (1, False), "LOG": (1, False), "neg": (1, False)}
+BINARY_OPS = {"add": (2, False), "sub": (2, False), "mul": (2, False), "div": (2, False)}
+TS_OPS = {
+    "DELTA": (1, True),
+    "DELAY": (1, True),
+    "SUM": (1, True),
+    "MEAN": (1, True),
+    "STD": (1, True),
+    "TSRANK": (1, True),
+    "TSMAX": (1, True),
+    "TSMIN": (1, True),
+    "DECAYLINEAR": (1, True),
+    "CORR": (2, True),
+    "COV": (2, True),
+}
+OPERATORS = {**UNARY_OPS, **BINARY_OPS, **TS_OPS}
+
+WINDOWS = (3, 5, 10, 20)
+
+# 交換律成立的運算，子節點排序後再產生標準字串，提高快取命中率
+COMMUTATIVE = {"add", "mul", "CORR", "COV"}
+
+_INFIX = {"add": "+", "sub": "-", "mul": "*", "div": "/"}
+
+
+def to_formula(tree):
+    """
+    把運算式樹轉成 formula.py 可以解析的公式字串，同時也是快取使用的標準字串。
+
+    Args:
+        tree: 終端節點名稱(str)，或 (運算子, 子樹..., [窗口]) 的 tuple
+    """
+    if isinstance(tree, str):
+        return tree
+    op, args = tree[0], tree[1:]
+    arity, has_window = OPERATORS[op]
+    children = [to_formula(a) for a in args[:arity]]
+    if op in COMMUTATIVE:
+        children.sort()
+    if op in _INFIX:
+        return f"({children[0]} {_INFIX[op]} {children[1]})"
+    if op == "neg":
+        return f"(-{children[0]})"
+    if has_window:
+        children.append(str(args[arity]))
+    return f"{op}({', '.join(children)})"
+
+
+def depth(tree):
+    if isinstance(tree, str):
+        return 1
+    arity = OPERATORS[tree[0]][0]
+    return 1 + max(depth(a) for a in tree[1 : 1 + arity])
+
+
+def _subtrees(tree, path=()):
+    # 走訪所有運算式子樹(不含窗口參數)，回傳 (路徑, 子樹)
+    yield path, tree
+    if not isinstance(tree, str):
+        arity = OPERATORS[tree[0]][0]
+        for i in range(arity):
+            yield from _subtrees(tree[1 + i], path + (1 + i,))
+
+
+def _replace(tree, path, subtree):
+    if not path:
+        return subtree
+    items = list(tree)
+    items[path[0]] = _replace(tree[path[0]], path[1:], subtree)
+    return tuple(items)
+
+
+def random_tree(rng, max_depth, full=False):
+    """
+    隨機產生運算式樹。full=True 時每個分支都長到 max_depth，否則隨機提早結束(grow)。
+    """
+    if max_depth <= 1 or (not full and rng.random() < 0.3):
+        return rng.choice(list(TERMINALS))
+    op = rng.choice(list(OPERATORS))
+    arity, has_window = OPERATORS[op]
+    children = [random_tree(rng, max_depth - 1, full) for _ in range(arity)]
+    if has_window:
+        children.append(rng.choice(WINDOWS))
+    return (op, *children)
+
+
+# region 子行程
+
+_WORKER = {}
+
+
+def _init_worker(df_data, horizon, cache_size, min_coverage):
+    # 每個子行程只在啟動時接收一次資料，之後的任務只傳運算式樹
+    variables = panel_variables(df_data)
+    close = variables["close"]
+    forward = close.shift(-horizon) / close - 1
+    _WORKER["variables"] = variables
+    _WORKER["forward"] = forward
+    # 有效天數不足可計算 IC 天數的 min_coverage 時不評分，避免只在少數幾天有值的運算式勝出
+    available = int((forward.notna().sum(axis=1) >= 3).sum())
+    _WORKER["min_days"] = max(2, int(np.ceil(min_coverage * available)))
+    _WORKER["cache"] = OrderedDict()
+    _WORKER["cache_size"] = cache_size
+    _WORKER["hits"] = 0
+    _WORKER["misses"] = 0
+
+
+def _evaluate_tree(tree):
+    if isinstance(tree, str):
+        return _WORKER["variables"][TERMINALS[tree]]
+    cache = _WORKER["cache"]
+    key = to_formula(tree)
+    if key in cache:
+        cache.move_to_end(key)
+        _WORKER["hits"] += 1
+        return cache[key]
+    _WORKER["misses"] += 1
+    op, args = tree[0], tree[1:]
+    arity, has_window = OPERATORS[op]
+    values = [_evaluate_tree(a) for a in args[:arity]]
+    if has_window:
+        values.append(args[arity])
+    if op in ELEMENTWISE:
+        result = ELEMENTWISE[op](*values)
+    else:
+        result = FUNCTIONS[op][0]()(*values)
+    if isinstance(result, pd.DataFrame):
+        result = result.replace([np.inf, -np.inf], np.nan)
+    cache[key] = result
+    # 超過容量時淘汰最久未使用的子樹
+    while len(cache) > _WORKER["cache_size"]:
+        cache.popitem(last=False)
+    return result
+
+
+def rank_ic(alpha, forward, min_assets=3):
+    """
+    逐日計算 alpha 與未來報酬的橫截面 Rank IC。
+
+    Args:
+        alpha: 因子值，列為日期、欄為股票
+        forward: 未來報酬，形狀與 alpha 相同
+        min_assets: 當日有效股票數少於此值時不計算
+    Returns:
+        pd.Series: 每日的 Rank IC
+    """
+    valid = alpha.notna() & forward.notna()
+    a = alpha.where(valid).rank(axis=1)
+    f = forward.where(valid).rank(axis=1)
+    a = a.sub(a.mean(axis=1), axis=0)
+    f = f.sub(f.mean(axis=1), axis=0)
+    ic = (a * f).sum(axis=1) / np.sqrt((a**2).sum(axis=1) * (f**2).sum(axis=1))
+    return ic[valid.sum(axis=1) >= min_assets].replace([np.inf, -np.inf], np.nan).dropna()
+
+
+def _fitness(tree):
+    hits, misses = _WORKER["hits"], _WORKER["misses"]
+    ic, icir, days = _tree_fitness(tree)
+    # 同時回傳這次評估的快取命中與計算次數
+    return ic, icir, days, _WORKER["hits"] - hits, _WORKER["misses"] - misses
+
+
+def _tree_fitness(tree):
+    try:
+        with np.errstate(all="ignore"):
+            alpha = _evaluate_tree(tree)
+        if not isinstance(alpha, pd.DataFrame):
+            return np.nan, np.nan, 0
+        ic = rank_ic(alpha, _WORKER["forward"])
+    except (ValueError, TypeError, ZeroDivisionError, FloatingPointError):
+        return np.nan, np.nan, 0
+    if len(ic) < _WORKER["min_days"] or ic.std() == 0:
+        return np.nan, np.nan, len(ic)
+    return ic.mean(), ic.mean() / ic.std(), len(ic)
+
+
+# endregion
+
+
+class GPMiner(object):
+    """
+    遺傳規劃 alpha 搜尋。
+
+    Args:
+        df_data: Alphas191.get_stocks_data / get_stocks_data_range 回傳的股票資料表
+        horizon: 未來報酬的期數
+        population: 每一代的個體數
+        generations: 演化世代數
+        max_depth: 運算式樹的最大深度
+        tournament: 錦標賽選擇的參賽個數
+        crossover_rate: 交配機率，其餘為突變
+        elite: 每一代直接保留的最佳個體數
+        parsimony: 每增加一層深度扣除的適應度，避免運算式無限膨脹
+        min_coverage: 有 IC 的天數至少需佔可計算天數的比例，不足時不評分
+        processes: 平行計算的行程數，預設為 CPU 核心數
+        cache_size: 每個子行程最多保留的子樹結果數
+        seed: 亂數種子
+    """
+
+    def __init__(
+        self,
+        df_data,
+        horizon=1,
+        population=100,
+        generations=10,
+        max_depth=4,
+        tournament=3,
+        crossover_rate=0.7,
+        elite=5,
+        parsimony=0.001,
+        min_coverage=0.5,
+        processes=None,
+        cache_size=2000,
+        seed=None,
+    ):
+        self.df_data = df_data
+        self.horizon = horizon
+        self.population = population
+        self.generations = generations
+        self.max_depth = max_depth
+        self.tournament = tournament
+        self.crossover_rate = crossover_rate
+        self.elite = elite
+        self.parsimony = parsimony
+        self.min_coverage = min_coverage
+        self.processes = processes or os.cpu_count() or 1
+        self.cache_size = cache_size
+        self.rng = random.Random(seed)
+        # 標準字串 -> (ic, icir, 天數)，已評估過的運算式不會再送到子行程
+        self.results = {}
+        self.history = []
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def score(self, tree):
+        ic = self.results[to_formula(tree)][0]
+        if np.isnan(ic):
+            return -np.inf
+        return abs(ic) - self.parsimony * depth(tree)
+
+    def _initial_population(self):
+        # ramped half-and-half: 不同深度各一半用 full、一半用 grow 產生
+        population, seen = [], set()
+        attempts = 0
+        while len(population) < self.population and attempts < self.population * 20:
+            attempts += 1
+            d = 2 + attempts % (self.max_depth - 1)
+            tree = random_tree(self.rng, d, full=attempts % 2 == 0)
+            key = to_formula(tree)
+            if key not in seen:
+                seen.add(key)
+                population.append(tree)
+        return population
+
+    def _select(self, population):
+        contestants = self.rng.sample(population, min(self.tournament, len(population)))
+        return max(contestants, key=self.score)
+
+    def _crossover(self, a, b):
+        path_a, _ = self.rng.choice(list(_subtrees(a)))
+        _, sub_b = self.rng.choice(list(_subtrees(b)))
+        child = _replace(a, path_a, sub_b)
+        return child if depth(child) <= self.max_depth else a
+
+    def _mutate(self, tree):
+        path, sub = self.rng.choice(list(_subtrees(tree)))
+        if not isinstance(sub, str) and OPERATORS[sub[0]][1] and self.rng.random() < 0.5:
+            # 只改窗口參數
+            arity = OPERATORS[sub[0]][0]
+            new = sub[: 1 + arity] + (self.rng.choice(WINDOWS),)
+        else:
+            new = random_tree(self.rng, max(self.max_depth - len(path), 1))
+        child = _replace(tree, path, new)
+        return child if depth(child) <= self.max_depth else tree
+
+    def _evaluate(self, pool, population):
+        pending = OrderedDict()
+        for tree in population:
+            key = to_formula(tree)
+            if key not in self.results:
+                pending.setdefault(key, tree)
+        if pending:
+            chunksize = max(1, len(pending) // (4 * self.processes))
+            for key, result in zip(pending, pool.map(_fitness, list(pending.values()), chunksize)):
+                self.results[key] = result[:3]
+                self.cache_hits += result[3]
+                self.cache_misses += result[4]
+
+    def run(self, verbose=True):
+        """
+        執行演化。
+
+        Returns:
+            pd.DataFrame: 所有評估過的運算式，依 |IC| 由大到小排序，
+                欄位為 formula、ic、icir、days
+        """
+        with Pool(
+            self.processes,
+            initializer=_init_worker,
+            initargs=(self.df_data, self.horizon, self.cache_size, self.min_coverage),
+        ) as pool:
+            population = self._initial_population()
+            for generation in range(self.generations):
+                self._evaluate(pool, population)
+                population.sort(key=self.score, reverse=True)
+                best = population[0]
+                ic, icir, _ = self.results[to_formula(best)]
+                self.history.append({"generation": generation, "best": to_formula(best), "ic": ic, "icir": icir})
+                if verbose:
+                    print(f"generation {generation}: IC={ic:.4f} ICIR={icir:.4f} {to_formula(best)}")
+                if generation == self.generations - 1:
+                    break
+                offspring = population[: self.elite]
+                while len(offspring) < self.population:
+                    if self.rng.random() < self.crossover_rate:
+                        child = self._crossover(self._select(population), self._select(population))
+                    else:
+                        child = self._mutate(self._select(population))
+                    offspring.append(child)
+                population = offspring
+        if verbose:
+            print(f"子樹快取命中 {self.cache_hits} 次，計算 {self.cache_misses} 次")
+        return self.report()
+
+    def report(self):
+        rows = [
+            {"formula": key, "ic": ic, "icir": icir, "days": days}
+            for key, (ic, icir, days) in self.results.items()
+        ]
+        report = pd.DataFrame(rows, columns=["formula", "ic", "icir", "days"]).dropna()
+        order = report["ic"].abs().sort_values(ascending=False).index
+        return report.loc[order].reset_index(drop=True)
@@ -0,0 +1,442 @@
+# alpha 運算子的數值核心
+# 以 numpy 直接對整張寬表(日期 × 股票)逐列計算，避免 pandas 逐欄處理與大量暫存資料表
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+# 欄位數少於此值時逐列計算的額外負擔大於 pandas 逐欄計算，直接交給 pandas(兩者數值完全相同)
+EWM_MIN_COLUMNS = 512
+
+
+def _as_2d(data):
+    # 轉成 float64 的二維陣列，一維輸入視為單一欄位
+    values = np.asarray(data, dtype=np.float64)
+    if values.ndim == 1:
+        values = values[:, None]
+    return values
+
+
+def _wrap(values, like):
+    if isinstance(like, pd.DataFrame):
+        return pd.DataFrame(values, index=like.index, columns=like.columns)
+    if isinstance(like, pd.Series):
+        return pd.Series(values[:, 0], index=like.index, name=like.name)
+    return values if np.ndim(like) == 2 else values[:, 0]
+
+
+class EWMFilter(object):
+    """
+    指數加權移動平均的遞迴濾波器，與 pandas 的 ewm(alpha=..., adjust=False).mean() 數值完全相同。
+
+    一次處理所有欄位；多個 alpha 時為連續套用(stacked)，第 k 層的輸入是第 k-1 層的輸出，
+    逐列在同一次走訪中完成，不產生中間層的完整資料表。
+    濾波器保留每一層的狀態，之後可以用 update 接續輸入新的資料列。
+
+    Args:
+        alphas: 平滑係數，單一數值或每一層的係數列表
+        n_columns: 欄位數
+    """
+
+    def __init__(self, alphas, n_columns):
+        alphas = np.atleast_1d(np.asarray(alphas, dtype=np.float64))
+        # pandas 先把 alpha 換算成 com = (1-alpha)/alpha，計算時再以 1/(1+com) 取回 alpha，
+        # 兩次換算的捨入誤差也要照做才能逐位元相同
+        self.com = (1.0 - alphas) / alphas
+        self.alphas = 1.0 / (1.0 + self.com)
+        self.n_columns = n_columns
+        # 每一層的目前平均值、舊資料權重與新資料權重；尚未出現有效值時平均值為 NaN
+        self.weighted = np.full((len(self.alphas), n_columns), np.nan)
+        self.old_wt = np.ones((len(self.alphas), n_columns))
+        self.new_wt = np.repeat(self.alphas[:, None], n_columns, axis=1)
+        # 所有欄位都已有平均值且舊權重皆為 1 時稱為穩態，完整的資料列可以走較短的計算路徑
+        self.steady = np.zeros(len(self.alphas), dtype=bool)
+
+    @property
+    def stages(self):
+        return len(self.alphas)
+
+    def update(self, values, out=None, keep_all=False):
+        """
+        輸入新的資料列並更新狀態。
+
+        Args:
+            values: 二維陣列(列數 × 欄位數)或一維陣列(單一資料列)
+            out: 存放最後一層輸出的陣列，None 時自動配置
+            keep_all: 為 True 時回傳每一層的輸出，形狀為(層數 × 列數 × 欄位數)
+        Returns:
+            np.ndarray: 最後一層(或每一層)的輸出
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if np.isinf(values).any():
+            # pandas 的 ewm 把 ±inf 當成空值略過，不會一直沿用到之後的平均值
+            values = np.where(np.isinf(values), np.nan, values)
+        single = values.ndim == 1
+        if single:
+            values = values[None, :]
+        n_rows = values.shape[0]
+        if keep_all:
+            result = np.empty((self.stages, n_rows, self.n_columns))
+        else:
+            result = np.empty((n_rows, self.n_columns)) if out is None else out
+
+        cols = self.n_columns
+        cur = np.empty(cols)
+        new = np.empty(cols)
+        tmp = np.empty(cols)
+        obs = np.empty(cols, dtype=bool)
+        seen = np.empty(cols, dtype=bool)
+        mask = np.empty(cols, dtype=bool)
+        changed = np.empty(cols, dtype=bool)
+        complete = ~np.isnan(values).any(axis=1)
+        for i in range(n_rows):
+            cur[:] = values[i]
+            row_complete = complete[i]
+            for k in range(self.stages):
+                weighted = self.weighted[k]
+                if row_complete and self.steady[k]:
+                    # 穩態下 old_wt 衰減後恆為 1-alpha、new_wt 恆為 alpha(com == 1 時 1-old_wt 也等於 alpha)，
+                    # 公式與一般路徑逐位元相同
+                    alpha = self.alphas[k]
+                    np.multiply(weighted, 1.0 - alpha, out=new)
+                    np.multiply(cur, alpha, out=tmp)
+                    np.add(new, tmp, out=new)
+                    np.divide(new, (1.0 - alpha) + alpha, out=new)
+                    np.not_equal(weighted, cur, out=changed)
+                    np.copyto(weighted, new, where=changed)
+                    if keep_all:
+                        result[k, i] = weighted
+                    cur[:] = weighted
+                    continue
+                old_wt = self.old_wt[k]
+                new_wt = self.new_wt[k]
+                np.equal(cur, cur, out=obs)
+                np.equal(weighted, weighted, out=seen)
+                # 已有平均值的欄位，不論本列是否為空值，舊權重都要衰減(pandas ignore_na=False)
+                np.multiply(old_wt, 1.0 - self.alphas[k], out=old_wt, where=seen)
+                # 與 pandas 相同只在數值有變化時才更新
+                np.logical_and(seen, obs, out=mask)
+                np.not_equal(weighted, cur, out=changed)
+                np.logical_and(mask, changed, out=changed)
+                if self.com[k] == 1:
+                    # pandas 在 com == 1 時改用 1 - old_wt 做為新資料權重，並沿用到之後的資料列
+                    np.subtract(1.0, old_wt, out=new_wt, where=changed)
+                # weighted = (old_wt * weighted + new_wt * cur) / (old_wt + new_wt)
+                np.multiply(old_wt, weighted, out=new)
+                np.multiply(new_wt, cur, out=tmp)
+                np.add(new, tmp, out=new)
+                np.add(old_wt, new_wt, out=tmp)
+                np.divide(new, tmp, out=new)
+                np.copyto(weighted, new, where=changed)
+                old_wt[mask] = 1.0
+                # 第一次出現有效值時直接做為平均值
+                np.logical_and(obs, ~seen, out=mask)
+                np.copyto(weighted, cur, where=mask)
+                # 整列都有值時，更新後所有欄位的舊權重都重設為 1；下一層的輸入也不會有空值
+                self.steady[k] = row_complete
+                row_complete = row_complete and bool(seen.all() or obs.all())
+                if keep_all:
+                    result[k, i] = weighted
+                cur[:] = weighted
+            if not keep_all:
+                result[i] = cur
+        if single and not keep_all:
+            return result[0]
+        return result
+
+
+def ewm_mean(data, alphas, keep_all=False):
+    """
+    對 Series / DataFrame / ndarray 的每一欄計算 ewm(alpha=..., adjust=False).mean()。
+
+    Args:
+        data: 輸入資料，列為時間
+        alphas: 平滑係數；傳入列表時依序連續套用，例如 SMA(SMA(X,3,1),3,1) 為 [1/3, 1/3]
+        keep_all: 為 True 時回傳每一層結果組成的列表
+    """
+    stages = list(np.atleast_1d(alphas))
+    if (
+        isinstance(data, (pd.Series, pd.DataFrame))
+        and not keep_all
+        and (data.ndim == 1 or data.shape[1] < EWM_MIN_COLUMNS)
+    ):
+        for alpha in stages:
+            data = data.ewm(alpha=alpha, adjust=False).mean()
+        return data
+    values = _as_2d(data)
+    ewm = EWMFilter(stages, values.shape[1])
+    if keep_all:
+        return [_wrap(v, data) for v in ewm.update(values, keep_all=True)]
+    return _wrap(ewm.update(values), data)
+
+
+def _ranks_from_sorted(sorted_keys, group_start, method):
+    # sorted_keys 為各組已排序的值(空值排在組尾)，group_start 標記每組的第一個位置，
+    # 依 pandas 的同值處理方式回傳排序後每個位置的名次
+    n = len(sorted_keys)
+    pos = np.arange(n)
+    start = np.maximum.accumulate(np.where(group_start, pos, 0))
+    new_tie = group_start.copy()
+    new_tie[1:] |= sorted_keys[1:] != sorted_keys[:-1]
+    if method == "first":
+        return (pos - start + 1).astype(np.float64)
+    if method == "dense":
+        dense = np.cumsum(new_tie)
+        return (dense - dense[start] + 1).astype(np.float64)
+    low = np.maximum.accumulate(np.where(new_tie, pos, 0)) - start + 1
+    if method == "min":
+        return low.astype(np.float64)
+    tie_end = np.empty(n, dtype=bool)
+    tie_end[:-1] = new_tie[1:]
+    tie_end[-1:] = True
+    high = np.minimum.accumulate(np.where(tie_end, pos, n)[::-1])[::-1] - start + 1
+    if method == "max":
+        return high.astype(np.float64)
+    if method == "average":
+        return (low + high) / 2.0
+    raise ValueError(f"不支援的排名方式 {method}")
+
+
+def _rank_sorted(values, nan, order, group_start, method, pct, group_ids):
+    # 依排序結果計算名次後放回原本位置；空值維持空值
+    sorted_values = values[order]
+    ranks = _ranks_from_sorted(sorted_values, group_start, method)
+    valid = ~nan[order]
+    ranks[~valid] = np.nan
+    if pct and len(ranks):
+        sorted_groups = group_ids[order]
+        n_groups = sorted_groups.max() + 1
+        if method == "dense":
+            # dense 的百分位以每組不同值的個數為分母
+            denominator = np.zeros(n_groups)
+            np.maximum.at(denominator, sorted_groups[valid], ranks[valid])
+        else:
+            denominator = np.bincount(sorted_groups[valid], minlength=n_groups)
+        ranks /= denominator[sorted_groups]
+    out = np.empty_like(ranks)
+    out[order] = ranks
+    return out
+
+
+def rank_rows(values, method="average", pct=False, ascending=True):
+    """
+    逐列(橫截面)排名，結果與 pandas 的 DataFrame.rank(axis=1, ...) 相同。
+
+    Args:
+        values: 二維陣列或 DataFrame，列為日期、欄為股票
+        method: 同值的名次，average、min、max、dense 或 first
+        pct: 是否以百分位表示，分母為當列有效值個數(dense 為不同值的個數)
+        ascending: 是否由小到大排名
+    Returns:
+        與輸入相同型別的排名結果，空值維持空值
+    """
+    data = values
+    values = _as_2d(values)
+    n_rows, n_cols = values.shape
+    if n_cols == 0:
+        return _wrap(values.copy(), data)
+    keys = values if ascending else -values
+    nan = np.isnan(keys)
+    if nan.any() and not np.isposinf(keys).any():
+        # numpy 對含空值的陣列排序很慢；沒有 +inf 時先以 +inf 代替空值，排序結果同樣排在列尾
+        keys = np.where(nan, np.inf, keys)
+    # 每列各自排序，空值排在列尾；method="first" 需要穩定排序以保留原本的欄位順序
+    order = np.argsort(keys, axis=1, kind="stable" if method == "first" else None)
+    # 攤平成一維，每列視為一組，名次與百分位交給 rank_groups 共用的 _rank_sorted 計算
+    order = (order + np.arange(n_rows)[:, None] * n_cols).ravel()
+    group_start = np.zeros((n_rows, n_cols), dtype=bool)
+    group_start[:, 0] = True
+    group_ids = np.repeat(np.arange(n_rows), n_cols)
+    ranks = _rank_sorted(
+        keys.ravel(), nan.ravel(), order, group_start.ravel(), method, pct, group_ids
+    )
+    return _wrap(ranks.reshape(n_rows, n_cols), data)
+
+
+def rank_groups(values, groups, method="average", pct=False, ascending=True):
+    """
+    長格式資料的分組排名，結果與 pandas 的 groupby(...).rank(...) 相同。
+
+    Args:
+        values: 一維的排名依據
+        groups: 與 values 等長的分組標籤(例如日期)
+        method, pct, ascending: 同 rank_rows
+    Returns:
+        np.ndarray: 與 values 等長的名次，空值維持空值
+    """
+    values = np.asarray(values, dtype=np.float64)
+    group_ids = pd.factorize(np.asarray(groups))[0]
+    keys = values if ascending else -values
+    nan = np.isnan(keys)
+    sort_keys = keys
+    if nan.any() and not np.isposinf(keys).any():
+        # 與 rank_rows 相同，以 +inf 代替空值加快排序
+        sort_keys = np.where(nan, np.inf, keys)
+    # 先依數值排序，再以穩定排序依組別分開，等同 lexsort((sort_keys, group_ids)) 但快得多；
+    # 組數不超過 65536 時組別轉成 uint16，numpy 會使用基數排序
+    order = np.argsort(sort_keys, kind="stable" if method == "first" else None)
+    codes = group_ids[order]
+    if len(codes) and codes.max() < 2**16:
+        codes = codes.astype(np.uint16)
+    order = order[np.argsort(codes, kind="stable")]
+    sorted_groups = group_ids[order]
+    group_start = np.ones(len(order), dtype=bool)
+    group_start[1:] = sorted_groups[1:] != sorted_groups[:-1]
+    return _rank_sorted(sort_keys, nan, order, group_start, method, pct, group_ids)
+
+
+def benchmark_rank(n_rows=1000, n_cols=1000, nan_ratio=0.05, repeat=5, seed=0):
+    """
+    比較 rank_rows 與 pandas DataFrame.rank(axis=1, method="min", pct=True) 的耗時。
+
+    Returns:
+        dict: pandas 與 numpy 版本每次的平均秒數，以及結果是否相同
+    """
+    import time
+
+    rng = np.random.default_rng(seed)
+    values = np.round(rng.standard_normal((n_rows, n_cols)), 2)
+    values[rng.random(values.shape) < nan_ratio] = np.nan
+    df = pd.DataFrame(values)
+    timings = {}
+    for name, func in (
+        ("pandas", lambda: df.rank(axis=1, method="min", pct=True)),
+        ("numpy", lambda: rank_rows(df, method="min", pct=True)),
+    ):
+        t1 = time.perf_counter()
+        for _ in range(repeat):
+            result = func()
+        timings[name] = (time.perf_counter() - t1) / repeat
+        timings[f"{name}_result"] = result
+    same = np.array_equal(
+        timings.pop("pandas_result").values, timings.pop("numpy_result").values, equal_nan=True
+    )
+    return {**timings, "identical": same}
+
+
+def rolling_extrema(values, window, kind="max"):
+    """
+    滾動窗口的最大(最小)值與其位置，以 van Herk/Gil-Werman 演算法一次處理所有欄位，
+    每個元素只需常數次比較，與窗口長度無關。
+
+    Args:
+        values: 一維或二維(列為時間)的陣列、Series 或 DataFrame
+        window: 窗口長度
+        kind: "max" 或 "min"
+    Returns:
+        Tuple: (極值, 位置)，形狀與輸入相同。位置為極值在窗口內的索引(0 為窗口最舊的一筆)，
+            有多個相同極值時取最早出現的一筆；窗口不足或含空值(含 ±inf)時兩者皆為空值，
+            與 pandas rolling(window).max() / rolling.apply(np.argmax) 相同
+    """
+    if kind not in ("max", "min"):
+        raise ValueError(f"不支援的極值種類 {kind}")
+    window = int(window)
+    if window < 1:
+        raise ValueError("window 必須大於 0")
+    data = values
+    x = _as_2d(values)
+    n, cols = x.shape
+    extreme = np.full((n, cols), np.nan)
+    position = np.full((n, cols), np.nan)
+    if n < window:
+        return _wrap(extreme, data), _wrap(position, data)
+
+    # 與 pandas rolling 相同，±inf 視為空值
+    nan = ~np.isfinite(x)
+    # 最小值以 -x 的最大值計算；空值以 -inf 代替，含空值的窗口最後再設為空值
+    y = np.where(nan, -np.inf, x if kind == "max" else -x)
+    n_blocks = -(-n // window)
+    padded = np.full((n_blocks * window, cols), -np.inf)
+    padded[:n] = y
+    blocks = padded.reshape(n_blocks, window, cols)
+    index = np.arange(n_blocks * window).reshape(n_blocks, window, 1)
+
+    # 區塊內由左往右的累積最大值，只在嚴格變大時更新位置，相同值保留較早的位置
+    prefix = np.maximum.accumulate(blocks, axis=1)
+    rising = np.ones(blocks.shape, dtype=bool)
+    rising[:, 1:] = blocks[:, 1:] > prefix[:, :-1]
+    prefix_arg = np.maximum.accumulate(np.where(rising, index, -1), axis=1)
+
+    # 區塊內由右往左的累積最大值，相同值時改用較早的位置
+    reverse = blocks[:, ::-1]
+    suffix = np.maximum.accumulate(reverse, axis=1)
+    rising = np.ones(blocks.shape, dtype=bool)
+    rising[:, 1:] = reverse[:, 1:] >= suffix[:, :-1]
+    suffix_arg = np.minimum.accumulate(
+        np.where(rising, index[:, ::-1], n_blocks * window), axis=1
+    )
+    suffix = suffix[:, ::-1].reshape(-1, cols)
+    suffix_arg = suffix_arg[:, ::-1].reshape(-1, cols)
+    prefix = prefix.reshape(-1, cols)
+    prefix_arg = prefix_arg.reshape(-1, cols)
+
+    # 窗口 [i-window+1, i] 恰好跨越相鄰兩個區塊: 左半段取右往左的累積值，右半段取左往右的累積值
+    end = np.arange(window - 1, n)
+    start = end - window + 1
+    left, right = suffix[start], prefix[end]
+    use_left = left >= right
+    value = np.where(use_left, left, right)
+    arg = np.where(use_left, suffix_arg[start], prefix_arg[end]) - start[:, None]
+
+    nan_count = np.concatenate([np.zeros((1, cols)), np.cumsum(nan, axis=0)])
+    has_nan = nan_count[end + 1] - nan_count[start] > 0
+    value[has_nan] = np.nan
+    arg = arg.astype(np.float64)
+    arg[has_nan] = np.nan
+    extreme[window - 1 :] = value if kind == "max" else -value
+    position[window - 1 :] = arg
+    return _wrap(extreme, data), _wrap(position, data)
+
+
+class RollingExtrema(object):
+    """
+    逐筆更新的滾動最大(最小)值，以單調佇列維護窗口內的候選值，每筆資料攤銷後只需 O(1)。
+    結果與 rolling_extrema 相同，適合回測中一根K線一根K線地更新。
+
+    Args:
+        window: 窗口長度
+        kind: "max" 或 "min"
+    """
+
+    def __init__(self, window, kind="max"):
+        if kind not in ("max", "min"):
+            raise ValueError(f"不支援的極值種類 {kind}")
+        self.window = int(window)
+        self.kind = kind
+        # 佇列中為 (序號, 數值)，數值由前往後嚴格遞減(最小值時為遞增)，隊首即為窗口極值
+        self.queue = deque()
+        self.count = 0
+        self.last_nan = -1
+
+    def update(self, value):
+        """
+        加入一筆新資料。
+
+        Returns:
+            Tuple[float, float]: (極值, 位置)，位置為極值在窗口內的索引(0 為最舊的一筆)；
+                窗口不足或含空值時皆為 NaN
+        """
+        i = self.count
+        self.count += 1
+        queue = self.queue
+        if not np.isfinite(value):
+            self.last_nan = i
+        else:
+            if self.kind == "max":
+                while queue and queue[-1][1] < value:
+                    queue.pop()
+            else:
+                while queue and queue[-1][1] > value:
+                    queue.pop()
+            queue.append((i, value))
+        start = i - self.window + 1
+        while queue and queue[0][0] < start:
+            queue.popleft()
+        if start < 0 or self.last_nan >= start or not queue:
+            return np.nan, np.nan
+        return queue[0][1], float(queue[0][0] - start)
+
+    @property
+    def value(self):
+        # 目前窗口的極值(不檢查窗口是否已滿)
+        return self.queue[0][1] if self.queue else np.nan
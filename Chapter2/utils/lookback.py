@@ -0,0 +1,311 @@
+# alpha 回看窗口(lookback)登記表
+# 透過解析 alpha 方法的原始碼，依運算子的窗口參數推算每個 alpha 最多需要多少根歷史K線，
+# 讓資料載入時只需多取剛好足夠的暖機資料，計算完成後再裁掉暖機區間
+import ast
+import inspect
+import math
+import textwrap
+
+import numpy as np
+
+# 滾動窗口類運算子: 名稱 -> (窗口參數位置, 關鍵字名稱)，回看長度為 window - 1
+WINDOW_OPS = {
+    # alphas191.py
+    "Corr": (2, "window"),
+    "Cov": (2, "window"),
+    "Sum": (1, "window"),
+    "Prod": (1, "window"),
+    "Mean": (1, "window"),
+    "Std": (1, "window"),
+    "Tsrank": (1, "window"),
+    "Tsmax": (1, "window"),
+    "Tsmin": (1, "window"),
+    "Decaylinear": (1, "window"),
+    "Lowday": (1, "window"),
+    "Highday": (1, "window"),
+    "Wma": (1, "window"),
+    "Count": (1, "window"),
+    "Sumif": (1, "window"),
+    "Regbeta": (1, "window"),
+    # Alpha_code_1.py
+    "ts_sum": (1, "window"),
+    "sma": (1, "window"),
+    "stddev": (1, "window"),
+    "correlation": (2, "window"),
+    "covariance": (2, "window"),
+    "ts_rank": (1, "window"),
+    "product": (1, "window"),
+    "ts_min": (1, "window"),
+    "ts_max": (1, "window"),
+    "ts_argmax": (1, "window"),
+    "ts_argmin": (1, "window"),
+    "decay_linear": (1, "period"),
+}
+
+# 平移類運算子: 名稱 -> (期數參數位置, 關鍵字名稱)，回看長度為 period
+SHIFT_OPS = {
+    "Delta": (1, "period"),
+    "Delay": (1, "period"),
+    "delta": (1, "period"),
+    "delay": (1, "period"),
+}
+
+# 固定回看長度的運算子
+FIXED_OPS = {
+    "Returns": 1,
+}
+
+# 指數加權類運算子(Sma)的記憶無限長，以權重衰減到 SMA_WARMUP_TOL 以下所需的長度做為暖機長度
+EWM_OPS = {
+    "Sma": (1, 2),
+}
+SMA_WARMUP_TOL = 1e-3
+
+# 對整段時間序列做運算的函數(例如 Alpha_code_1 的 rank 是時間序列上的百分位)，
+# 結果依賴完整歷史，無法以有限暖機精確重現
+GLOBAL_OPS = {"rank", "scale"}
+
+# 物件方法: 平移類與整段序列彙總類
+SHIFT_METHODS = {"shift": 1, "diff": 1, "pct_change": 1}
+GLOBAL_METHODS = {"std", "mean", "sum", "cumsum", "cumprod", "expanding"}
+
+# 窗口參數無法在解析階段決定時使用的保守預設值
+UNKNOWN_WINDOW = 250
+
+# Alpha_code_1 的輔助函數預設窗口
+DEFAULT_WINDOW = 10
+DEFAULT_PERIOD = 1
+
+_REGISTRY = {}
+
+
+def _const(node):
+    # 嘗試取得常數參數值，例如 6、19.8975、Sequence(6)
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+        return node.value
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+        value = _const(node.operand)
+        return None if value is None else -value
+    if (
+        isinstance(node, ast.Call)
+        and isinstance(node.func, ast.Name)
+        and node.func.id == "Sequence"
+        and node.args
+    ):
+        return _const(node.args[0])
+    return None
+
+
+class _Analyzer(object):
+    def __init__(self, fields):
+        # fields: self.xxx 屬性的回看長度，例如 returns 需要 1 根
+        self.fields = fields
+
+    def _arg(self, call, pos, name, default):
+        if len(call.args) > pos:
+            return _const(call.args[pos])
+        for kw in call.keywords:
+            if kw.arg == name:
+                return _const(kw.value)
+        return default
+
+    def _children(self, node, env):
+        lookback, exact = 0, True
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, ast.expr):
+                lb, ex = self.expr(child, env)
+                lookback, exact = max(lookback, lb), exact and ex
+        return lookback, exact
+
+    def _call(self, node, env):
+        lookback, exact = self._children(node, env)
+        func = node.func
+        if isinstance(func, ast.Name):
+            name = func.id
+            if name in WINDOW_OPS:
+                window = self._arg(node, *WINDOW_OPS[name], DEFAULT_WINDOW)
+                if window is None:
+                    return lookback + UNKNOWN_WINDOW - 1, False
+                return lookback + max(int(round(window)) - 1, 0), exact
+            if name in SHIFT_OPS:
+                period = self._arg(node, *SHIFT_OPS[name], DEFAULT_PERIOD)
+                if period is None:
+                    return lookback + UNKNOWN_WINDOW, False
+                return lookback + abs(int(round(period))), exact
+            if name in FIXED_OPS:
+                return lookback + FIXED_OPS[name], exact
+            if name in EWM_OPS:
+                n_pos, m_pos = EWM_OPS[name]
+                n, m = self._arg(node, n_pos, "n", None), self._arg(node, m_pos, "m", None)
+                if not n or not m or m >= n:
+                    return lookback, False
+                warmup = math.ceil(math.log(SMA_WARMUP_TOL) / math.log(1 - m / n))
+                # Sma(x, n, m, times=k) 連續套用 k 次
+                times = self._arg(node, 3, "times", 1) or 1
+                return lookback + warmup * int(times), False
+            if name in GLOBAL_OPS:
+                return lookback, False
+        elif isinstance(func, ast.Attribute):
+            if func.attr in SHIFT_METHODS:
+                period = self._arg(node, 0, "periods", SHIFT_METHODS[func.attr])
+                if period is None:
+                    return lookback + UNKNOWN_WINDOW, False
+                return lookback + abs(int(round(period))), exact
+            if func.attr in GLOBAL_METHODS:
+                # 指定 axis=1 時是橫截面彙總，不影響回看長度
+                for kw in node.keywords:
+                    if kw.arg == "axis" and _const(kw.value) == 1:
+                        return lookback, exact
+                return lookback, False
+        return lookback, exact
+
+    def expr(self, node, env):
+        if isinstance(node, ast.Call):
+            return self._call(node, env)
+        if isinstance(node, ast.Attribute):
+            if isinstance(node.value, ast.Name) and node.value.id == "self":
+                return self.fields.get(node.attr, (0, True))
+            return self.expr(node.value, env)
+        if isinstance(node, ast.Name):
+            return env.get(node.id, (0, True))
+        return self._children(node, env)
+
+    def body(self, stmts, env, on_self_assign=None):
+        # 依序走訪函數內的語句，回傳所有 return 運算式中最大的回看長度
+        result = (0, True)
+        for stmt in stmts:
+            if isinstance(stmt, (ast.Assign, ast.AugAssign)):
+                value = self.expr(stmt.value, env)
+                if isinstance(stmt, ast.Assign):
+                    targets = stmt.targets
+                else:
+                    # x += y: 結果同時依賴 x 原本的值
+                    targets = [stmt.target]
+                    old = self.expr(stmt.target, env)
+                    value = (max(old[0], value[0]), old[1] and value[1])
+                for target in targets:
+                    self._assign(target, value, env, on_self_assign)
+            elif isinstance(stmt, ast.Return) and stmt.value is not None:
+                lb, ex = self.expr(stmt.value, env)
+                result = (max(result[0], lb), result[1] and ex)
+        return result
+
+    def _assign(self, target, value, env, on_self_assign):
+        if isinstance(target, ast.Name):
+            env[target.id] = value
+        elif isinstance(target, (ast.Tuple, ast.List)):
+            for elt in target.elts:
+                self._assign(elt, value, env, on_self_assign)
+        elif isinstance(target, ast.Attribute):
+            if isinstance(target.value, ast.Name) and target.value.id == "self":
+                if on_self_assign is not None:
+                    on_self_assign(target.attr, value)
+        elif isinstance(target, ast.Subscript):
+            # part[cond] = value、df.loc[...] = value: 結果併入被賦值的變數
+            base = target.value
+            while isinstance(base, (ast.Subscript, ast.Attribute)):
+                base = base.value
+            if isinstance(base, ast.Name) and base.id != "self":
+                old = env.get(base.id, (0, True))
+                index = self.expr(target.slice, env)
+                env[base.id] = (
+                    max(old[0], value[0], index[0]),
+                    old[1] and value[1] and index[1],
+                )
+
+
+def _function_tree(func):
+    source = textwrap.dedent(inspect.getsource(func))
+    return ast.parse(source).body[0]
+
+
+def _field_lookbacks(cls):
+    # 解析 __init__，推算 self.returns、self.close_prev 等欄位本身的回看長度
+    fields = {}
+    analyzer = _Analyzer(fields)
+    try:
+        tree = _function_tree(cls.__init__)
+    except (OSError, TypeError, IndexError):
+        return fields
+
+    def on_self_assign(name, value):
+        fields[name] = value
+
+    analyzer.body(tree.body, {}, on_self_assign)
+    return fields
+
+
+def analyze_lookback(cls, alpha_name):
+    """
+    解析 alpha 方法的原始碼，推算它的最大回看長度。
+
+    Args:
+        cls: 因子計算類別，例如 Alphas191
+        alpha_name: alpha 方法名稱
+    Returns:
+        Tuple[int, bool]: (回看長度, 是否精確)。
+            含有 Sma 或整段序列彙總的 alpha 無法以有限暖機精確重現，此時為 False。
+    """
+    tree = _function_tree(getattr(cls, alpha_name))
+    analyzer = _Analyzer(_field_lookbacks(cls))
+    return analyzer.body(tree.body, {})
+
+
+def register_lookback(cls, alpha_name, lookback, exact=True):
+    """
+    手動登記 alpha 的回看長度，會覆蓋自動解析的結果。
+    """
+    _REGISTRY[(cls.__name__, alpha_name)] = (int(lookback), bool(exact))
+
+
+def lookback_info(cls, alpha_name):
+    """
+    取得 alpha 的(回看長度, 是否精確)，第一次查詢時自動解析並登記。
+    """
+    key = (cls.__name__, alpha_name)
+    if key not in _REGISTRY:
+        _REGISTRY[key] = analyze_lookback(cls, alpha_name)
+    return _REGISTRY[key]
+
+
+def get_lookback(cls, alpha_name):
+    """
+    取得 alpha 所需的回看長度(K線根數)。
+    """
+    return lookback_info(cls, alpha_name)[0]
+
+
+def is_exact(cls, alpha_name):
+    """
+    alpha 是否能以有限的暖機資料精確重現完整歷史的計算結果。
+    """
+    return lookback_info(cls, alpha_name)[1]
+
+
+def max_lookback(cls, methods=None):
+    """
+    一批 alpha 中最大的回看長度，未指定 methods 時涵蓋類別中所有 alpha。
+    """
+    if methods is None:
+        methods = [
+            m for m in dir(cls) if m.startswith("alpha") and callable(getattr(cls, m))
+        ]
+    return max((get_lookback(cls, m) for m in methods), default=0)
+
+
+def warmup_start(trading_dates, start_time, lookback):
+    """
+    根據交易日曆，找出要讓 start_time 當天就有 lookback 根歷史資料時應該從哪一天開始載入。
+
+    Args:
+        trading_dates: 交易日列表(字串 "YYYY-MM-DD" 或 datetime)
+        start_time: 需要輸出的起始日期
+        lookback: 回看長度
+    Returns:
+        載入資料的起始日期，型別與 trading_dates 相同
+    """
+    dates = np.sort(np.asarray(trading_dates))
+    if len(dates) == 0:
+        return start_time
+    pos = int(np.searchsorted(dates, start_time, side="left"))
+    return dates[max(pos - int(lookback), 0)]
@@ -0,0 +1,197 @@
+# alpha 運算子層級的效能分析工具
+# 啟用時會暫時替換 alphas191.py / Alpha_code_1.py 中的輔助函數(Rank、Corr、ts_rank...)，
+# 記錄每個 alpha 內各運算子的呼叫次數、耗時、輸入形狀與結果佔用的記憶體；
+# 停用時還原原本的函數，因此沒有啟用時完全不增加任何負擔
+import importlib
+import inspect
+import re
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_MODULES = ("Chapter2.utils.alphas191", "Chapter2.utils.Alpha_code_1")
+
+# 不屬於運算子、不需要替換的函數
+EXCLUDED_FUNCTIONS = {"get_alpha", "Benchmark"}
+
+_ALPHA_NAME = re.compile(r"^alpha\d+$")
+
+
+def _result_bytes(result):
+    # 運算結果佔用的記憶體(不含索引)
+    if isinstance(result, pd.DataFrame):
+        return int(result.memory_usage(index=False).sum())
+    if isinstance(result, pd.Series):
+        return int(result.memory_usage(index=False))
+    if isinstance(result, np.ndarray):
+        return int(result.nbytes)
+    return 0
+
+
+def _input_shape(args):
+    for arg in args:
+        shape = getattr(arg, "shape", None)
+        if shape is not None:
+            return tuple(shape)
+    return ()
+
+
+def _current_alpha():
+    # 沿著呼叫堆疊往上找，第一個名稱為 alphaXXX 的函數就是目前正在計算的 alpha
+    frame = sys._getframe(2)
+    while frame is not None:
+        name = frame.f_code.co_name
+        if _ALPHA_NAME.match(name):
+            return name
+        frame = frame.f_back
+    return "<none>"
+
+
+class OperatorProfiler(object):
+    """
+    記錄每個 alpha × 每個運算子的呼叫次數、累計耗時、輸入形狀與配置的記憶體。
+
+    使用方式:
+        with OperatorProfiler() as profiler:
+            stock.alpha001()
+        print(profiler.breakdown())
+
+    Args:
+        modules: 要替換輔助函數的模組(模組物件或名稱)，預設為 alphas191 與 Alpha_code_1
+    """
+
+    def __init__(self, modules=None):
+        self.modules = list(modules) if modules is not None else list(DEFAULT_MODULES)
+        # (alpha, operator) -> [呼叫次數, 總耗時, 自身耗時, 配置位元組, 最大輸入形狀]
+        self.records = {}
+        self._originals = []
+        self._stack = []
+
+    def __enter__(self):
+        return self.enable()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.disable()
+        return False
+
+    @property
+    def enabled(self):
+        return bool(self._originals)
+
+    def enable(self):
+        """
+        替換模組中的輔助函數，開始記錄。
+        """
+        if self.enabled:
+            return self
+        for module in self.modules:
+            if isinstance(module, str):
+                try:
+                    module = importlib.import_module(module)
+                except ImportError:
+                    continue
+            for name, func in list(vars(module).items()):
+                if (
+                    not inspect.isfunction(func)
+                    or func.__module__ != module.__name__
+                    or name.startswith("_")
+                    or name in EXCLUDED_FUNCTIONS
+                ):
+                    continue
+                self._originals.append((module, name, func))
+                setattr(module, name, self._wrap(name, func))
+        return self
+
+    def disable(self):
+        """
+        還原被替換的輔助函數，停止記錄。
+        """
+        while self._originals:
+            module, name, func = self._originals.pop()
+            setattr(module, name, func)
+        return self
+
+    def _wrap(self, name, func):
+        records = self.records
+        stack = self._stack
+
+        def wrapper(*args, **kwargs):
+            alpha = _current_alpha()
+            stack.append(0.0)
+            t1 = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - t1
+                child = stack.pop()
+                if stack:
+                    stack[-1] += elapsed
+            record = records.setdefault((alpha, name), [0, 0.0, 0.0, 0, ()])
+            record[0] += 1
+            record[1] += elapsed
+            record[2] += elapsed - child
+            record[3] += _result_bytes(result)
+            shape = _input_shape(args)
+            if np.prod(shape or (0,)) > np.prod(record[4] or (0,)):
+                record[4] = shape
+            return result
+
+        wrapper.__wrapped__ = func
+        wrapper.__name__ = func.__name__
+        return wrapper
+
+    def merge(self, records):
+        """
+        合併其他行程(例如 multiprocessing 的子行程)回傳的記錄。
+        """
+        for key, value in records.items():
+            record = self.records.setdefault(key, [0, 0.0, 0.0, 0, ()])
+            for i in range(4):
+                record[i] += value[i]
+            if np.prod(value[4] or (0,)) > np.prod(record[4] or (0,)):
+                record[4] = value[4]
+        return self
+
+    def report(self):
+        """
+        Returns:
+            pd.DataFrame: 每列為一組 (alpha, operator)，
+                欄位包含 calls、total_time、self_time、bytes、max_shape，依 self_time 由大到小排序
+        """
+        rows = [
+            {
+                "alpha": alpha,
+                "operator": op,
+                "calls": r[0],
+                "total_time": r[1],
+                "self_time": r[2],
+                "bytes": r[3],
+                "max_shape": r[4],
+            }
+            for (alpha, op), r in self.records.items()
+        ]
+        columns = ["alpha", "operator", "calls", "total_time", "self_time", "bytes", "max_shape"]
+        report = pd.DataFrame(rows, columns=columns)
+        return report.sort_values("self_time", ascending=False).reset_index(drop=True)
+
+    def breakdown(self, value="self_time"):
+        """
+        alpha × operator 的交叉表，最後一列與最後一欄為合計。
+
+        Args:
+            value: 要彙總的欄位，self_time(預設)、total_time、calls 或 bytes
+        """
+        report = self.report()
+        if report.empty:
+            return pd.DataFrame()
+        return report.pivot_table(
+            index="alpha",
+            columns="operator",
+            values=value,
+            aggfunc="sum",
+            fill_value=0,
+            margins=True,
+            margins_name="total",
+        )
@@ -0,0 +1,262 @@
+# alpha 去冗餘
+# 分段計算各 alpha 兩兩之間每日橫截面相關係數的平均值，記憶體用量只與區段長度有關，
+# 再以完全連結(complete linkage)階層分群，相關係數高於門檻的 alpha 歸為同一群，
+# 每群只保留一個代表，輸出可直接做為 generate_alphas 的 methods 參數
+import os
+
+import numpy as np
+import pandas as pd
+from scipy.cluster.hierarchy import fcluster, linkage
+from scipy.spatial.distance import squareform
+
+from Chapter2.utils.kernels import rank_rows
+
+
+def alpha_paths(root):
+    """
+    列出目錄下所有 alpha 結果檔，例如 alphas/Alphas191/2020。
+
+    Returns:
+        dict: alpha 名稱 -> CSV 路徑，依名稱排序
+    """
+    names = sorted(f[:-4] for f in os.listdir(root) if f.endswith(".csv"))
+    return {name: f"{root}/{name}.csv" for name in names}
+
+
+def _frame_chunks(frames, chunk_size):
+    # 記憶體中的結果依日期聯集切段
+    dates = frames[0].index
+    for df in frames[1:]:
+        dates = dates.union(df.index)
+    for i in range(0, len(dates), chunk_size):
+        part = dates[i : i + chunk_size]
+        yield [df[df.index.isin(part)] for df in frames]
+
+
+def _csv_chunks(paths, chunk_size):
+    # 同時逐段讀取所有 CSV，只輸出每個檔案都已讀到的日期，其餘留到下一段
+    # generate_alphas 寫出的檔案有 (欄位, 股票) 兩列表頭加一列 date 索引名稱
+    readers = [
+        pd.read_csv(p, header=[0, 1], index_col=0, chunksize=chunk_size) for p in paths
+    ]
+    buffers = [None] * len(paths)
+    done = [False] * len(paths)
+    while True:
+        for i, reader in enumerate(readers):
+            if not done[i] and (buffers[i] is None or len(buffers[i]) < chunk_size):
+                try:
+                    part = next(reader)
+                except StopIteration:
+                    done[i] = True
+                    continue
+                part.index = part.index.astype(str)
+                buffers[i] = part if buffers[i] is None else pd.concat([buffers[i], part])
+        pending = [b.index[-1] for i, b in enumerate(buffers) if not done[i] and len(b)]
+        if not pending and not any(b is not None and len(b) for b in buffers):
+            return
+        cut = min(pending) if pending else None
+        chunk = []
+        for i, b in enumerate(buffers):
+            if b is None:
+                chunk.append(pd.DataFrame())
+                continue
+            keep = b.index <= cut if cut is not None else np.ones(len(b), dtype=bool)
+            chunk.append(b[keep])
+            buffers[i] = b[~keep]
+        yield chunk
+
+
+def _by_asset(df):
+    # alpha 結果的欄位為 (欄位, 股票)，運算子對齊後同一股票的值只在其中一個欄位有值
+    # 或各欄位相同，合併成每檔股票一欄
+    if df.columns.nlevels == 1:
+        return df
+    return df.T.groupby(level=-1, sort=False).first().T
+
+
+def _stack(chunk):
+    # 對齊日期與股票，得到 (日期, alpha, 股票) 的陣列
+    chunk = [_by_asset(df) for df in chunk]
+    frames = [df for df in chunk if len(df)]
+    dates = frames[0].index
+    assets = frames[0].columns
+    for df in frames[1:]:
+        dates = dates.union(df.index)
+        assets = assets.union(df.columns)
+    values = np.full((len(dates), len(chunk), len(assets)), np.nan)
+    for k, df in enumerate(chunk):
+        if not len(df):
+            continue
+        values[:, k] = df.reindex(index=dates, columns=assets).to_numpy(dtype=np.float64)
+    # inf 與空值一樣視為沒有值
+    values[~np.isfinite(values)] = np.nan
+    return values
+
+
+def _daily_corr(values, min_assets):
+    # 每日每對 alpha 以兩者都有值的股票計算 Pearson 相關係數，
+    # 回傳 (相關係數, 是否有效, 兩者都有值的股票數)，形狀皆為 (日期, alpha, alpha)
+    valid = np.isfinite(values)
+    mask = valid.astype(np.float64)
+    count = valid.sum(axis=2, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        # 先逐日標準化，減少以總和計算共變異數時的數值誤差
+        x = np.where(valid, values, 0.0)
+        mean = x.sum(axis=2, keepdims=True) / count
+        x = np.where(valid, x - mean, 0.0)
+        std = np.sqrt((x * x).sum(axis=2, keepdims=True) / count)
+        x = np.where(valid, x / std, 0.0)
+        n = mask @ mask.transpose(0, 2, 1)
+        sx = x @ mask.transpose(0, 2, 1)
+        sxx = (x * x) @ mask.transpose(0, 2, 1)
+        sxy = x @ x.transpose(0, 2, 1)
+        sy = sx.transpose(0, 2, 1)
+        syy = sxx.transpose(0, 2, 1)
+        cov = sxy - sx * sy / n
+        corr = cov / np.sqrt((sxx - sx * sx / n) * (syy - sy * sy / n))
+    ok = np.isfinite(corr) & (n >= min_assets)
+    return np.where(ok, np.clip(corr, -1.0, 1.0), 0.0), ok, n
+
+
+def _daily_spearman(values, min_assets, batch_size=2**22):
+    # 每日每對 alpha 只以兩者都有值的股票重新排名後計算相關係數，回傳格式同 _daily_corr。
+    # 兩者有值的股票相同時，各自排名後的 Pearson 即為答案；只有有值股票不同的組合才重新排名
+    n_dates, n_alpha, n_assets = values.shape
+    ranks = rank_rows(values.reshape(-1, n_assets)).reshape(values.shape)
+    corr, ok, n = _daily_corr(ranks, min_assets)
+    valid = np.isfinite(values)
+    count = valid.sum(axis=2)
+    d, i, j = np.nonzero(
+        (n >= min_assets)
+        & ((n < count[:, :, None]) | (n < count[:, None, :]))
+        & np.triu(np.ones((n_alpha, n_alpha), dtype=bool))
+    )
+    if not len(d):
+        return corr, ok, n
+    step = max(1, batch_size // n_assets)
+    for k in range(0, len(d), step):
+        di, ii, jj = d[k : k + step], i[k : k + step], j[k : k + step]
+        mask = valid[di, ii] & valid[di, jj]
+        a = rank_rows(np.where(mask, values[di, ii], np.nan))
+        b = rank_rows(np.where(mask, values[di, jj], np.nan))
+        m = n[di, ii, jj][:, None]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            a = np.where(mask, a - (m + 1) / 2, 0.0)
+            b = np.where(mask, b - (m + 1) / 2, 0.0)
+            c = (a * b).sum(axis=1) / np.sqrt((a * a).sum(axis=1) * (b * b).sum(axis=1))
+        good = np.isfinite(c)
+        corr[di, ii, jj] = corr[di, jj, ii] = np.where(good, np.clip(c, -1.0, 1.0), 0.0)
+        ok[di, ii, jj] = ok[di, jj, ii] = good
+    return corr, ok, n
+
+
+def alpha_correlation(alphas, chunk_size=120, method="spearman", min_assets=3):
+    """
+    分段計算 alpha 兩兩之間每日橫截面相關係數的平均值。
+
+    Args:
+        alphas: alpha 名稱 -> 結果資料表(日期 × 股票)或 CSV 路徑，例如 alpha_paths 的回傳值；
+            CSV 為 generate_alphas 寫出的格式，(欄位, 股票) 兩列表頭加一列 date
+        chunk_size: 每段的日期數，同時在記憶體中的資料為 chunk_size × alpha 數 × 股票數
+        method: "spearman" 每日以兩者都有值的股票重新排名後計算，"pearson" 以原始數值計算；
+            兩個 alpha 有值的股票不同的日期需要逐對重新排名，spearman 會比 pearson 慢
+        min_assets: 當日兩者都有值的股票少於此數時不計入
+    Returns:
+        pd.DataFrame: 平均相關係數矩陣，沒有任何有效日期的組合為 NaN
+    """
+    if method not in ("spearman", "pearson"):
+        raise ValueError(f"不支援的相關係數 {method}")
+    names = list(alphas)
+    items = [alphas[m] for m in names]
+    if all(isinstance(item, pd.DataFrame) for item in items):
+        chunks = _frame_chunks(items, chunk_size)
+    else:
+        chunks = _csv_chunks(items, chunk_size)
+    total = np.zeros((len(names), len(names)))
+    days = np.zeros((len(names), len(names)))
+    for chunk in chunks:
+        daily = _daily_spearman if method == "spearman" else _daily_corr
+        corr, ok, _ = daily(_stack(chunk), min_assets)
+        total += corr.sum(axis=0)
+        days += ok.sum(axis=0)
+    with np.errstate(invalid="ignore"):
+        mean = total / days
+    return pd.DataFrame(mean, index=names, columns=names)
+
+
+def cluster_alphas(corr, threshold=0.95, absolute=True):
+    """
+    以完全連結階層分群，同一群內任兩個 alpha 的相關係數都不低於 threshold。
+
+    Args:
+        corr: alpha_correlation 的回傳值
+        threshold: 視為重複的相關係數門檻
+        absolute: 是否以絕對值判斷(高度負相關也視為重複)
+    Returns:
+        List[List[str]]: 各群的 alpha 名稱，依第一個成員在 corr 中的順序排列
+    """
+    names = list(corr.index)
+    if len(names) < 2:
+        return [names]
+    c = corr.to_numpy(dtype=np.float64)
+    c = np.abs(c) if absolute else c
+    # 沒有有效日期的組合視為不相關
+    dist = 1.0 - np.nan_to_num(c, nan=0.0)
+    dist = np.clip((dist + dist.T) / 2, 0.0, 2.0)
+    np.fill_diagonal(dist, 0.0)
+    labels = fcluster(
+        linkage(squareform(dist, checks=False), method="complete"),
+        t=1.0 - threshold,
+        criterion="distance",
+    )
+    clusters = {}
+    for name, label in zip(names, labels):
+        clusters.setdefault(label, []).append(name)
+    return list(clusters.values())
+
+
+def prune_alphas(
+    alphas, threshold=0.95, scores=None, chunk_size=120, method="spearman", min_assets=3
+):
+    """
+    去除高度相關的重複 alpha，每群只保留一個代表。
+
+    Args:
+        alphas: alpha 名稱 -> 結果資料表或 CSV 路徑
+        threshold: 視為重複的相關係數門檻
+        scores: alpha 名稱 -> 分數(例如篩選階段的 IC)，每群保留分數最高的 alpha；
+            未指定時保留群內順序最前的 alpha
+        chunk_size, method, min_assets: 見 alpha_correlation
+    Returns:
+        Tuple[List[str], dict]: (保留的 alpha 名稱, 代表 -> 同群的所有 alpha)
+    """
+    corr = alpha_correlation(alphas, chunk_size, method, min_assets)
+    kept = []
+    groups = {}
+    for members in cluster_alphas(corr, threshold):
+        if scores is not None:
+            rep = max(members, key=lambda m: scores.get(m, -np.inf))
+        else:
+            rep = members[0]
+        kept.append(rep)
+        groups[rep] = members
+    return kept, groups
+
+
+def save_allowlist(methods, path):
+    """
+    把保留的 alpha 名稱存成文字檔，一行一個。
+    """
+    folder = os.path.dirname(path)
+    if folder and not os.path.isdir(folder):
+        os.makedirs(folder)
+    with open(path, "w") as f:
+        f.write("\n".join(methods) + "\n")
+
+
+def load_allowlist(path):
+    """
+    讀取 save_allowlist 存下的 alpha 名稱，可直接傳給 generate_alphas 的 methods 參數。
+    """
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
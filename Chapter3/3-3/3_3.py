@@ -16,20 +16,20 @@ if not hasattr(collections, 'Sequence'):
     collections.Sequence = collections.abc.Sequence
 
 #%%
-import datetime  
 import backtrader as bt
-import pandas as pd
-import calendar
-from datetime import datetime 
-import empyrical as ep
-import pyfolio as pf
-import itertools
+import os
+import sys
 import warnings
 warnings.filterwarnings('ignore')
 
-def option_expiration(date): 
-    day = 21 - (calendar.weekday(date.year, date.month, 1) + 4) % 7 
-    return datetime(date.year, date.month, day) 
+# 專案根目錄加入模組搜尋路徑，以便匯入 Chapter3.utils
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+from Chapter3.utils.indicators import sma
+from Chapter3.utils.analyzers import StreamingMetrics, streaming_metrics
+from Chapter3.utils.optimizer import optimize, param_grid
+from Chapter3.utils.result_store import ResultStore
 
 class MA_Volume_Strategy(bt.Strategy):
     params = (
@@ -53,13 +53,13 @@ class MA_Volume_Strategy(bt.Strategy):
         self.datavolume = self.datas[0].volume
 
         # 移動平均線
-        self.ma_short = bt.indicators.SMA(self.dataclose, period=self.params.ma_short)
-        self.ma_medium = bt.indicators.SMA(self.dataclose, period=self.params.ma_medium)
-        self.ma_long = bt.indicators.SMA(self.dataclose, period=self.params.ma_long)
+        self.ma_short = sma(self.datas[0], 'close', self.params.ma_short)
+        self.ma_medium = sma(self.datas[0], 'close', self.params.ma_medium)
+        self.ma_long = sma(self.datas[0], 'close', self.params.ma_long)
 
         # 成交量移動平均線
-        self.vol_ma_short = bt.indicators.SMA(self.datavolume, period=self.params.ma_short)
-        self.vol_ma_long = bt.indicators.SMA(self.datavolume, period=self.params.ma_long)
+        self.vol_ma_short = sma(self.datas[0], 'volume', self.params.ma_short)
+        self.vol_ma_long = sma(self.datas[0], 'volume', self.params.ma_long)
 
         self.order = None
 
@@ -93,15 +93,12 @@ class MA_Volume_Strategy(bt.Strategy):
         position_price = self.getposition().price
 
         status = None
-        if (
-            option_expiration(self.datas[0].datetime.datetime(0)).day
-            == self.datas[0].datetime.datetime(0).day
-        ):
-            if self.datas[0].datetime.datetime(0).hour >= 13:
-                status = "end"
-                if  position_size != 0:
-                    self.close()
-                    self.log("Expired and Create Close Order")
+        # 結算日 13:00 之後平倉，當天不再進場
+        if self.datas[0].is_settlement_day[0] and self.datas[0].datetime.time(0).hour >= 13:
+            status = "end"
+            if position_size != 0:
+                self.close()
+                self.log("Expired and Create Close Order")
 
         if status != 'end':
             if not position_size:
@@ -143,77 +140,39 @@ class MA_Volume_Strategy(bt.Strategy):
                         self.order = self.close()
                         self.log('平空單 - 停損')
 
-# 初始化 Cerebro 引擎
-cerebro = bt.Cerebro(optreturn=False)
-
-df = pd.read_csv('TXF_30.csv')
-df = df.dropna()
-df['Date'] = pd.to_datetime(df['Date'])
-df.index = df['Date']
-df = df.between_time('08:45', '13:45')
-
-data_feed = bt.feeds.PandasData(
-    dataname=df,
-    name='TXF',
-    datetime=0,
-    high=2,
-    low=3,
-    open=1,
-    close=4,
-    volume=5,
-    plot=False,
-)
-cerebro.adddata(data_feed, name='TXF')
-
-# 參數範圍
-ma_short_values = [3, 5, 10]
-ma_medium_values = [15, 20, 30]
-ma_long_values = [40, 60, 90]
-stop_loss_values = [0.02, 0.01, 0.03, 0.05]
-take_profit_values = [0.02, 0.01, 0.03, 0.05]
-
-# 添加策略的排列組合
-cerebro.optstrategy(MA_Volume_Strategy,
-                    ma_short=ma_short_values,
-                    ma_medium=ma_medium_values,
-                    ma_long=ma_long_values,
-                    stop_loss_pct=stop_loss_values,
-                    take_profit_pct=take_profit_values)
-
-# 設定初始資金和交易成本
-cerebro.broker.setcash(300000.0)
-cerebro.broker.setcommission(commission=200, margin=167000, mult=200)
-
-# 添加 PyFolio 分析器
-cerebro.addanalyzer(bt.analyzers.PyFolio, _name='pyfolio')
-
-# 執行回測
-results = cerebro.run(maxcpus=1)
-
-# 將結果保存為 Excel
-output = []
-for result in results:
-    strat = result[0]
-    pyfoliozer = strat.analyzers.getbyname('pyfolio')
-    returns, positions, transactions, gross_lev = pyfoliozer.get_pf_items()
-    
-    cum_return = ep.cum_returns_final(returns)
-    sharpe_ratio = ep.sharpe_ratio(returns)
-    mdd = ep.max_drawdown(returns)
-    
-    output.append({
-        'ma_short': strat.params.ma_short,
-        'ma_medium': strat.params.ma_medium,
-        'ma_long': strat.params.ma_long,
-        'stop_loss_pct': strat.params.stop_loss_pct,
-        'take_profit_pct': strat.params.take_profit_pct,
-        'cum_return': cum_return,
-        'sharpe_ratio': sharpe_ratio,
-        'max_drawdown': mdd
-    })
-
-df_output = pd.DataFrame(output)
-df_output.to_excel('optimization_results.xlsx', index=False)
-print('結果已保存到 optimization_results.xlsx')
-
-# %%
\ No newline at end of file
+# 子行程會重新匯入本檔，回測只在主行程執行
+if __name__ == '__main__':
+    # 參數範圍
+    ma_short_values = [3, 5, 10]
+    ma_medium_values = [15, 20, 30]
+    ma_long_values = [40, 60, 90]
+    stop_loss_values = [0.02, 0.01, 0.03, 0.05]
+    take_profit_values = [0.02, 0.01, 0.03, 0.05]
+
+    # 策略的排列組合
+    combos = param_grid(ma_short=ma_short_values,
+                        ma_medium=ma_medium_values,
+                        ma_long=ma_long_values,
+                        stop_loss_pct=stop_loss_values,
+                        take_profit_pct=take_profit_values)
+
+    # 網格中用到的均線只有 9 條，各算一次後與K線一起放在共享記憶體，所有組合共用
+    indicators = ([('sma', 'close', p) for p in ma_short_values + ma_medium_values + ma_long_values] +
+                  [('sma', 'volume', p) for p in ma_short_values + ma_long_values])
+
+    # 以行程池執行回測，讀取與本檔同目錄的 TXF_30.csv，K線放在共享記憶體
+    # 初始資金 300000、手續費 200、保證金 167000、每點 200 元
+    # 每完成一組就寫入 SQLite，中斷後重新執行只會跑尚未完成的組合
+    with ResultStore('optimization_results.sqlite') as store:
+        df_output = optimize(MA_Volume_Strategy, combos,
+                             csv_path=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'TXF_30.csv'),
+                             indicators=indicators,
+                             metrics=streaming_metrics,
+                             analyzers=[(StreamingMetrics, {'_name': 'metrics'})],
+                             store=store)
+
+    # 匯出成 Excel
+    df_output.to_excel('optimization_results.xlsx', index=False)
+    print('結果已保存到 optimization_results.xlsx')
+
+# %%
@@ -1,14 +1,18 @@
-import datetime
+import os
+import sys
 import backtrader as bt
-import pandas as pd
-import calendar
-from datetime import datetime
-import empyrical as ep
-import pyfolio as pf
-import itertools
 import warnings
 warnings.filterwarnings('ignore')
 
+# 專案根目錄加入模組搜尋路徑，以便匯入 Chapter3.utils
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+from Chapter3.utils.analyzers import StreamingMetrics, streaming_metrics
+from Chapter3.utils.optimizer import optimize, param_grid
+from Chapter3.utils.result_store import ResultStore
+from Chapter3.utils.indicators import highest_prev, lowest_prev
+
 import collections
 import collections.abc
 
@@ -25,10 +29,6 @@ if not hasattr(collections, 'MutableSequence'):
 if not hasattr(collections, 'Sequence'):
     collections.Sequence = collections.abc.Sequence
 
-def option_expiration(date):
-    day = 21 - (calendar.weekday(date.year, date.month, 1) + 4) % 7
-    return datetime(date.year, date.month, day)  
-
 class High_Low_Strategy(bt.Strategy):
     params = (
         ('period', 18),            # 回溯週期長度
@@ -47,8 +47,8 @@ class High_Low_Strategy(bt.Strategy):
         self.dataclose = self.datas[0].close
 
         # 計算過去 18 根K線的最高價和最低價 (不包含當前K線)
-        self.highest_prev = bt.indicators.Highest(self.datahigh(-1), period=self.params.period)
-        self.lowest_prev = bt.indicators.Lowest(self.datalow(-1), period=self.params.period)
+        self.highest_prev = highest_prev(self.datas[0], self.params.period)
+        self.lowest_prev = lowest_prev(self.datas[0], self.params.period)
 
         self.order = None
 
@@ -106,15 +106,12 @@ class High_Low_Strategy(bt.Strategy):
         position_size = self.getposition().size
         # print(f"position_size: {position_size}")
 
-        if (
-            option_expiration(self.datas[0].datetime.date(0)).day
-            == self.datas[0].datetime.datetime(0).day
-        ):
-            if self.datas[0].datetime.datetime(0).day >= 13:
-                status = "end"
-                if position_size != 0:
-                    self.close()
-                    self.log("Expired and Create Close Order")
+        # 結算日 13:00 之後平倉，當天不再進場
+        if self.datas[0].is_settlement_day[0] and self.datas[0].datetime.time(0).hour >= 13:
+            status = "end"
+            if position_size != 0:
+                self.close()
+                self.log("Expired and Create Close Order")
         
         # 進場條件
         if status != "end": # 如果不是到期日
@@ -157,71 +154,33 @@ class High_Low_Strategy(bt.Strategy):
                         self.order = self.close()
                         self.log("平空單 - 止損條件達成")
 
-cerebro = bt.Cerebro()
-# /Users/houguanyu/Documents/code/python/stock/Quant/PythonQuantrading/Chapter3/3-3
-df = pd.read_csv('/Users/houguanyu/Documents/code/python/stock/Quant/PythonQuantrading/Chapter3/3-3/TXF_30.csv')
-df = df.dropna()
-df['Date'] = pd.to_datetime(df['Date'])
-df.index= df['Date']
-df = df.between_time('08:45','13:45')
-data_feed = bt.feeds.PandasData(
-    dataname=df,
-    name='TXF',
-    datetime=0,
-    high=2,
-    low=3,
-    open=1,
-    close=4,
-    volume=5,
-    plot=False
-)
-
-cerebro.adddata(data_feed, name='TXF')
-
-# 參數優化範圍
-period_values = [3, 5, 10, 15, 18, 25, 50, 90, 150]
-stop_loss_pct_values = [0.01, 0.02, 0.03, 0.04, 0.05]
-exit_pct_value = [0.01, 0.02, 0.03, 0.04, 0.05]
-
-# 新增策略的排列組合
-cerebro.optstrategy(High_Low_Strategy,
-                    period=period_values,
-                    stop_loss_pct=stop_loss_pct_values,
-                    exit_pct=exit_pct_value
-                    )
-
-# 設定初始資金和交易成本
-cerebro.broker.setcash(300000.0)
-cerebro.broker.setcommission(commission=200, margin=167000, mult=200)
-
-# 新增PyFolio分析器
-cerebro.addanalyzer(bt.analyzers.PyFolio, _name='pyfolio')
-
-results = cerebro.run(maxcpus=1)
-
-# 儲存結果為 Excel 檔案
-output = []
-for result in results:
-    strat = result[0]
-    pyfoliozer = strat.analyzers.getbyname('pyfolio')
-    returns, positions, transactions, gross_lev = pyfoliozer.get_pf_items()
-
-    cum_return = ep.cum_returns_final(returns)
-    sharpe_ratio = ep.sharpe_ratio(returns)
-    mdd = ep.max_drawdown(returns)
-
-    output.append({
-        'period': strat.params.period,
-        'stop_loss_pct': strat.params.stop_loss_pct,
-        'exit_pct': strat.params.exit_pct,
-        'cum_return': cum_return,
-        'sharpe_ratio': sharpe_ratio,
-        'max_drawdown': mdd
-    })
-
-
-df_output = pd.DataFrame(output)
-df_output.to_excel('futures_highest_high_lowest_low_bt_optimize_results.xlsx', index=False)
-print('Optimization results saved to futures_highest_high_lowest_low_bt_optimize_results.xlsx')
-
-                 
\ No newline at end of file
+# 子行程會重新匯入本檔，回測只在主行程執行
+if __name__ == '__main__':
+    # 參數優化範圍
+    period_values = [3, 5, 10, 15, 18, 25, 50, 90, 150]
+    stop_loss_pct_values = [0.01, 0.02, 0.03, 0.04, 0.05]
+    exit_pct_value = [0.01, 0.02, 0.03, 0.04, 0.05]
+
+    # 策略的排列組合
+    combos = param_grid(period=period_values,
+                        stop_loss_pct=stop_loss_pct_values,
+                        exit_pct=exit_pct_value)
+
+    # 每個回溯週期的通道上下軌只算一次，同一週期的 25 組停損/出場參數共用
+    indicators = ([('highest_prev', 'high', p) for p in period_values] +
+                  [('lowest_prev', 'low', p) for p in period_values])
+
+    # 以行程池執行回測，讀取與本檔同目錄的 TXF_30.csv，K線放在共享記憶體
+    # 初始資金 300000、手續費 200、保證金 167000、每點 200 元
+    # 每完成一組就寫入 SQLite，中斷後重新執行只會跑尚未完成的組合
+    with ResultStore('futures_highest_high_lowest_low_bt_optimize_results.sqlite') as store:
+        df_output = optimize(High_Low_Strategy, combos,
+                             csv_path=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'TXF_30.csv'),
+                             indicators=indicators,
+                             metrics=streaming_metrics,
+                             analyzers=[(StreamingMetrics, {'_name': 'metrics'})],
+                             store=store)
+
+    # 匯出成 Excel 檔案
+    df_output.to_excel('futures_highest_high_lowest_low_bt_optimize_results.xlsx', index=False)
+    print('Optimization results saved to futures_highest_high_lowest_low_bt_optimize_results.xlsx')
@@ -1,19 +1,14 @@
-# import backtrader as bt
-# import calendar
-import datetime
 import backtrader as bt
-import pandas as pd
-import calendar
-from datetime import datetime
-import empyrical as ep
-import pyfolio as pf
-import itertools
+import os
+import sys
 import warnings
 warnings.filterwarnings('ignore')
 
-def option_expiration(date):
-    day = 21 - (calendar.weekday(date.year, date.month, 1) + 4) % 7
-    return datetime(date.year, date.month, day)  # type: ignore
+# 專案根目錄加入模組搜尋路徑，以便匯入 Chapter3.utils
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+from Chapter3.utils.indicators import sma
 
 class MA_Volume_Strategy(bt.Strategy):
     params = (
@@ -37,20 +32,20 @@ class MA_Volume_Strategy(bt.Strategy):
         self.datavolume = self.datas[0].volume
 
         # 移動平均線
-        self.ma_short = bt.indicators.SMA(self.dataclose, period=self.params.ma_short)
-        self.ma_medium = bt.indicators.SMA(self.dataclose, period=self.params.ma_medium)
-        self.ma_long = bt.indicators.SMA(self.dataclose, period=self.params.ma_long)
+        self.ma_short = sma(self.datas[0], 'close', self.params.ma_short)
+        self.ma_medium = sma(self.datas[0], 'close', self.params.ma_medium)
+        self.ma_long = sma(self.datas[0], 'close', self.params.ma_long)
 
         # 成交價移動平均線
-        self.vol_ma_short = bt.indicators.SMA(self.datavolume, period=self.params.ma_short)
-        self.vol_ma_long = bt.indicators.SMA(self.datavolume, period=self.params.ma_long)
+        self.vol_ma_short = sma(self.datas[0], 'volume', self.params.ma_short)
+        self.vol_ma_long = sma(self.datas[0], 'volume', self.params.ma_long)
 
         self.order = None
 
     def notify_order(self, order):
         if order.status in [order.Submitted, order.Accepted]:
             return 
-        if order.status in [order.Complete]:
+        if order.status in [order.Completed]:
             if order.isbuy():
                 self.log(f"""BUY EXECUTED, Price: {order.executed.price:.2f},
                          Cost: {order.executed.value:.2f},
@@ -77,52 +72,49 @@ class MA_Volume_Strategy(bt.Strategy):
         position_price = self.getposition().price
 
         status = None
-        if (
-            option_expiration(self.datas[0].datetime.datetime(0))
-            == self.datas[0].datetime.datetime(0).day
-        ):
-            if self.datas[0].datetime.datetime(0).hour >= 13:
-                status = "end"
-                if position_size != 0:
-                    self.close()
-                    self.log("Expired and Create Close Order")
+        # 結算日 13:00 之後平倉，當天不再進場
+        if self.datas[0].is_settlement_day[0] and self.datas[0].datetime.time(0).hour >= 13:
+            status = "end"
+            if position_size != 0:
+                self.close()
+                self.log("Expired and Create Close Order")
 
-            if status != "end":
-                if not position_size:
-                    # 多頭進場條件
-                    if (self.dataclose[0] > self.ma_short[0] and
-                        self.dataclose[0] > self.ma_medium[0] and 
-                        self.dataclose[0] > self.ma_long[0] and 
-                        self.vol_ma_short[0] > self.vol_ma_long[0]):
-                        self.order = self.buy()
-                        self.log("創建買單")
-                    # 空頭進場條件
-                    elif (self.dataclose[0] < self.ma_short[0] and
-                          self.dataclose[0] < self.ma_medium[0] and 
-                          self.dataclose[0] < self.ma_long[0] and 
-                          self.vol_ma_short[0] < self.vol_ma_long[0]):
-                        self.order = self.sell()
-                        self.log("創建賣單")
-                else:
-                    # 已有持倉，檢查出場條件
-                    if position_size > 0:
-                        stop_loss_price = position_price * (1 - self.params.stop_loss_pct)
-                        taks_profit_price = position_price * (1 + self.params.take_profit_pct)
-                        # 多頭持倉
-                        if self.dataclose[0] <= stop_loss_price:
-                            self.oreder = self.close()
-                            self.log("平多單 - 止損")
-                        elif self.dataclose[0] >= taks_profit_price:
-                            self.order = self.close()
-                            self.log("平多單 - 停利")
+        if status != "end":
+            if not position_size:
+                # 多頭進場條件
+                if (self.dataclose[0] > self.ma_short[0] and
+                    self.dataclose[0] > self.ma_medium[0] and
+                    self.dataclose[0] > self.ma_long[0] and
+                    self.vol_ma_short[0] > self.vol_ma_long[0]):
+                    self.order = self.buy()
+                    self.log("創建買單")
+                # 空頭進場條件
+                elif (self.dataclose[0] < self.ma_short[0] and
+                      self.dataclose[0] < self.ma_medium[0] and
+                      self.dataclose[0] < self.ma_long[0] and
+                      self.vol_ma_short[0] < self.vol_ma_long[0]):
+                    self.order = self.sell()
+                    self.log("創建賣單")
+            else:
+                # 已有持倉，檢查出場條件
+                if position_size > 0:
+                    stop_loss_price = position_price * (1 - self.params.stop_loss_pct)
+                    take_profit_price = position_price * (1 + self.params.take_profit_pct)
+                    # 多頭持倉
+                    if self.dataclose[0] >= take_profit_price:
+                        self.order = self.close()
+                        self.log("平多單 - 停利")
+                    elif self.dataclose[0] <= stop_loss_price:
+                        self.order = self.close()
+                        self.log("平多單 - 止損")
 
-                    elif position_size < 0:
-                        stop_loss_price = position_price * (1 + self.params.stop_loss_pct)
-                        taks_profit_price = position_price * (1 - self.params.take_profit_pct)
-                        # 空頭持倉
-                        if self.dataclose[0] <= taks_profit_price:
-                            self.order = self.close()
-                            self.log("平空單 - 停利")
-                        elif self.dataclose[0] >= stop_loss_price:
-                            self.order = self.close()
-                            self.log("平空單 - 止損")
\ No newline at end of file
+                elif position_size < 0:
+                    stop_loss_price = position_price * (1 + self.params.stop_loss_pct)
+                    take_profit_price = position_price * (1 - self.params.take_profit_pct)
+                    # 空頭持倉
+                    if self.dataclose[0] <= take_profit_price:
+                        self.order = self.close()
+                        self.log("平空單 - 停利")
+                    elif self.dataclose[0] >= stop_loss_price:
+                        self.order = self.close()
+                        self.log("平空單 - 止損")
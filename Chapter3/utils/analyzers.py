@@ -0,0 +1,82 @@
+# backtrader 分析器
+# 參數最佳化時每組參數只需要幾個績效數字，不必像 PyFolio 分析器保存完整的報酬、持倉與成交紀錄
+# 再交給 empyrical 計算；StreamingMetrics 逐根K棒累計，記憶體用量固定，回測結束即得到結果
+import math
+
+import backtrader as bt
+
+
+class StreamingMetrics(bt.Analyzer):
+    """
+    以日報酬逐日累計的績效指標，定義與 PyFolio 分析器的 returns 加上 empyrical 相同:
+    每天最後一根K棒的帳戶價值相對前一天(第一天相對初始資金)為日報酬，
+    累積報酬為日報酬連乘，波動度與夏普比率以樣本標準差年化，最大回撤以初始資金為起點。
+
+    Args:
+        annualization: 年化的交易日數
+    """
+
+    params = (("annualization", 252),)
+
+    def start(self):
+        self._day = None
+        self._value = self._day_start = self.strategy.broker.getvalue()
+        # 日報酬的筆數、平均與離均差平方和(Welford)
+        self._count = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._wealth = self._peak = 1.0
+        self._drawdown = 0.0
+        self._trades = 0
+        self._wins = 0
+
+    def _close_day(self):
+        ret = self._value / self._day_start - 1.0
+        self._count += 1
+        delta = ret - self._mean
+        self._mean += delta / self._count
+        self._m2 += delta * (ret - self._mean)
+        self._wealth *= 1.0 + ret
+        self._peak = max(self._peak, self._wealth)
+        self._drawdown = min(self._drawdown, self._wealth / self._peak - 1.0)
+        self._day_start = self._value
+
+    def next(self):
+        day = self.strategy.datetime.date(0)
+        if self._day is not None and day != self._day:
+            self._close_day()
+        self._day = day
+        self._value = self.strategy.broker.getvalue()
+
+    def notify_trade(self, trade):
+        if trade.isclosed:
+            self._trades += 1
+            self._wins += trade.pnlcomm > 0
+
+    def stop(self):
+        if self._day is not None:
+            self._close_day()
+            self._day = None
+
+    def get_analysis(self):
+        """
+        Returns:
+            dict: cum_return、annual_volatility、sharpe_ratio、max_drawdown、trades、win_rate
+        """
+        std = math.sqrt(self._m2 / (self._count - 1)) if self._count > 1 else math.nan
+        factor = math.sqrt(self.p.annualization)
+        return {
+            "cum_return": self._wealth - 1.0,
+            "annual_volatility": std * factor,
+            "sharpe_ratio": self._mean / std * factor if std > 0 else math.nan,
+            "max_drawdown": self._drawdown,
+            "trades": self._trades,
+            "win_rate": self._wins / self._trades if self._trades else math.nan,
+        }
+
+
+def streaming_metrics(strat):
+    """
+    optimizer 的評估函數，需搭配 analyzers=[(StreamingMetrics, {"_name": "metrics"})]。
+    """
+    return strat.analyzers.getbyname("metrics").get_analysis()
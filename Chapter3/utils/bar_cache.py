@@ -0,0 +1,180 @@
+# TXF_30.csv 的二進位快取
+# 第一次讀取時把 CSV 解析成結構化陣列(時間 + OHLCV)存成 .npy，並另存早盤K棒的列位置索引，
+# 之後的腳本、筆記本與最佳化的子行程都以記憶體映射載入，不必重新解析 CSV 與時間字串
+import os
+
+import backtrader as bt
+import numpy as np
+import pandas as pd
+
+from Chapter3.utils.settlement import SettlementPandasData, add_settlement_columns
+
+# resample 筆記本產生的 30 分K
+TXF_30_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "3-1", "TXF_30.csv"
+)
+
+# 交易時段的K棒時間範圍(含頭尾)，與 between_time 相同
+SESSION_TIMES = {"day": ("08:45", "13:45"), "night": ("15:00", "05:00")}
+
+
+def _cache_paths(csv_path):
+    root = os.path.splitext(csv_path)[0]
+    return f"{root}.bars.npy", f"{root}.day.npy"
+
+
+def _session_mask(dates, session):
+    # 依K棒時間判斷是否在交易時段內，跨午夜的時段為兩段的聯集
+    start, end = SESSION_TIMES[session]
+    clock = pd.DatetimeIndex(dates).strftime("%H:%M")
+    if start <= end:
+        return np.asarray((clock >= start) & (clock <= end))
+    return np.asarray((clock >= start) | (clock <= end))
+
+
+def build_bar_cache(csv_path=TXF_30_PATH):
+    """
+    解析 K 線 CSV 並寫入快取，CSV 中有空值的列會先移除。
+
+    Returns:
+        Tuple[str, str]: (K線陣列路徑, 早盤列位置索引路徑)
+    """
+    bars_path, day_path = _cache_paths(csv_path)
+    df = pd.read_csv(csv_path).dropna()
+    dates = pd.to_datetime(df["Date"])
+    columns = [c for c in df.columns if c != "Date"]
+    dtype = [("Date", "datetime64[ns]")] + [(c, df[c].dtype.str) for c in columns]
+    bars = np.empty(len(df), dtype=dtype)
+    bars["Date"] = dates.to_numpy(dtype="datetime64[ns]")
+    for c in columns:
+        bars[c] = df[c].to_numpy()
+    np.save(bars_path, bars)
+    np.save(day_path, np.flatnonzero(_session_mask(bars["Date"], "day")))
+    return bars_path, day_path
+
+
+def load_bar_array(csv_path=TXF_30_PATH, session=None):
+    """
+    以記憶體映射載入快取的結構化陣列，快取不存在或比 CSV 舊時會先重建。
+
+    Args:
+        csv_path: K 線 CSV 路徑
+        session: None 表示所有K棒，"day" 只取早盤，"night" 只取夜盤
+    Returns:
+        np.ndarray: 欄位為 Date/Open/High/Low/Close/Volume 的結構化陣列
+    """
+    bars_path, day_path = _cache_paths(csv_path)
+    stale = not os.path.isfile(bars_path) or os.path.getmtime(
+        bars_path
+    ) < os.path.getmtime(csv_path)
+    if stale:
+        build_bar_cache(csv_path)
+    bars = np.load(bars_path, mmap_mode="r")
+    if session is None:
+        return bars
+    if session == "day":
+        return bars[np.load(day_path)]
+    if session not in SESSION_TIMES:
+        raise ValueError(f"不支援的交易時段 {session}")
+    return bars[_session_mask(bars["Date"], session)]
+
+
+def load_txf_bars(csv_path=TXF_30_PATH, session="day"):
+    """
+    讀取台指期 K 線，結果與原本的
+    read_csv → dropna → to_datetime → set index → between_time('08:45', '13:45') 相同。
+
+    Args:
+        csv_path: K 線 CSV 路徑
+        session: "day"(預設)、"night" 或 None
+    Returns:
+        pd.DataFrame: 第 0 欄為 Date、索引也是 Date，可直接傳給 bt.feeds.PandasData(datetime=0)
+    """
+    bars = load_bar_array(csv_path, session)
+    dates = pd.DatetimeIndex(np.asarray(bars["Date"]), name="Date")
+    df = pd.DataFrame({"Date": dates}, index=dates)
+    for c in bars.dtype.names[1:]:
+        df[c] = np.asarray(bars[c])
+    return df
+
+
+class _ColumnLoadMixin(object):
+    # PandasData 每根K棒每個欄位都以 DataFrame.iloc 取值，回測時間大多花在讀資料；
+    # 改為開始時把各欄位一次轉成 list，之後每根K棒只依位置取值，載入的數值完全相同
+
+    def start(self):
+        super(_ColumnLoadMixin, self).start()
+        df = self.p.dataname
+        self._columns = []
+        for field in self.getlinealiases():
+            col = self._colmapping[field]
+            if field == "datetime" or col is None:
+                continue
+            self._columns.append((getattr(self.lines, field), df.iloc[:, col].tolist()))
+        col = self._colmapping["datetime"]
+        stamps = df.index if col is None else df.iloc[:, col]
+        self._dtnums = [
+            bt.date2num(dt) for dt in pd.DatetimeIndex(stamps).to_pydatetime()
+        ]
+
+    def _load(self):
+        self._idx += 1
+        if self._idx >= len(self._dtnums):
+            return False
+        for line, values in self._columns:
+            line[0] = values[self._idx]
+        self.lines.datetime[0] = self._dtnums[self._idx]
+        return True
+
+
+class TXFData(_ColumnLoadMixin, bt.feeds.PandasData):
+    """
+    載入方式較快的 PandasData。
+    """
+
+
+class TXFSettlementData(_ColumnLoadMixin, SettlementPandasData):
+    """
+    載入方式較快的 SettlementPandasData。
+    """
+
+
+def bars_feed(df, name="TXF", plot=False):
+    """
+    由 load_txf_bars 格式的 DataFrame 建立 backtrader 資料來源，
+    有 is_settlement_day / minutes_to_settlement 欄位時一併載入成資料線。
+
+    Returns:
+        bt.feeds.PandasData
+    """
+    feed = TXFData
+    if "is_settlement_day" in df.columns:
+        feed = TXFSettlementData
+    return feed(
+        dataname=df,
+        name=name,
+        datetime=0,
+        high=2,
+        low=3,
+        open=1,
+        close=4,
+        volume=5,
+        plot=plot,
+    )
+
+
+def txf_feed(
+    csv_path=TXF_30_PATH, session="day", name="TXF", plot=False, settlement=False
+):
+    """
+    建立台指期 K 線的 backtrader 資料來源。
+
+    Args:
+        settlement: 是否加上 is_settlement_day / minutes_to_settlement 兩條線
+    Returns:
+        bt.feeds.PandasData
+    """
+    df = load_txf_bars(csv_path, session)
+    if settlement:
+        df = add_settlement_columns(df)
+    return bars_feed(df, name, plot)
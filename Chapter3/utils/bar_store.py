@@ -0,0 +1,141 @@
+# 多週期K線資料庫
+# 讀取一次分K就同時產生所有設定的週期(5/15/30/60 分K與日K)，
+# 每個週期每個欄位存成一個 .npy 檔，查詢時以記憶體映射(mmap)載入並以二分搜尋取出日期區間，
+# 不必重新解析 CSV
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from Chapter3.utils.resample import COLUMNS, SESSIONS, BarAggregator
+
+# 只含早盤的時段，Chapter3 的策略只交易早盤
+DAY_SESSION = (("08:45", "13:45"),)
+
+# 週期名稱 -> (K棒分鐘數, 交易時段)；日K為整個早盤一根K棒，標籤為 13:45
+TIMEFRAMES = {
+    "5min": (5, SESSIONS),
+    "15min": (15, SESSIONS),
+    "30min": (30, SESSIONS),
+    "60min": (60, SESSIONS),
+    "D": (300, DAY_SESSION),
+}
+
+
+def build_bar_store(minute_path, root, timeframes=None, chunksize=500_000):
+    """
+    分段讀取分K檔一次，同時產生所有週期的K線並存入 root。
+
+    Args:
+        minute_path: 分K檔案路徑(例如 TXF.csv)，需依時間排序
+        root: 資料庫目錄
+        timeframes: 週期名稱 -> (K棒分鐘數, 交易時段)，預設為 TIMEFRAMES
+        chunksize: 每段讀取的分K筆數
+    Returns:
+        BarStore: 建立完成的資料庫
+    """
+    timeframes = TIMEFRAMES if timeframes is None else timeframes
+    aggregators = {
+        name: BarAggregator(minutes, sessions)
+        for name, (minutes, sessions) in timeframes.items()
+    }
+    parts = {name: [] for name in timeframes}
+    for chunk in pd.read_csv(minute_path, chunksize=chunksize):
+        # 每段只解析一次時間，再交給各週期彙總
+        chunk = chunk.set_index(pd.DatetimeIndex(pd.to_datetime(chunk["Date"])))
+        for name, agg in aggregators.items():
+            bars = agg.update(chunk)
+            if not len(bars):
+                continue
+            done = parts[name]
+            # 第一根與前一段最後一根同一時間時，是該K棒更新後的結果
+            if done and done[-1].index[-1] == bars.index[0]:
+                done[-1] = done[-1].iloc[:-1]
+            done.append(bars)
+    meta = {}
+    for name, (minutes, sessions) in timeframes.items():
+        bars = pd.concat(parts[name]) if parts[name] else None
+        folder = os.path.join(root, name)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        dates = np.array([], dtype="datetime64[ns]") if bars is None else bars.index
+        np.save(os.path.join(folder, "Date.npy"), np.asarray(dates, "datetime64[ns]"))
+        for c in COLUMNS:
+            values = np.array([]) if bars is None else bars[c].to_numpy()
+            np.save(os.path.join(folder, f"{c}.npy"), values)
+        meta[name] = {
+            "minutes": minutes,
+            "sessions": [list(s) for s in sessions],
+            "rows": 0 if bars is None else len(bars),
+        }
+    with open(os.path.join(root, "meta.json"), "w") as f:
+        json.dump(
+            {"source": os.path.basename(minute_path), "timeframes": meta}, f, indent=2
+        )
+    return BarStore(root)
+
+
+class BarStore(object):
+    """
+    build_bar_store 建立的多週期K線資料庫。
+
+    Args:
+        root: 資料庫目錄
+    """
+
+    def __init__(self, root):
+        self.root = root
+        with open(os.path.join(root, "meta.json")) as f:
+            self.meta = json.load(f)["timeframes"]
+        self._arrays = {}
+
+    @property
+    def timeframes(self):
+        return list(self.meta)
+
+    def _load(self, timeframe):
+        if timeframe not in self.meta:
+            raise KeyError(f"資料庫中沒有週期 {timeframe}，可用的週期: {self.timeframes}")
+        if timeframe not in self._arrays:
+            folder = os.path.join(self.root, timeframe)
+            self._arrays[timeframe] = {
+                c: np.load(os.path.join(folder, f"{c}.npy"), mmap_mode="r")
+                for c in ["Date"] + COLUMNS
+            }
+        return self._arrays[timeframe]
+
+    def arrays(self, timeframe, start=None, end=None):
+        """
+        取得日期區間內各欄位的陣列，為記憶體映射的切片，不會複製資料。
+
+        Args:
+            timeframe: 週期名稱
+            start, end: 區間的開始與結束時間(含頭尾)，None 表示不限
+        Returns:
+            dict: 欄位名稱(Date/Open/High/Low/Close/Volume) -> np.ndarray
+        """
+        arrays = self._load(timeframe)
+        dates = arrays["Date"]
+        lo, hi = 0, len(dates)
+        if start is not None:
+            lo = np.searchsorted(dates, np.datetime64(pd.Timestamp(start), "ns"), "left")
+        if end is not None:
+            hi = np.searchsorted(dates, np.datetime64(pd.Timestamp(end), "ns"), "right")
+        return {c: values[lo:hi] for c, values in arrays.items()}
+
+    def query(self, timeframe, start=None, end=None):
+        """
+        以 DataFrame 取得日期區間內的K線，格式與 TXF_30.csv 讀入後相同。
+
+        Args:
+            timeframe: 週期名稱
+            start, end: 區間的開始與結束時間(含頭尾)，None 表示不限
+        Returns:
+            pd.DataFrame: 以 Date 為索引的 Open/High/Low/Close/Volume
+        """
+        arrays = self.arrays(timeframe, start, end)
+        return pd.DataFrame(
+            {c: np.array(arrays[c]) for c in COLUMNS},
+            index=pd.DatetimeIndex(np.array(arrays["Date"]), name="Date"),
+        )
@@ -0,0 +1,91 @@
+# 逐次減半(successive halving)參數搜尋
+# 先以前一小段K棒評估所有參數組合，只保留表現最好的 1/eta 進入下一輪，下一輪的資料長度乘以 eta，
+# 最後一輪才用全部資料。細網格中大部分組合只在短資料上跑過一次，總計算量約為完整網格的幾分之一。
+# 每一輪都以 optimizer.iter_optimize 的行程池平行執行，策略類別與評估函數不需修改
+import math
+import time
+
+import numpy as np
+import pandas as pd
+
+from Chapter3.utils.bar_cache import TXF_30_PATH, load_txf_bars
+from Chapter3.utils.optimizer import iter_optimize
+from Chapter3.utils.settlement import add_settlement_columns
+
+
+def halving_fractions(eta=3, min_fraction=1 / 9):
+    """
+    各輪使用的資料比例，由小到大，最後一輪為 1。
+
+    Args:
+        eta: 每輪保留 1/eta 的組合，資料長度乘以 eta
+        min_fraction: 第一輪資料比例的下限
+    Returns:
+        List[float]
+    """
+    rungs = int(math.floor(math.log(1 / min_fraction, eta) + 1e-9))
+    return [eta ** -(rungs - k) for k in range(rungs + 1)]
+
+
+def _score(rows, objective):
+    # 目標值越大越好，NaN(例如資料太短沒有交易)排在最後
+    values = np.array([row.get(objective, np.nan) for row in rows], dtype=np.float64)
+    return np.where(np.isnan(values), -np.inf, values)
+
+
+def successive_halving(
+    strategy,
+    combos,
+    objective="sharpe_ratio",
+    eta=3,
+    min_fraction=1 / 9,
+    data=None,
+    csv_path=TXF_30_PATH,
+    progress=True,
+    **kwargs,
+):
+    """
+    以逐次減半搜尋參數。第一輪用前 min_fraction 的K棒評估所有組合，
+    每輪依 objective 保留前 1/eta 的組合並把資料長度乘以 eta，直到用完整資料評估。
+
+    Args:
+        strategy: backtrader 策略類別
+        combos: 參數組合(dict)的序列
+        objective: metrics 回傳的欄位名稱，越大越好，例如 "sharpe_ratio"、"cum_return"
+        eta: 每輪保留 1/eta 的組合
+        min_fraction: 第一輪使用的資料比例下限，需足以涵蓋最長指標的暖身期
+        data: load_txf_bars 格式且已加上結算日欄位的 K 線，預設讀取 csv_path 的早盤K棒
+        csv_path: data 為 None 時讀取的 K 線 CSV
+        progress: 是否顯示每輪的進度
+        kwargs: 傳給 iter_optimize 的其他參數，例如 metrics、analyzers、indicators、processes
+    Returns:
+        Tuple[pd.DataFrame, pd.DataFrame]: (最後一輪的結果，依 objective 由大到小排列,
+            各輪所有評估結果，另有 rung 與 bars 兩欄)
+    """
+    if data is None:
+        data = add_settlement_columns(load_txf_bars(csv_path))
+    survivors = list(combos)
+    fractions = halving_fractions(eta, min_fraction)
+    history = []
+    for rung, fraction in enumerate(fractions):
+        bars = max(1, int(round(len(data) * fraction)))
+        start = time.time()
+        rows = list(iter_optimize(strategy, survivors, data=data.iloc[:bars], **kwargs))
+        if progress:
+            print(
+                f"第 {rung + 1}/{len(fractions)} 輪: {len(rows)} 組，"
+                f"前 {bars} 根K棒，{time.time() - start:.0f} 秒"
+            )
+        for row in rows:
+            history.append(dict(row, rung=rung, bars=bars))
+        # 依分數由大到小排列，同分時維持原本的組合順序
+        names = list(survivors[0]) if survivors else []
+        order = {tuple(c[n] for n in names): i for i, c in enumerate(survivors)}
+        rows.sort(key=lambda r: order[tuple(r[n] for n in names)])
+        rank = np.argsort(-_score(rows, objective), kind="stable")
+        rows = [rows[i] for i in rank]
+        if rung == len(fractions) - 1:
+            break
+        keep = max(1, int(math.ceil(len(rows) / eta)))
+        survivors = [{n: row[n] for n in names} for row in rows[:keep]]
+    return pd.DataFrame(rows), pd.DataFrame(history)
@@ -0,0 +1,129 @@
+# backtrader 指標
+# 以單調佇列(逐根K線)與 van Herk/Gil-Werman 區塊掃描(整段資料)計算通道上下軌，
+# 每根K線的計算量與回溯週期長度無關，取代 bt.indicators.Highest / Lowest 的逐窗口 max()/min()
+# 參數最佳化時 sma / highest_prev / lowest_prev 可改用預先計算的陣列，同一指標在所有參數組合間共用
+from array import array
+
+import backtrader as bt
+import numpy as np
+
+from Chapter2.utils.kernels import RollingExtrema, rolling_extrema
+
+
+class _RollingExtremaIndicator(bt.Indicator):
+    params = (("period", 18),)
+    kind = "max"
+
+    def __init__(self):
+        self.addminperiod(self.p.period)
+
+    def nextstart(self):
+        # 第一根完整的K線: 用最近 period 根資料建立佇列，之後每根K線只加入一筆
+        self.extrema = RollingExtrema(self.p.period, self.kind)
+        for value in self.data.get(size=self.p.period):
+            value, _ = self.extrema.update(value)
+        self.lines[0][0] = value
+
+    def next(self):
+        self.lines[0][0] = self.extrema.update(self.data[0])[0]
+
+    def once(self, start, end):
+        # runonce 模式一次取得整段資料，直接對全部K線做區塊掃描
+        values = np.asarray(self.data.array[:end], dtype=np.float64)
+        res, _ = rolling_extrema(values, self.p.period, self.kind)
+        self.lines[0].array[start:end] = array("d", res[start:end])
+
+
+class RollingHighest(_RollingExtremaIndicator):
+    """
+    過去 period 根K線的最高值，數值與 bt.indicators.Highest 相同。
+
+    Args:
+        period: 回溯週期長度
+    """
+
+    lines = ("highest",)
+    kind = "max"
+
+
+class RollingLowest(_RollingExtremaIndicator):
+    """
+    過去 period 根K線的最低值，數值與 bt.indicators.Lowest 相同。
+
+    Args:
+        period: 回溯週期長度
+    """
+
+    lines = ("lowest",)
+    kind = "min"
+
+
+# 預先計算的指標鍵值 (種類, 欄位, 期數) 的暖身期；*_prev 以前一根K棒計算，多一根
+def indicator_minperiod(key):
+    kind, _, period = key
+    return period + 1 if kind in ("highest_prev", "lowest_prev") else period
+
+
+class CachedLine(bt.Indicator):
+    """
+    以預先計算好的陣列作為指標值，暖身期與原本的指標相同。
+    參數最佳化時每個指標只計算一次，所有策略實例共用同一份陣列。
+
+    Args:
+        values: 與資料等長的指標陣列
+        minperiod: 暖身期
+    """
+
+    lines = ("value",)
+    params = (("values", None), ("minperiod", 1))
+
+    def __init__(self):
+        self.addminperiod(self.p.minperiod)
+
+    def next(self):
+        self.lines[0][0] = self.p.values[len(self) - 1]
+
+    def once(self, start, end):
+        self.lines[0].array[start:end] = array("d", self.p.values[start:end])
+
+
+def _cached(data, key, build):
+    # 資料來源帶有 indicator_cache 且含此指標時直接使用，否則照常計算
+    cache = getattr(data, "indicator_cache", None)
+    if cache is not None and key in cache:
+        return CachedLine(data, values=cache[key], minperiod=indicator_minperiod(key))
+    return build()
+
+
+def sma(data, column, period):
+    """
+    簡單移動平均，等同 bt.indicators.SMA(getattr(data, column), period=period)，
+    資料來源有預先計算的 ("sma", column, period) 時直接取用。
+    """
+    return _cached(
+        data,
+        ("sma", column, period),
+        lambda: bt.indicators.SMA(getattr(data, column), period=period),
+    )
+
+
+def highest_prev(data, period, column="high"):
+    """
+    前 period 根K棒(不含當根)的最高值，等同 RollingHighest(getattr(data, column)(-1), period)。
+    """
+    return _cached(
+        data,
+        ("highest_prev", column, period),
+        lambda: RollingHighest(getattr(data, column)(-1), period=period),
+    )
+
+
+def lowest_prev(data, period, column="low"):
+    """
+    前 period 根K棒(不含當根)的最低值，等同 RollingLowest(getattr(data, column)(-1), period)。
+    """
+    return _cached(
+        data,
+        ("lowest_prev", column, period),
+        lambda: RollingLowest(getattr(data, column)(-1), period=period),
+    )
@@ -0,0 +1,256 @@
+# 多行程參數最佳化
+# K線只在主行程放一份到共享記憶體，子行程啟動時附加上去並建立一次資料來源，之後每組參數只傳參數本身，
+# 不像 cerebro.optstrategy 的多行程那樣為每個子行程序列化整份資料。
+# 參數網格中用到的指標也在主行程各算一次並放在同一塊共享記憶體，所有組合共用，指標計算量與網格大小無關。
+# 每組參數完成就立即回傳結果，可顯示進度並寫入 ResultStore；中斷(Ctrl+C)時停止子行程並保留已完成的結果
+import contextlib
+import io
+import itertools
+import multiprocessing
+import signal
+import sys
+import time
+from multiprocessing import shared_memory
+
+import backtrader as bt
+import numpy as np
+import pandas as pd
+
+from Chapter3.utils.bar_cache import TXF_30_PATH, bars_feed, load_txf_bars
+from Chapter3.utils.result_store import data_hash, params_key
+from Chapter3.utils.settlement import add_settlement_columns
+from Chapter3.utils.vector_backtest import BROKER, MarketData
+
+# 子行程附加的共享K線與回測設定，由 _init_worker 設定
+_worker = {}
+
+
+class SharedBars(object):
+    """
+    放在共享記憶體中的K線，欄位與 load_txf_bars(加上結算日欄位)相同，可附帶預先計算的指標。
+    可當作 context manager 使用，結束時釋放共享記憶體。
+
+    Args:
+        df: 以時間為索引、第 0 欄為 Date 的 K 線
+        indicators: 指標鍵值 -> 與 df 等長的陣列，見 Chapter3.utils.indicators
+    """
+
+    def __init__(self, df, indicators=None):
+        indicators = {} if indicators is None else indicators
+        columns = [c for c in df.columns if c != "Date"]
+        keys = list(indicators)
+        dtype = [("Date", "datetime64[ns]")] + [(c, df[c].dtype.str) for c in columns]
+        dtype += [(f"indicator_{i}", "<f8") for i in range(len(keys))]
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=max(1, np.dtype(dtype).itemsize * len(df))
+        )
+        bars = np.ndarray(len(df), dtype=dtype, buffer=self.shm.buf)
+        bars["Date"] = df["Date"].to_numpy(dtype="datetime64[ns]")
+        for c in columns:
+            bars[c] = df[c].to_numpy()
+        for i, key in enumerate(keys):
+            bars[f"indicator_{i}"] = indicators[key]
+        self.spec = (self.shm.name, dtype, len(df), keys)
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def attach_bars(spec):
+    """
+    附加到 SharedBars 的共享記憶體，K線與指標都直接引用共享記憶體，不複製資料。
+
+    Args:
+        spec: SharedBars.spec
+    Returns:
+        Tuple[SharedMemory, pd.DataFrame, dict]: (共享記憶體, K線, 指標鍵值 -> 陣列)，
+            需保留 SharedMemory 物件，K線與指標才能繼續使用
+    """
+    name, dtype, length, keys = spec
+    shm = shared_memory.SharedMemory(name=name)
+    bars = np.ndarray(length, dtype=dtype, buffer=shm.buf)
+    dates = pd.DatetimeIndex(bars["Date"], name="Date")
+    columns = {"Date": dates}
+    columns.update(
+        {c: bars[c] for c in bars.dtype.names[1:] if not c.startswith("indicator_")}
+    )
+    cache = {key: bars[f"indicator_{i}"] for i, key in enumerate(keys)}
+    return shm, pd.DataFrame(columns, index=dates, copy=False), cache
+
+
+def final_value(strat):
+    """
+    預設的評估函數: 回測結束時的帳戶價值。
+    """
+    return {"final_value": strat.broker.getvalue()}
+
+
+def _init_worker(spec, strategy, broker, analyzers, metrics):
+    # 中斷由主行程處理，子行程忽略 Ctrl+C
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    shm, df, cache = attach_bars(spec)
+    _worker.update(
+        shm=shm,
+        df=df,
+        cache=cache,
+        strategy=strategy,
+        broker=broker,
+        analyzers=analyzers,
+        metrics=metrics,
+    )
+
+
+def _run_combo(params):
+    cerebro = bt.Cerebro(stdstats=False)
+    feed = bars_feed(_worker["df"])
+    # 策略以 indicators.sma / highest_prev / lowest_prev 建立指標時會直接取用共享的陣列
+    feed.indicator_cache = _worker["cache"]
+    cerebro.adddata(feed, name="TXF")
+    cerebro.addstrategy(_worker["strategy"], **params)
+    broker = _worker["broker"]
+    cerebro.broker.setcash(broker["cash"])
+    cerebro.broker.setcommission(
+        commission=broker["commission"], margin=broker["margin"], mult=broker["mult"]
+    )
+    for analyzer, kwargs in _worker["analyzers"]:
+        cerebro.addanalyzer(analyzer, **kwargs)
+    # 策略的 log 輸出不回傳主行程
+    with contextlib.redirect_stdout(io.StringIO()):
+        strat = cerebro.run()[0]
+    row = dict(params)
+    row.update(_worker["metrics"](strat))
+    return row
+
+
+def param_grid(**grid):
+    """
+    參數網格的所有組合，順序與 cerebro.optstrategy 相同。
+
+    Returns:
+        List[dict]
+    """
+    names = list(grid)
+    return [
+        dict(zip(names, values))
+        for values in itertools.product(*(grid[name] for name in names))
+    ]
+
+
+def iter_optimize(
+    strategy,
+    combos,
+    data=None,
+    csv_path=TXF_30_PATH,
+    metrics=final_value,
+    analyzers=(),
+    indicators=(),
+    broker=None,
+    processes=None,
+):
+    """
+    以行程池執行參數組合，依完成順序逐筆產生結果。
+
+    Args:
+        strategy: backtrader 策略類別，需可由子行程匯入(定義在模組或受 __main__ 保護的腳本中)
+        combos: 參數組合(dict)的序列，例如 param_grid(...) 的結果
+        data: load_txf_bars 格式且已加上結算日欄位的 K 線，預設讀取 csv_path 的早盤K棒
+        csv_path: data 為 None 時讀取的 K 線 CSV
+        metrics: metrics(strat) 在子行程中回傳評估結果 dict，需為模組層級的函數
+        analyzers: (分析器類別, 參數 dict) 的序列，例如 [(bt.analyzers.PyFolio, {"_name": "pyfolio"})]
+        indicators: 預先計算並共用的指標鍵值，例如 [("sma", "close", 5)]，見 Chapter3.utils.indicators
+        broker: 資金與交易成本設定，預設為 BROKER
+        processes: 子行程數，預設為 CPU 數
+    Yields:
+        dict: 參數加上 metrics 的結果
+    """
+    if data is None:
+        data = add_settlement_columns(load_txf_bars(csv_path))
+    broker = BROKER if broker is None else broker
+    market = MarketData(data)
+    cache = {key: market.indicator(key) for key in dict.fromkeys(indicators)}
+    with SharedBars(data, cache) as shared:
+        pool = multiprocessing.Pool(
+            processes,
+            initializer=_init_worker,
+            initargs=(shared.spec, strategy, broker, list(analyzers), metrics),
+        )
+        try:
+            for row in pool.imap_unordered(_run_combo, combos):
+                yield row
+            pool.close()
+        finally:
+            # 正常結束或中途停止(中斷、generator 被關閉)都要結束子行程後才能釋放共享記憶體
+            pool.terminate()
+            pool.join()
+
+
+def optimize(strategy, combos, progress=True, store=None, **kwargs):
+    """
+    以行程池執行所有參數組合並彙整成 DataFrame，Ctrl+C 中斷時回傳已完成的部分。
+
+    Args:
+        strategy: backtrader 策略類別
+        combos: 參數組合(dict)的序列
+        progress: 是否顯示進度
+        store: ResultStore，每完成一組就寫入；同策略、同資料已完成的組合不會重跑
+        kwargs: 傳給 iter_optimize 的其他參數
+    Returns:
+        pd.DataFrame: 每組參數一列，順序與 combos 相同
+    """
+    combos = list(combos)
+    names = list(combos[0]) if combos else []
+    todo = combos
+    if store is not None:
+        if kwargs.get("data") is None:
+            csv_path = kwargs.pop("csv_path", TXF_30_PATH)
+            kwargs["data"] = add_settlement_columns(load_txf_bars(csv_path))
+        digest = data_hash(kwargs["data"])
+        done = store.completed(strategy.__name__, digest)
+        todo = [c for c in combos if params_key(c) not in done]
+        if progress and len(todo) < len(combos):
+            print(f"資料庫中已有 {len(combos) - len(todo)} 組結果，略過")
+    rows = []
+    start = time.time()
+    try:
+        if todo:
+            for row in iter_optimize(strategy, todo, **kwargs):
+                rows.append(row)
+                if store is not None:
+                    params = {n: row[n] for n in names}
+                    metrics = {k: v for k, v in row.items() if k not in params}
+                    store.add(strategy.__name__, digest, params, metrics)
+                if progress:
+                    elapsed = time.time() - start
+                    remain = elapsed / len(rows) * (len(todo) - len(rows))
+                    sys.stdout.write(
+                        f"\r{len(rows)}/{len(todo)} 組完成，"
+                        f"已用 {elapsed:.0f} 秒，預估剩餘 {remain:.0f} 秒"
+                    )
+                    sys.stdout.flush()
+    except KeyboardInterrupt:
+        print(f"\n已中斷，保留 {len(rows)}/{len(todo)} 組結果")
+    else:
+        if progress and todo:
+            print()
+    if store is not None:
+        # 包含之前執行時已完成的組合
+        stored = store.frame(strategy.__name__, digest)
+        rows = [
+            {k: v for k, v in row.items() if k not in ("strategy", "data_hash")}
+            for row in stored.to_dict("records")
+        ]
+    if not rows:
+        return pd.DataFrame(columns=names or None)
+    # 依原本的參數組合順序排列，不在 combos 中的舊結果不列出
+    order = {params_key(c): i for i, c in enumerate(combos)}
+    rows = [r for r in rows if params_key({n: r[n] for n in names}) in order]
+    rows.sort(key=lambda r: order[params_key({n: r[n] for n in names})])
+    df = pd.DataFrame(rows)
+    return df[names + [c for c in df.columns if c not in names]]
@@ -0,0 +1,330 @@
+# 台指期分K資料轉換成 N 分K
+# 依交易時段(早盤 08:45~13:45、夜盤 15:00~隔日 05:00)切齊K棒，一次向量化處理所有時段，
+# 夜盤跨過午夜的K棒也歸在同一個時段；大型分K檔可以分段讀取，不必一次載入整個檔案
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# 交易時段(開始, 結束)，結束早於開始表示跨過午夜
+SESSIONS = (("08:45", "13:45"), ("15:00", "05:00"))
+
+COLUMNS = ["Open", "High", "Low", "Close", "Volume"]
+
+# 寫出時固定時間格式，避免整段都是午夜的K棒被寫成只有日期
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+_DAY = np.int64(24 * 60 * 60 * 10**9)
+_MINUTE = np.int64(60 * 10**9)
+
+
+def _clock(text):
+    # "HH:MM" -> 當日經過的奈秒數
+    hour, minute = text.split(":")
+    return (int(hour) * 60 + int(minute)) * _MINUTE
+
+
+def bar_labels(index, minutes=30, sessions=SESSIONS):
+    """
+    計算每筆分K所屬 N 分K的時間標籤。
+
+    K棒以時段開始時間為起點、每 minutes 分鐘切一根，標籤為K棒的結束時間(右側標籤、右側封閉)，
+    時段開始時間的分K併入第一根K棒，時段最後一根不足 minutes 分鐘時標籤為時段結束時間。
+    早盤 30 分K的標籤為 09:15、09:45 ... 13:45，夜盤為 15:30、16:00 ... 05:00。
+
+    Args:
+        index: 分K的時間，DatetimeIndex 或可轉換成時間的陣列
+        minutes: K棒的分鐘數
+        sessions: 交易時段
+    Returns:
+        np.ndarray: datetime64[ns] 標籤，不在任何時段內的分K為 NaT
+    """
+    times = pd.DatetimeIndex(index).as_unit("ns").asi8
+    day = times - times % _DAY
+    clock = times - day
+    width = np.int64(minutes) * _MINUTE
+    labels = np.full(len(times), np.iinfo(np.int64).min, dtype=np.int64)
+    for start, end in sessions:
+        start, end = _clock(start), _clock(end)
+        length = (end - start) % _DAY
+        if start <= end:
+            inside = (clock >= start) & (clock <= end)
+            session_start = day + start
+        else:
+            # 跨午夜的時段，午夜後的分K屬於前一天開始的時段
+            late = clock >= start
+            inside = late | (clock <= end)
+            session_start = np.where(late, day, day - _DAY) + start
+        # 剛好在時段開始時間的分K(例如開盤集合競價)併入第一根K棒
+        bins = np.maximum((times - session_start + width - 1) // width, 1)
+        label = session_start + bins * width
+        label = np.minimum(label, session_start + length)
+        labels = np.where(inside, label, labels)
+    return labels.view("datetime64[ns]")
+
+
+def _as_minute_bars(data):
+    # 以時間為索引的分K資料，接受 Date 欄位或 DatetimeIndex
+    if not isinstance(data.index, pd.DatetimeIndex):
+        data = data.set_index(pd.DatetimeIndex(pd.to_datetime(data["Date"])))
+    data = data[COLUMNS]
+    if not data.index.is_monotonic_increasing:
+        data = data.sort_index(kind="stable")
+    return data
+
+
+def _aggregate(data, labels):
+    # 已依時間排序的分K，同一標籤的分K必定相鄰，以 reduceat 一次彙總所有K棒
+    # 逐欄取出陣列，Volume 保留原本的整數型別，不隨價格一起轉成浮點數
+    keep = ~np.isnat(labels)
+    values = {c: data[c].to_numpy()[keep] for c in COLUMNS}
+    labels = labels[keep]
+    if not len(labels):
+        return pd.DataFrame(columns=COLUMNS, index=pd.DatetimeIndex([], name="Date"))
+    starts = np.flatnonzero(np.r_[True, labels[1:] != labels[:-1]])
+    ends = np.r_[starts[1:], len(labels)] - 1
+    bars = pd.DataFrame(
+        {
+            # 與既有 TXF_30.csv 相同，價格存成浮點數
+            "Open": values["Open"][starts].astype(np.float64),
+            "High": np.maximum.reduceat(values["High"], starts).astype(np.float64),
+            "Low": np.minimum.reduceat(values["Low"], starts).astype(np.float64),
+            "Close": values["Close"][ends].astype(np.float64),
+            "Volume": np.add.reduceat(values["Volume"], starts),
+        },
+        index=pd.DatetimeIndex(labels[starts], name="Date"),
+    )
+    return bars
+
+
+def resample_sessions(data, minutes=30, sessions=SESSIONS):
+    """
+    把分K轉換成依交易時段切齊的 N 分K。
+
+    Args:
+        data: 分K資料，含 Open/High/Low/Close/Volume 欄位，以及 Date 欄位或 DatetimeIndex
+        minutes: K棒的分鐘數
+        sessions: 交易時段
+    Returns:
+        pd.DataFrame: 以K棒結束時間(Date)為索引的 N 分K
+    """
+    data = _as_minute_bars(data)
+    labels = bar_labels(data.index, minutes, sessions)
+    return _aggregate(data, labels)
+
+
+def iter_resample_csv(path, minutes=30, sessions=SESSIONS, chunksize=500_000):
+    """
+    分段讀取分K的 CSV 並逐段產出 N 分K，記憶體用量只與 chunksize 有關。
+    每段最後一根K棒可能還有分K在下一段，會留到下一段一起計算，因此產出的K棒都是完整的。
+
+    Args:
+        path: 分K檔案路徑，檔案需依時間排序
+        minutes: K棒的分鐘數
+        sessions: 交易時段
+        chunksize: 每段讀取的分K筆數
+    Yields:
+        pd.DataFrame: 各段完成的 N 分K
+    """
+    carry = None
+    for chunk in pd.read_csv(path, chunksize=chunksize):
+        chunk = _as_minute_bars(chunk)
+        if carry is not None:
+            chunk = pd.concat([carry, chunk])
+        labels = bar_labels(chunk.index, minutes, sessions)
+        valid = np.flatnonzero(~np.isnat(labels))
+        if not len(valid):
+            carry = None
+            continue
+        # 最後一個標籤的分K保留到下一段
+        tail = labels == labels[valid[-1]]
+        carry = chunk[tail]
+        done = ~tail
+        yield _aggregate(chunk[done], labels[done])
+    if carry is not None and len(carry):
+        yield resample_sessions(carry, minutes, sessions)
+
+
+def resample_csv(path, out_path=None, minutes=30, sessions=SESSIONS, chunksize=500_000):
+    """
+    把分K的 CSV 轉換成 N 分K，例如由 TXF.csv 產生 TXF_30.csv。
+
+    Args:
+        path: 分K檔案路徑
+        out_path: 指定時逐段寫入 CSV，不在記憶體中保留完整結果
+        minutes, sessions, chunksize: 見 iter_resample_csv
+    Returns:
+        pd.DataFrame 或 str: 未指定 out_path 時回傳 N 分K，否則回傳 out_path
+    """
+    parts = iter_resample_csv(path, minutes, sessions, chunksize)
+    if out_path is None:
+        return pd.concat(list(parts))
+    for i, bars in enumerate(parts):
+        bars.to_csv(
+            out_path, mode="w" if i == 0 else "a", header=i == 0, date_format=DATE_FORMAT
+        )
+    return out_path
+
+
+class BarAggregator(object):
+    """
+    逐次加入新的分K並更新 N 分K，每次只處理新資料，不必重新轉換整個分K檔。
+
+    保留最後一根K棒(可能尚未完成)與最後處理的分K時間，新資料與最後一根K棒同一標籤時合併，
+    早於最後處理時間的分K視為重複資料略過。狀態可存成 JSON，下次更新時接續使用。
+
+    Args:
+        minutes: K棒的分鐘數
+        sessions: 交易時段
+    """
+
+    def __init__(self, minutes=30, sessions=SESSIONS):
+        self.minutes = minutes
+        self.sessions = tuple(tuple(s) for s in sessions)
+        # 最後處理的分K時間與最後一根K棒
+        self.last_time = None
+        self.last_bar = None
+
+    def update(self, data):
+        """
+        加入新的分K。
+
+        Args:
+            data: 分K資料，格式同 resample_sessions
+        Returns:
+            pd.DataFrame: 新增或有變動的 N 分K；第一根可能是先前最後一根K棒的更新
+        """
+        data = _as_minute_bars(data)
+        if self.last_time is not None:
+            data = data[data.index > self.last_time]
+        bars = resample_sessions(data, self.minutes, self.sessions)
+        if not len(data):
+            return bars
+        self.last_time = data.index[-1]
+        if not len(bars):
+            return bars
+        last = self.last_bar
+        if last is not None and bars.index[0] == last["Date"]:
+            # 接續先前未完成的K棒，逐欄更新以保留各欄位的型別
+            first = bars.index[0]
+            bars.loc[first, "Open"] = last["Open"]
+            bars.loc[first, "High"] = max(bars.loc[first, "High"], last["High"])
+            bars.loc[first, "Low"] = min(bars.loc[first, "Low"], last["Low"])
+            bars.loc[first, "Volume"] += last["Volume"]
+        self.last_bar = dict(
+            {"Date": bars.index[-1]}, **{c: bars[c].iloc[-1].item() for c in COLUMNS}
+        )
+        return bars
+
+    def state(self):
+        last = None
+        if self.last_bar is not None:
+            last = dict(self.last_bar, Date=str(self.last_bar["Date"]))
+        return {
+            "minutes": self.minutes,
+            "sessions": [list(s) for s in self.sessions],
+            "last_time": None if self.last_time is None else str(self.last_time),
+            "last_bar": last,
+        }
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.state(), f, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            state = json.load(f)
+        agg = cls(state["minutes"], state["sessions"])
+        if state["last_time"] is not None:
+            agg.last_time = pd.Timestamp(state["last_time"])
+        if state["last_bar"] is not None:
+            agg.last_bar = dict(
+                state["last_bar"], Date=pd.Timestamp(state["last_bar"]["Date"])
+            )
+        return agg
+
+
+def _last_line(path):
+    # 回傳 CSV 最後一行的起始位置與內容，只讀取檔案結尾
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        pos = end
+        block = b""
+        while pos > 0:
+            step = min(4096, pos)
+            pos -= step
+            f.seek(pos)
+            block = f.read(step) + block
+            lines = block.rstrip(b"\r\n")
+            cut = lines.rfind(b"\n")
+            if cut >= 0:
+                return pos + cut + 1, lines[cut + 1 :].decode()
+        lines = block.rstrip(b"\r\n")
+        return 0, lines.decode()
+
+
+def write_bars(path, bars):
+    """
+    把 BarAggregator.update 的結果寫入 N 分K的 CSV。
+    第一根與檔案最後一根同一時間時覆寫最後一行，其餘附加在檔案結尾。
+    """
+    if not len(bars):
+        return
+    if not os.path.isfile(path) or os.path.getsize(path) == 0:
+        bars.to_csv(path, date_format=DATE_FORMAT)
+        return
+    offset, line = _last_line(path)
+    if line.split(",", 1)[0] == bars.index[0].strftime(DATE_FORMAT):
+        with open(path, "r+b") as f:
+            f.truncate(offset)
+    bars.to_csv(path, mode="a", header=False, date_format=DATE_FORMAT)
+
+
+def rebuild_store(
+    minute_path, store_path, minutes=30, sessions=SESSIONS, state_path=None, chunksize=500_000
+):
+    """
+    由完整的分K檔重新建立 N 分K的 CSV 與狀態檔，之後可用 update_store 逐次更新。
+    分K檔分段讀取，不會一次載入。
+
+    Args:
+        minute_path: 分K檔案路徑，需依時間排序
+        store_path: N 分K的 CSV 路徑，已存在時會覆寫
+        minutes, sessions: 見 resample_sessions
+        state_path: 狀態檔路徑，預設為 {store_path}.state.json
+        chunksize: 每段讀取的分K筆數
+    """
+    state_path = state_path or f"{store_path}.state.json"
+    agg = BarAggregator(minutes, sessions)
+    with open(store_path, "w"):
+        pass
+    for chunk in pd.read_csv(minute_path, chunksize=chunksize):
+        write_bars(store_path, agg.update(chunk))
+    agg.save(state_path)
+    return agg
+
+
+def update_store(data, store_path, state_path=None):
+    """
+    以新的分K更新 N 分K的 CSV(例如 TXF_30.csv)，只處理新資料。
+
+    Args:
+        data: 新的分K資料或分K檔案路徑
+        store_path: N 分K的 CSV 路徑
+        state_path: rebuild_store 建立的狀態檔路徑，預設為 {store_path}.state.json
+    Returns:
+        pd.DataFrame: 本次新增或更新的 N 分K
+    """
+    state_path = state_path or f"{store_path}.state.json"
+    if not os.path.isfile(state_path):
+        raise FileNotFoundError(f"找不到狀態檔 {state_path}，請先以 rebuild_store 建立")
+    agg = BarAggregator.load(state_path)
+    if isinstance(data, str):
+        data = pd.read_csv(data)
+    bars = agg.update(data)
+    write_bars(store_path, bars)
+    agg.save(state_path)
+    return bars
@@ -0,0 +1,156 @@
+# 參數最佳化結果資料庫
+# 每完成一組參數就寫入本機 SQLite，以 (策略, 參數, 資料雜湊) 為鍵值；
+# 中途中斷後重新執行只跑尚未完成的組合，Excel / CSV 只是匯出格式
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+
+def data_hash(df):
+    """
+    K 線內容的雜湊值，資料有任何改變(多一根K棒、價格修正)時結果就不會被沿用。
+
+    Args:
+        df: K 線 DataFrame
+    Returns:
+        str: 16 個字元的十六進位字串
+    """
+    h = hashlib.sha1()
+    h.update(np.asarray(df.index, dtype="datetime64[ns]").tobytes())
+    for c in df.columns:
+        h.update(c.encode())
+        values = df[c].to_numpy()
+        if values.dtype.kind == "M":
+            values = values.astype("datetime64[ns]")
+        h.update(np.ascontiguousarray(values).tobytes())
+    return h.hexdigest()[:16]
+
+
+def params_key(params):
+    """
+    參數組合轉成固定順序的 JSON 字串，作為資料庫鍵值。
+    """
+    return json.dumps(params, sort_keys=True)
+
+
+class ResultStore(object):
+    """
+    以 SQLite 保存的最佳化結果。
+
+    Args:
+        path: 資料庫檔案路徑，不存在時會建立
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        # WAL 模式下每筆寫入都能立即提交，中斷時已完成的結果不會遺失
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS results (
+                strategy TEXT NOT NULL,
+                params TEXT NOT NULL,
+                data_hash TEXT NOT NULL,
+                metrics TEXT NOT NULL,
+                created REAL NOT NULL,
+                PRIMARY KEY (strategy, params, data_hash)
+            )
+            """
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def completed(self, strategy, data_hash):
+        """
+        已完成的參數組合。
+
+        Returns:
+            set: params_key 字串
+        """
+        rows = self.conn.execute(
+            "SELECT params FROM results WHERE strategy = ? AND data_hash = ?",
+            (strategy, data_hash),
+        )
+        return {params for params, in rows}
+
+    def add(self, strategy, data_hash, params, metrics):
+        """
+        寫入一組參數的結果，已存在時覆蓋。
+
+        Args:
+            strategy: 策略名稱
+            data_hash: data_hash() 的結果
+            params: 參數 dict
+            metrics: 評估結果 dict，值需可轉成 JSON
+        """
+        self.conn.execute(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+            (
+                strategy,
+                params_key(params),
+                data_hash,
+                json.dumps({k: _plain(v) for k, v in metrics.items()}),
+                time.time(),
+            ),
+        )
+        self.conn.commit()
+
+    def frame(self, strategy=None, data_hash=None):
+        """
+        讀出結果，每組參數一列，欄位為參數與評估結果。
+
+        Args:
+            strategy, data_hash: 篩選條件，None 表示不限
+        Returns:
+            pd.DataFrame: 另有 strategy、data_hash 兩欄
+        """
+        query = "SELECT strategy, params, data_hash, metrics FROM results"
+        where, args = [], []
+        for column, value in (("strategy", strategy), ("data_hash", data_hash)):
+            if value is not None:
+                where.append(f"{column} = ?")
+                args.append(value)
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        rows = []
+        for name, params, digest, metrics in self.conn.execute(query + " ORDER BY rowid", args):
+            row = {"strategy": name, "data_hash": digest}
+            row.update(json.loads(params))
+            row.update(json.loads(metrics))
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+    def export(self, path, strategy=None, data_hash=None):
+        """
+        匯出成 Excel(.xlsx) 或 CSV(其他副檔名)。
+
+        Returns:
+            pd.DataFrame: 匯出的結果
+        """
+        df = self.frame(strategy, data_hash)
+        if os.path.splitext(path)[1].lower() == ".xlsx":
+            df.to_excel(path, index=False)
+        else:
+            df.to_csv(path, index=False)
+        return df
+
+
+def _plain(value):
+    # numpy 數值轉成 Python 型別，NaN / inf 以 JSON 的 NaN / Infinity 保存
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
@@ -0,0 +1,120 @@
+# 台指期結算日曆
+# 台指期在每月第三個星期三結算，遇到休市則順延至下一個交易日。
+# 整段資料只計算一次，結果以 is_settlement_day / minutes_to_settlement 兩個欄位加到K線上，
+# 策略每根K棒只需讀取欄位，不必重新計算日期
+import backtrader as bt
+import numpy as np
+import pandas as pd
+
+# 結算日最後交易時間
+SETTLEMENT_TIME = "13:30"
+
+
+def third_wednesdays(months):
+    """
+    每個月的第三個星期三。
+
+    Args:
+        months: 月份，可轉換成 datetime64[M] 的陣列
+    Returns:
+        np.ndarray: datetime64[D]
+    """
+    first = np.asarray(months, dtype="datetime64[M]").astype("datetime64[D]")
+    # 1970-01-01 是星期四，換算成星期一為 0 的星期
+    weekday = (first.astype(np.int64) + 3) % 7
+    return first + (14 + (2 - weekday) % 7)
+
+
+def _roll_forward(day, holidays):
+    # 遇到週末或休市日順延至下一個營業日
+    holidays = np.asarray([] if holidays is None else holidays, dtype="datetime64[D]")
+    while np.isin(day, holidays) or not np.is_busday(day):
+        day += 1
+    return day
+
+
+def settlement_days(trading_dates, holidays=None):
+    """
+    依交易日計算各月實際結算日: 第三個星期三，若當天不是交易日則順延至下一個交易日。
+
+    Args:
+        trading_dates: 有交易的日期，例如K線資料中出現過的日期
+        holidays: 額外指定的休市日，資料未涵蓋的結算日以此與週末判斷是否順延
+    Returns:
+        np.ndarray: 各月結算日(datetime64[D])，依時間排序
+    """
+    days = np.unique(np.asarray(trading_dates, dtype="datetime64[D]"))
+    if not len(days):
+        return days
+    first, last = days[0].astype("datetime64[M]"), days[-1].astype("datetime64[M]")
+    nominal = third_wednesdays(np.arange(first, last + 1))
+    # 資料開始前已經結算的月份不列入，否則會被順延到第一個交易日
+    nominal = nominal[nominal >= days[0]]
+    # 資料範圍內以實際有交易的日期順延
+    pos = np.searchsorted(days, nominal)
+    covered = pos < len(days)
+    actual = nominal.copy()
+    actual[covered] = days[pos[covered]]
+    for i in np.flatnonzero(~covered):
+        actual[i] = _roll_forward(actual[i], holidays)
+    return actual
+
+
+def settlement_columns(dates, trading_dates=None, holidays=None, time=SETTLEMENT_TIME):
+    """
+    計算每根K棒的結算日欄位。
+
+    Args:
+        dates: K棒時間
+        trading_dates: 交易日，預設為 dates 中出現過的日期
+        holidays: 見 settlement_days
+        time: 結算日最後交易時間
+    Returns:
+        pd.DataFrame: is_settlement_day(K棒日期為結算日時為 1)與
+            minutes_to_settlement(距離下一次結算時間的分鐘數，已過當月結算時間則計算到下個月)
+    """
+    times = pd.DatetimeIndex(dates).values.astype("datetime64[ns]")
+    if trading_dates is None:
+        trading_dates = times
+    settle = settlement_days(trading_dates, holidays)
+    # 多算下一個月，最後一次結算之後的K棒也有下一次結算時間；
+    # 資料只有當月結算日之後的幾天時 settle 為空，下一次結算在下個月
+    if len(settle):
+        last = settle[-1:]
+    else:
+        last = np.asarray(trading_dates, dtype="datetime64[D]").max(keepdims=True)
+    following = third_wednesdays(last.astype("datetime64[M]") + 1)
+    settle = np.r_[settle, _roll_forward(following[0], holidays)]
+    hour, minute = (int(v) for v in time.split(":"))
+    settle_at = settle.astype("datetime64[ns]") + np.timedelta64(hour * 60 + minute, "m")
+    nxt = np.minimum(np.searchsorted(settle_at, times), len(settle_at) - 1)
+    return pd.DataFrame(
+        {
+            "is_settlement_day": np.isin(times.astype("datetime64[D]"), settle).astype(
+                np.float64
+            ),
+            "minutes_to_settlement": (settle_at[nxt] - times) / np.timedelta64(1, "m"),
+        },
+        index=pd.DatetimeIndex(dates),
+    )
+
+
+def add_settlement_columns(df, holidays=None, time=SETTLEMENT_TIME):
+    """
+    在以時間為索引的K線資料後面加上 is_settlement_day / minutes_to_settlement 欄位。
+    """
+    cols = settlement_columns(df.index, holidays=holidays, time=time)
+    df = df.copy()
+    df["is_settlement_day"] = cols["is_settlement_day"].values
+    df["minutes_to_settlement"] = cols["minutes_to_settlement"].values
+    return df
+
+
+class SettlementPandasData(bt.feeds.PandasData):
+    """
+    多了 is_settlement_day / minutes_to_settlement 兩條線的 PandasData，
+    資料需先以 add_settlement_columns 加上欄位。
+    """
+
+    lines = ("is_settlement_day", "minutes_to_settlement")
+    params = (("is_settlement_day", -1), ("minutes_to_settlement", -1))
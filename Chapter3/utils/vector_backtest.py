@@ -0,0 +1,503 @@
+# 向量化回測引擎
+# 指標與進出場條件以 NumPy 陣列一次算完，持倉只在進場/出場的K棒之間跳躍，
+# 一組參數只需數毫秒。撮合規則與 backtrader 預設的 BackBroker 相同:
+# 市價單於下一根K棒開盤成交、期貨保證金與每口固定手續費、逐K棒以收盤價計算權益
+import contextlib
+import io
+import itertools
+import math
+
+import backtrader as bt
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from Chapter2.utils.kernels import rolling_extrema
+from Chapter3.utils.bar_cache import TXF_30_PATH, load_txf_bars, txf_feed
+from Chapter3.utils.settlement import settlement_columns
+
+# 與 Chapter3 腳本相同的資金與交易成本設定
+BROKER = {"cash": 300000.0, "commission": 200.0, "margin": 167000.0, "mult": 200.0}
+
+# 已平倉交易: 進場/出場成交的K棒位置、口數(多單為正)、成交價與損益
+TRADE_DTYPE = [
+    ("entry", np.int64),
+    ("exit", np.int64),
+    ("size", np.int64),
+    ("entry_price", np.float64),
+    ("exit_price", np.float64),
+    ("pnl", np.float64),
+    ("pnlcomm", np.float64),
+]
+
+
+def _window_sum(values, period):
+    # 整數資料以累積和相減即為精確值，與 backtrader 的 math.fsum 相同；否則逐窗 fsum
+    if np.all(np.mod(values, 1) == 0) and np.abs(values).sum() < 2**53:
+        total = np.cumsum(np.r_[0.0, values])
+        return total[period:] - total[:-period]
+    return np.array([math.fsum(w) for w in sliding_window_view(values, period)])
+
+
+class MarketData(object):
+    """
+    回測用的K線陣列，指標依 (欄位, 期數) 快取，同一份資料跑多組參數時只計算一次。
+
+    Args:
+        df: 以時間為索引、含 Open/High/Low/Close/Volume 欄位的 K 線
+    """
+
+    def __init__(self, df):
+        self.dates = pd.DatetimeIndex(df.index)
+        self.open = df["Open"].to_numpy(dtype=np.float64)
+        self.high = df["High"].to_numpy(dtype=np.float64)
+        self.low = df["Low"].to_numpy(dtype=np.float64)
+        self.close = df["Close"].to_numpy(dtype=np.float64)
+        self.volume = df["Volume"].to_numpy(dtype=np.float64)
+        # 結算日 13:00 之後的K棒: 有持倉就平倉，不再進場
+        settle = settlement_columns(self.dates)["is_settlement_day"].to_numpy()
+        self.settle_close = (settle != 0) & (self.dates.hour >= 13)
+        self._cache = {}
+        self._source = None
+
+    @classmethod
+    def from_csv(cls, csv_path=TXF_30_PATH, session="day"):
+        return cls(load_txf_bars(csv_path, session))
+
+    def __len__(self):
+        return len(self.close)
+
+    def window(self, start, stop):
+        """
+        第 start 到 stop - 1 根K棒的子資料。指標取自完整資料的快取再切片，
+        重疊的區間不會重算，區間開頭也不必重新暖身。
+
+        Returns:
+            MarketData
+        """
+        child = MarketData.__new__(MarketData)
+        for name in ("dates", "open", "high", "low", "close", "volume", "settle_close"):
+            setattr(child, name, getattr(self, name)[start:stop])
+        child._cache = {}
+        child._source = (self, start, stop)
+        return child
+
+    def _memo(self, key, compute):
+        # compute(data) 以 data 的完整欄位計算指標；子資料改向來源資料取值後切片
+        if key not in self._cache:
+            if self._source is None:
+                self._cache[key] = compute(self)
+            else:
+                source, start, stop = self._source
+                self._cache[key] = source._memo(key, compute)[start:stop]
+        return self._cache[key]
+
+    def sma(self, column, period):
+        """
+        簡單移動平均，與 bt.indicators.SMA 的值相同，前 period - 1 根為 NaN。
+
+        Args:
+            column: "close"、"volume" 等欄位屬性名稱
+            period: 期數
+        Returns:
+            np.ndarray
+        """
+
+        def compute(data):
+            values = getattr(data, column)
+            out = np.full(len(values), np.nan)
+            if len(values) >= period:
+                out[period - 1 :] = _window_sum(values, period) / period
+            return out
+
+        return self._memo(("sma", column, period), compute)
+
+    def rolling_prev(self, column, period, kind):
+        """
+        前 period 根K棒(不含當根)的最大或最小值，
+        與 RollingHighest(data(-1)) / RollingLowest(data(-1)) 的值相同，前 period 根為 NaN。
+
+        Args:
+            column: "high"、"low" 等欄位屬性名稱
+            period: 回溯週期長度
+            kind: "max" 或 "min"
+        Returns:
+            np.ndarray
+        """
+
+        def compute(data):
+            prev = np.r_[np.nan, getattr(data, column)[:-1]]
+            return rolling_extrema(prev, period, kind)[0]
+
+        return self._memo(("prev", column, period, kind), compute)
+
+    def channel(self, period):
+        """
+        前 period 根K棒的通道上下軌。
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: (highest_prev, lowest_prev)
+        """
+        return (
+            self.rolling_prev("high", period, "max"),
+            self.rolling_prev("low", period, "min"),
+        )
+
+    def indicator(self, key):
+        """
+        依 Chapter3.utils.indicators 的指標鍵值計算指標陣列。
+
+        Args:
+            key: ("sma", 欄位, 期數)、("highest_prev", 欄位, 期數) 或 ("lowest_prev", 欄位, 期數)
+        Returns:
+            np.ndarray
+        """
+        kind, column, period = key
+        if kind == "sma":
+            return self.sma(column, period)
+        if kind == "highest_prev":
+            return self.rolling_prev(column, period, "max")
+        if kind == "lowest_prev":
+            return self.rolling_prev(column, period, "min")
+        raise ValueError(f"不支援的指標 {kind}")
+
+
+class BacktestResult(object):
+    """
+    向量化回測的結果。
+
+    Attributes:
+        trades: TRADE_DTYPE 的結構化陣列，只含已平倉的交易
+        equity: 每根K棒收盤後的帳戶價值(broker.getvalue())
+        position: 每根K棒收盤後的持倉口數
+    """
+
+    def __init__(self, data, trades, equity, position, cash):
+        self.data = data
+        self.trades = trades
+        self.equity = equity
+        self.position = position
+        self.cash = cash
+
+    @property
+    def final_value(self):
+        return float(self.equity[-1]) if len(self.equity) else self.cash
+
+    def trade_frame(self):
+        """
+        已平倉交易的 DataFrame，進出場位置換成成交K棒的時間。
+        """
+        df = pd.DataFrame(self.trades)
+        df.insert(0, "dtopen", self.data.dates[self.trades["entry"]])
+        df.insert(1, "dtclose", self.data.dates[self.trades["exit"]])
+        return df.drop(columns=["entry", "exit"])
+
+    def daily_returns(self):
+        """
+        日報酬率，與 PyFolio 分析器 get_pf_items() 的 returns 相同:
+        每天最後一根K棒的價值相對前一天，第一天相對初始資金。
+        """
+        equity = pd.Series(self.equity, index=self.data.dates)
+        daily = equity.groupby(equity.index.normalize()).last()
+        return daily / daily.shift(1).fillna(self.cash) - 1
+
+    def metrics(self):
+        """
+        以日報酬計算的績效，算法與 empyrical 的 cum_returns_final / sharpe_ratio / max_drawdown 相同。
+
+        Returns:
+            dict: 與 analyzers.StreamingMetrics 相同的欄位，另加 final_value
+        """
+        returns = self.daily_returns().to_numpy()
+        std = np.std(returns, ddof=1) if len(returns) > 1 else np.nan
+        sharpe = np.mean(returns) / std * np.sqrt(252) if std > 0 else np.nan
+        # 回撤以初始資金為起點
+        wealth = np.r_[1.0, np.cumprod(1 + returns)]
+        trades = len(self.trades)
+        return {
+            "cum_return": wealth[-1] - 1,
+            "annual_volatility": std * np.sqrt(252),
+            "sharpe_ratio": sharpe,
+            "max_drawdown": np.min(wealth / np.maximum.accumulate(wealth) - 1),
+            "trades": trades,
+            "win_rate": np.mean(self.trades["pnlcomm"] > 0) if trades else np.nan,
+            "final_value": self.final_value,
+        }
+
+
+def _first_valid(*arrays):
+    # 所有指標都有值的第一根K棒，即 backtrader 策略第一次執行 next 的位置
+    valid = np.flatnonzero(np.logical_and.reduce([np.isfinite(a) for a in arrays]))
+    return int(valid[0]) if len(valid) else len(arrays[0])
+
+
+def _first_true(condition, start, n, block=64):
+    # 由 start 開始找第一個條件成立的位置，每次檢查一段並加倍段長，持倉短時不必算到資料結尾
+    while start < n:
+        stop = min(n, start + block)
+        hit = np.flatnonzero(condition(start, stop))
+        if len(hit):
+            return start + int(hit[0])
+        start, block = stop, block * 2
+    return -1
+
+
+def simulate(data, start, long_entry, short_entry, find_exit, broker=None):
+    """
+    依進場訊號與出場規則模擬單一口數的交易，撮合方式與 backtrader 相同:
+    第 i 根K棒收盤後下的市價單在第 i + 1 根開盤成交，成交當根即開始檢查出場，
+    出場單成交的那一根就能再次判斷進場；可用資金不足保證金加手續費時進場單被拒絕。
+
+    Args:
+        data: MarketData
+        start: 策略第一次執行 next 的K棒位置(指標暖身期之後)
+        long_entry, short_entry: 每根K棒是否符合多/空進場條件的布林陣列，同時成立時做多
+        find_exit: find_exit(size, price, j) 回傳第 j 根(含)之後第一個送出平倉單的K棒位置，沒有則為 -1
+        broker: 資金與交易成本設定，預設為 BROKER
+    Returns:
+        BacktestResult
+    """
+    broker = BROKER if broker is None else broker
+    cash, comm = broker["cash"], broker["commission"]
+    margin, mult = broker["margin"], broker["mult"]
+    n = len(data)
+    candidates = np.flatnonzero((long_entry | short_entry) & ~data.settle_close)
+    candidates = candidates[candidates >= start]
+
+    trades = []
+    realized = cash
+    holding = None
+    i = start
+    while True:
+        k = np.searchsorted(candidates, i)
+        # 最後一根K棒送出的單不會成交
+        if k == len(candidates) or candidates[k] >= n - 1:
+            break
+        i = int(candidates[k])
+        if realized - margin - comm < 0:
+            i += 1
+            continue
+        size = 1 if long_entry[i] else -1
+        j = i + 1
+        price = data.open[j]
+        x = find_exit(size, price, j)
+        if x < 0 or x >= n - 1:
+            holding = (j, size, price)
+            break
+        exit_price = data.open[x + 1]
+        pnl = (exit_price - price) * size * mult
+        realized += pnl - 2 * comm
+        trades.append((j, x + 1, size, price, exit_price, pnl, pnl - 2 * comm))
+        i = x + 1
+
+    trades = np.array(trades, dtype=TRADE_DTYPE)
+    position = np.zeros(n, dtype=np.int64)
+    entry_price = np.zeros(n)
+    booked = np.zeros(n)
+    for t in trades:
+        position[t["entry"] : t["exit"]] = t["size"]
+        entry_price[t["entry"] : t["exit"]] = t["entry_price"]
+    np.add.at(booked, trades["exit"], trades["pnlcomm"])
+    if holding is not None:
+        j, size, price = holding
+        position[j:] = size
+        entry_price[j:] = price
+    # 帳戶價值 = 初始資金 + 已實現損益 + 持倉未實現損益 - 持倉進場手續費
+    open_pnl = position * (data.close - entry_price) * mult - comm * (position != 0)
+    equity = cash + np.cumsum(booked) + open_pnl
+    return BacktestResult(data, trades, equity, position, cash)
+
+
+def run_ma_volume(
+    data,
+    ma_short=5,
+    ma_medium=20,
+    ma_long=60,
+    stop_loss_pct=0.02,
+    take_profit_pct=0.02,
+    broker=None,
+):
+    """
+    MA_Volume_Strategy 的向量化版本: 收盤價同時在三條均線之上且短期均量大於長期均量時做多，
+    反之做空；收盤價達停利或停損價時平倉，結算日 13:00 之後平倉且不再進場。
+
+    Args:
+        data: MarketData
+        其餘參數與 MA_Volume_Strategy 相同
+    Returns:
+        BacktestResult
+    """
+    close = data.close
+    ma_s, ma_m, ma_l = (data.sma("close", p) for p in (ma_short, ma_medium, ma_long))
+    vol_s, vol_l = data.sma("volume", ma_short), data.sma("volume", ma_long)
+    with np.errstate(invalid="ignore"):
+        long_entry = (close > ma_s) & (close > ma_m) & (close > ma_l) & (vol_s > vol_l)
+        short_entry = (close < ma_s) & (close < ma_m) & (close < ma_l) & (vol_s < vol_l)
+    settle_close = data.settle_close
+
+    def find_exit(size, price, j):
+        # 與策略相同的算式，停利停損價的浮點數結果才會一致
+        if size > 0:
+            take_profit = price * (1 + take_profit_pct)
+            stop_loss = price * (1 - stop_loss_pct)
+            return _first_true(
+                lambda a, b: settle_close[a:b]
+                | (close[a:b] >= take_profit)
+                | (close[a:b] <= stop_loss),
+                j,
+                len(close),
+            )
+        take_profit = price * (1 - take_profit_pct)
+        stop_loss = price * (1 + stop_loss_pct)
+        return _first_true(
+            lambda a, b: settle_close[a:b]
+            | (close[a:b] <= take_profit)
+            | (close[a:b] >= stop_loss),
+            j,
+            len(close),
+        )
+
+    start = _first_valid(ma_s, ma_m, ma_l, vol_s, vol_l)
+    return simulate(data, start, long_entry, short_entry, find_exit, broker)
+
+
+def run_high_low(data, period=18, stop_loss_pct=0.02, exit_pct=0.02, broker=None):
+    """
+    High_Low_Strategy 的向量化版本: 最高價突破前 period 根的通道上軌時做多、最低價跌破下軌時做空。
+    多單在收盤價 >= 下軌 + 收盤價 * exit_pct 時出場，收盤價 <= 進場價 - 收盤價 * stop_loss_pct 時停損；
+    空單在最低價 <= 上軌 - 收盤價 * exit_pct 時出場，收盤價 >= 進場價 + 收盤價 * stop_loss_pct 時停損；
+    結算日 13:00 之後平倉且不再進場。
+
+    Args:
+        data: MarketData，通道陣列依 period 快取，同一 period 的所有組合共用
+        其餘參數與 High_Low_Strategy 相同
+    Returns:
+        BacktestResult
+    """
+    close, low = data.close, data.low
+    highest_prev, lowest_prev = data.channel(period)
+    with np.errstate(invalid="ignore"):
+        long_entry = data.high > highest_prev
+        short_entry = low < lowest_prev
+    settle_close = data.settle_close
+    long_exit = lowest_prev + close * exit_pct
+    short_exit = highest_prev - close * exit_pct
+    stop_offset = close * stop_loss_pct
+
+    def find_exit(size, price, j):
+        if size > 0:
+            return _first_true(
+                lambda a, b: settle_close[a:b]
+                | (close[a:b] >= long_exit[a:b])
+                | (close[a:b] <= price - stop_offset[a:b]),
+                j,
+                len(close),
+            )
+        return _first_true(
+            lambda a, b: settle_close[a:b]
+            | (low[a:b] <= short_exit[a:b])
+            | (close[a:b] >= price + stop_offset[a:b]),
+            j,
+            len(close),
+        )
+
+    return simulate(data, _first_valid(highest_prev, lowest_prev), long_entry, short_entry, find_exit, broker)
+
+
+def sweep(engine, data, broker=None, **grid):
+    """
+    以向量化引擎跑完參數網格的所有組合，指標依期數快取在 data 上，不會重複計算。
+
+    Args:
+        engine: run_ma_volume、run_high_low 等引擎
+        data: MarketData
+        grid: 參數名稱 -> 候選值，例如 period=[3, 5, 10]
+    Returns:
+        pd.DataFrame: 每組參數一列，附上 BacktestResult.metrics() 的績效
+    """
+    names = list(grid)
+    rows = []
+    for values in itertools.product(*(grid[name] for name in names)):
+        params = dict(zip(names, values))
+        result = engine(data, broker=broker, **params)
+        params.update(result.metrics())
+        rows.append(params)
+    return pd.DataFrame(rows)
+
+
+class _Recorder(bt.Analyzer):
+    # 記錄每根K棒收盤後的帳戶價值與已平倉交易，供驗證比對
+    def start(self):
+        self.values = []
+        self.trades = []
+
+    def next(self):
+        self.values.append(self.strategy.broker.getvalue())
+
+    def notify_trade(self, trade):
+        if trade.isclosed:
+            self.trades.append(
+                {
+                    "dtopen": bt.num2date(trade.dtopen),
+                    "dtclose": bt.num2date(trade.dtclose),
+                    "size": 1 if trade.long else -1,
+                    "entry_price": trade.price,
+                    "pnl": trade.pnl,
+                    "pnlcomm": trade.pnlcomm,
+                }
+            )
+
+
+def run_backtrader(strategy, csv_path=TXF_30_PATH, broker=None, **params):
+    """
+    以 backtrader 執行單一組參數，策略的 log 輸出會被略過。
+
+    Returns:
+        Tuple[pd.DataFrame, np.ndarray]: (已平倉交易, 每根K棒的帳戶價值)
+    """
+    broker = BROKER if broker is None else broker
+    cerebro = bt.Cerebro()
+    cerebro.adddata(txf_feed(csv_path, settlement=True), name="TXF")
+    cerebro.addstrategy(strategy, **params)
+    cerebro.broker.setcash(broker["cash"])
+    cerebro.broker.setcommission(
+        commission=broker["commission"], margin=broker["margin"], mult=broker["mult"]
+    )
+    cerebro.addanalyzer(_Recorder, _name="recorder")
+    with contextlib.redirect_stdout(io.StringIO()):
+        recorder = cerebro.run()[0].analyzers.recorder
+    return pd.DataFrame(recorder.trades), np.array(recorder.values)
+
+
+def validate(strategy, engine, csv_path=TXF_30_PATH, broker=None, **params):
+    """
+    驗證模式: 同一組參數分別以 backtrader 與向量化引擎回測，比對交易與權益曲線。
+
+    Args:
+        strategy: backtrader 策略類別，例如 MA_Volume_Strategy
+        engine: 對應的向量化引擎，例如 run_ma_volume
+        csv_path: K 線 CSV 路徑
+        params: 策略參數
+    Returns:
+        dict: trades 為兩邊交易並列的 DataFrame(_bt / _vec 欄位，matched 表示該筆一致)，
+            equity_diff 為權益曲線最大差異，ok 表示完全一致
+    """
+    bt_trades, bt_equity = run_backtrader(strategy, csv_path, broker, **params)
+    result = engine(MarketData.from_csv(csv_path), broker=broker, **params)
+    vec_trades = result.trade_frame().drop(columns="exit_price")
+    if bt_trades.empty:
+        bt_trades = pd.DataFrame(columns=vec_trades.columns)
+    trades = bt_trades.join(vec_trades, how="outer", lsuffix="_bt", rsuffix="_vec")
+    matched = np.ones(len(trades), dtype=bool)
+    for c in vec_trades.columns:
+        left, right = trades[f"{c}_bt"], trades[f"{c}_vec"]
+        matched &= np.asarray(left == right)
+    trades["matched"] = matched
+    # analyzer 從第一根K棒開始記錄，長度與資料相同
+    equity = result.equity[-len(bt_equity) :] if len(bt_equity) else result.equity[:0]
+    equity_diff = float(np.max(np.abs(equity - bt_equity), initial=0.0))
+    return {
+        "trades": trades,
+        "equity_diff": equity_diff,
+        "ok": bool(matched.all()) and equity_diff < 1e-6,
+    }
@@ -0,0 +1,126 @@
+# 前推(walk-forward)最佳化
+# 把K線切成連續的 訓練 / 測試 區間，每個訓練區間各自找出最佳參數，再到緊接著的測試區間(樣本外)驗證，
+# 最後把所有測試區間的權益曲線接起來，避免以全部資料最佳化後又在同一份資料上回測的過度配適。
+# 各訓練區間以行程池平行最佳化；指標只在完整資料上算一次，各區間取切片共用，總計算量接近一次網格回測
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+from Chapter3.utils.vector_backtest import BROKER
+
+# 子行程共用的資料、引擎與參數網格，由 _init_worker 設定
+_worker = {}
+
+
+def walk_forward_windows(n, train_bars, test_bars, anchored=False):
+    """
+    訓練 / 測試區間的K棒位置。測試區間緊接在訓練區間之後，每次前推一個測試區間，
+    各測試區間首尾相接，最後一個可能較短。
+
+    Args:
+        n: K棒數量
+        train_bars: 訓練區間長度
+        test_bars: 測試區間長度
+        anchored: True 時訓練區間固定從第一根開始，只往後延長
+    Returns:
+        List[Tuple[int, int, int, int]]: (訓練開始, 訓練結束, 測試開始, 測試結束)，結束位置不含
+    """
+    windows = []
+    train_stop = train_bars
+    while train_stop < n:
+        train_start = 0 if anchored else train_stop - train_bars
+        windows.append((train_start, train_stop, train_stop, min(n, train_stop + test_bars)))
+        train_stop += test_bars
+    return windows
+
+
+def _score(result, objective):
+    # 目標值越大越好，NaN(沒有交易、報酬無波動)視為最差
+    value = result.metrics()[objective]
+    return -np.inf if np.isnan(value) else value
+
+
+def _init_worker(data, engine, combos, objective, broker):
+    _worker.update(
+        data=data, engine=engine, combos=combos, objective=objective, broker=broker
+    )
+
+
+def _train(window):
+    # 在訓練區間跑完所有組合，回傳最佳參數與其目標值，同分時取順序在前的組合
+    data = _worker["data"].window(*window)
+    best, best_score = None, -np.inf
+    for params in _worker["combos"]:
+        result = _worker["engine"](data, broker=_worker["broker"], **params)
+        score = _score(result, _worker["objective"])
+        if best is None or score > best_score:
+            best, best_score = params, score
+    return window, best, best_score
+
+
+def walk_forward(
+    engine,
+    data,
+    combos,
+    train_bars,
+    test_bars,
+    anchored=False,
+    objective="sharpe_ratio",
+    broker=None,
+    processes=None,
+):
+    """
+    以向量化引擎做前推最佳化。
+
+    Args:
+        engine: run_ma_volume、run_high_low 等引擎
+        data: MarketData
+        combos: 參數組合(dict)的序列
+        train_bars, test_bars, anchored: 見 walk_forward_windows
+        objective: BacktestResult.metrics() 的欄位，越大越好
+        broker: 資金與交易成本設定，預設為 BROKER
+        processes: 子行程數，預設為 CPU 數
+    Returns:
+        Tuple[pd.DataFrame, pd.Series]: (每個區間一列: 區間時間、選出的參數、訓練目標值與樣本外績效,
+            接起來的樣本外權益曲線)。每個測試區間由空手開始，資金為上一個測試區間結束時的價值，
+            區間結束時仍持有的部位以收盤價計值
+    """
+    combos = list(combos)
+    broker = BROKER if broker is None else broker
+    windows = walk_forward_windows(len(data), train_bars, test_bars, anchored)
+    # 先以一根K棒的子資料跑過每組參數，完整資料的指標全部算好放進快取，子行程直接沿用
+    probe = data.window(0, min(1, len(data)))
+    for params in combos:
+        engine(probe, broker=broker, **params)
+    with multiprocessing.Pool(
+        processes,
+        initializer=_init_worker,
+        initargs=(data, engine, combos, objective, broker),
+    ) as pool:
+        trained = pool.map(_train, [(start, stop) for start, stop, _, _ in windows])
+
+    rows = []
+    curves = []
+    cash = broker["cash"]
+    for (train_start, train_stop, test_start, test_stop), (_, params, score) in zip(
+        windows, trained
+    ):
+        result = engine(
+            data.window(test_start, test_stop), broker=dict(broker, cash=cash), **params
+        )
+        oos = result.metrics()
+        row = {
+            "train_start": data.dates[train_start],
+            "train_end": data.dates[train_stop - 1],
+            "test_start": data.dates[test_start],
+            "test_end": data.dates[test_stop - 1],
+        }
+        row.update(params)
+        row[f"train_{objective}"] = score
+        row.update({f"test_{k}": v for k, v in oos.items()})
+        rows.append(row)
+        curves.append(pd.Series(result.equity, index=result.data.dates))
+        cash = result.final_value
+    equity = pd.concat(curves) if curves else pd.Series(dtype=np.float64)
+    return pd.DataFrame(rows), equity.rename("equity")